@@ -0,0 +1,164 @@
+import struct
+import numpy as np
+
+try:
+    from YBC3D_compact import quantize_points, dequantize_points
+except ImportError:
+    from .YBC3D_compact import quantize_points, dequantize_points
+
+# --- Định dạng nhị phân cho kết quả đường tâm ---
+# Bố cục (little-endian):
+#   [Header 96 byte]
+#     magic 'YBC3' (4s), version (uint16), bytes_per_component (uint8: 2 = int16, 4 = float32, 8 = float64), flags (uint8),
+#     version là phiên bản thấp nhất đọc được dữ liệu: 1 với float32/float64, 2 với int16 (phiên bản 2 thêm khối
+#     Quantization trước mảng điểm), nên bộ giải mã phiên bản 1 từ chối dữ liệu int16 thay vì đọc sai vị trí điểm
+#     num_points (uint32), num_segments (uint32), diameter (float64),
+#     final_point (3 x float64), final_direction (3 x float64), final_up_vector (3 x float64)
+#   [Quantization] chỉ có khi bytes_per_component = 2: origin (3 x float64), scale (3 x float64);
+#              điểm = origin + giá trị int16 * scale (lượng tử hóa theo hộp bao, xem YBC3D_compact.py)
+#   [Points]   num_points x 3 số float32/float64/int16, bắt đầu ở byte 96 (144 với int16; căn lề 8 byte, client wrap
+#              trực tiếp bằng Float32Array/Float64Array/Int16Array không cần sao chép), sau đó đệm 0 đến bội số của 8 byte
+#   [Segments] num_segments bản ghi 32 byte: type (uint8: 0 = 'Y', 1 = 'B'), 3 byte đệm, start_idx (uint32),
+#              end_idx (uint32), 4 byte đệm, value (float64: Y với đoạn thẳng, angle với đoạn uốn), radius (float64)
+#   [Frames]   chỉ có khi flags & FLAG_FRAMES: normals (num_points x 3 float32), binormals (num_points x 3 float32)
+#              của khung tối thiểu xoay tại từng điểm
+#   [Mesh]     chỉ có khi flags & FLAG_MESH: num_vertices, num_indices, ring_vertices, ring_edges (4 x uint32),
+#              vertices (num_vertices x 3 float32), normals (num_vertices x 3 float32), indices (num_indices x uint32).
+#              Các phần đều có độ dài bội số của 4 byte nên client wrap trực tiếp được (xem YBC3D_mesh.py)
+
+BINARY_MAGIC = b'YBC3'
+BINARY_VERSION = 2 # Phiên bản mới nhất mà pack/unpack hỗ trợ
+MIN_VERSION_BY_COMPONENT_BYTES = {8: 1, 4: 1, 2: 2} # bytes_per_component -> phiên bản đầu tiên có bố cục đó
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+
+HEADER_STRUCT = struct.Struct('<4sHBBIId9d')
+MESH_HEADER_STRUCT = struct.Struct('<4I')
+QUANTIZATION_STRUCT = struct.Struct('<6d')
+FLAG_MESH = 0x01
+FLAG_FRAMES = 0x02
+
+SEGMENT_TYPE_CODES = {'Y': 0, 'B': 1}
+SEGMENT_RECORD_DTYPE = np.dtype([
+    ('type', 'u1'), ('_pad0', 'u1', (3,)),
+    ('start_idx', '<u4'), ('end_idx', '<u4'), ('_pad1', '<u4'),
+    ('value', '<f8'), ('radius', '<f8'),
+])
+
+POINT_DTYPES = {'float32': np.dtype('<f4'), 'float64': np.dtype('<f8'), 'int16': np.dtype('<i2')}
+DTYPES_BY_SIZE = {dtype.itemsize: dtype for dtype in POINT_DTYPES.values()}
+
+
+def pack_centerline_binary(points, segment_info, final_point, final_direction, final_up_vector, diameter, precision='float32',
+                           mesh=None, frames=None):
+    """
+    Đóng gói kết quả đường tâm thành bytes theo định dạng ở trên.
+    points: mảng hoặc list (N, 3); segment_info: list các dict như trong kết quả JSON.
+    precision: 'float32' (mặc định), 'float64' hoặc 'int16' (lượng tử hóa theo hộp bao) cho mảng điểm.
+    mesh: TubeMesh (tùy chọn), thêm phần lưới bề mặt sau các đoạn.
+    frames: (normals, binormals) mảng (N, 3) (tùy chọn), thêm phần khung tại từng điểm.
+    """
+    if precision not in POINT_DTYPES:
+        raise ValueError(f"precision không hợp lệ: {precision!r} (chỉ hỗ trợ {', '.join(POINT_DTYPES)})")
+    point_dtype = POINT_DTYPES[precision]
+    quantization = b''
+    if precision == 'int16':
+        values, origin, scale = quantize_points(points)
+        points_array = np.ascontiguousarray(values, dtype=point_dtype)
+        quantization = QUANTIZATION_STRUCT.pack(*origin.tolist(), *scale.tolist())
+    else:
+        points_array = np.ascontiguousarray(np.asarray(points, dtype=float).reshape(-1, 3), dtype=point_dtype)
+
+    segments = np.zeros(len(segment_info), dtype=SEGMENT_RECORD_DTYPE)
+    for k, segment in enumerate(segment_info):
+        segment_type = segment.get('type')
+        segments[k]['type'] = SEGMENT_TYPE_CODES.get(segment_type, 255)
+        segments[k]['start_idx'] = segment['start_idx']
+        segments[k]['end_idx'] = segment['end_idx']
+        segments[k]['value'] = segment.get('value', 0.0) if segment_type == 'Y' else segment.get('angle', 0.0)
+        segments[k]['radius'] = segment.get('radius', 0.0)
+
+    flags = (FLAG_MESH if mesh is not None else 0) | (FLAG_FRAMES if frames is not None else 0)
+    header = HEADER_STRUCT.pack(
+        BINARY_MAGIC, MIN_VERSION_BY_COMPONENT_BYTES[point_dtype.itemsize], point_dtype.itemsize, flags,
+        points_array.shape[0], segments.shape[0], float(diameter),
+        *[float(v) for v in final_point], *[float(v) for v in final_direction], *[float(v) for v in final_up_vector]
+    )
+    points_bytes = points_array.tobytes()
+    padding = b'\x00' * (-len(points_bytes) % 8)
+    parts = [header, quantization, points_bytes, padding, segments.tobytes()]
+    if frames is not None:
+        for frame_vectors in frames:
+            parts.append(np.ascontiguousarray(frame_vectors, dtype='<f4').reshape(-1, 3).tobytes())
+    if mesh is not None:
+        parts.append(MESH_HEADER_STRUCT.pack(mesh.vertices.shape[0], mesh.indices.shape[0], mesh.ring_vertices, mesh.ring_edges))
+        parts.append(np.ascontiguousarray(mesh.vertices, dtype='<f4').tobytes())
+        parts.append(np.ascontiguousarray(mesh.normals, dtype='<f4').tobytes())
+        parts.append(np.ascontiguousarray(mesh.indices, dtype='<u4').tobytes())
+    return b''.join(parts)
+
+
+def unpack_centerline_binary(buffer):
+    """
+    Giải mã bytes do pack_centerline_binary tạo ra, trả về dict với 'centerline_points' là mảng (N, 3)
+    (đã giải lượng tử với int16, khi đó có thêm 'quantization' {'origin', 'scale'}).
+    """
+    (magic, version, bytes_per_component, flags, num_points, num_segments, diameter,
+     *frame_values) = HEADER_STRUCT.unpack_from(buffer, 0)
+    if magic != BINARY_MAGIC or not 1 <= version <= BINARY_VERSION:
+        raise ValueError("Dữ liệu nhị phân không đúng định dạng YBC3.")
+    point_dtype = DTYPES_BY_SIZE.get(bytes_per_component)
+    if point_dtype is None or version < MIN_VERSION_BY_COMPONENT_BYTES[bytes_per_component]:
+        raise ValueError(f"bytes_per_component không hợp lệ: {bytes_per_component} (phiên bản {version})")
+
+    offset = HEADER_STRUCT.size
+    quantization = None
+    if point_dtype == POINT_DTYPES['int16']:
+        quantization_values = QUANTIZATION_STRUCT.unpack_from(buffer, offset)
+        quantization = {"origin": list(quantization_values[0:3]), "scale": list(quantization_values[3:6])}
+        offset += QUANTIZATION_STRUCT.size
+    points = np.frombuffer(buffer, dtype=point_dtype, count=num_points * 3, offset=offset).reshape(num_points, 3)
+    offset += points.nbytes + (-points.nbytes % 8)
+    if quantization is not None:
+        points = dequantize_points(points, quantization["origin"], quantization["scale"])
+    segments = np.frombuffer(buffer, dtype=SEGMENT_RECORD_DTYPE, count=num_segments, offset=offset)
+    offset += segments.nbytes
+
+    type_names = {code: name for name, code in SEGMENT_TYPE_CODES.items()}
+    segment_info = []
+    for record in segments:
+        segment_type = type_names.get(int(record['type']))
+        if segment_type == 'Y':
+            segment = {'type': 'Y', 'value': float(record['value'])}
+        else:
+            segment = {'type': segment_type, 'angle': float(record['value']), 'radius': float(record['radius'])}
+        segment['start_idx'] = int(record['start_idx'])
+        segment['end_idx'] = int(record['end_idx'])
+        segment_info.append(segment)
+
+    unpacked = {
+        "centerline_points": points,
+        "segment_info": segment_info,
+        "final_point": list(frame_values[0:3]),
+        "final_direction": list(frame_values[3:6]),
+        "final_up_vector": list(frame_values[6:9]),
+        "diameter": diameter
+    }
+    if quantization is not None:
+        unpacked["quantization"] = quantization
+    if flags & FLAG_FRAMES:
+        for key in ("point_normals", "point_binormals"):
+            unpacked[key] = np.frombuffer(buffer, dtype='<f4', count=num_points * 3, offset=offset).reshape(num_points, 3)
+            offset += unpacked[key].nbytes
+    if flags & FLAG_MESH:
+        num_vertices, num_indices, ring_vertices, ring_edges = MESH_HEADER_STRUCT.unpack_from(buffer, offset)
+        offset += MESH_HEADER_STRUCT.size
+        vertices = np.frombuffer(buffer, dtype='<f4', count=num_vertices * 3, offset=offset).reshape(num_vertices, 3)
+        offset += vertices.nbytes
+        normals = np.frombuffer(buffer, dtype='<f4', count=num_vertices * 3, offset=offset).reshape(num_vertices, 3)
+        offset += normals.nbytes
+        indices = np.frombuffer(buffer, dtype='<u4', count=num_indices, offset=offset)
+        unpacked["mesh"] = {
+            "vertices": vertices, "normals": normals, "indices": indices,
+            "ring_vertices": ring_vertices, "ring_edges": ring_edges
+        }
+    return unpacked
@@ -0,0 +1,315 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("YBC3D_web")
+
+# --- Cache kết quả theo nội dung request ---
+# Khóa là SHA-256 của request đã chuẩn hóa (các dòng YBC, Diameter, các tùy chọn engine và profile),
+# nên hai request có cùng nội dung (khác thứ tự khóa, 100 so với 100.0, ...) dùng chung một kết quả.
+
+YBC_ROW_KEYS = ('Y', 'B', 'C', 'Radius')
+CACHE_KEY_VERSION = 1 # Tăng khi engine thay đổi kết quả để vô hiệu hóa các khóa cũ (kể cả ETag phía client)
+# Định dạng file cache trên đĩa: .npz gồm các mảng số và một mảng 'meta' (JSON UTF-8) mô tả phần còn lại của kết quả.
+# Chỉ đọc bằng np.load(allow_pickle=False): file do người khác ghi vào thư mục chung không thể chạy mã khi nạp.
+DISK_FORMAT_VERSION = 1
+PROGRAM_ROW_BYTES = 400 # Ước lượng bộ nhớ của một dòng YBC đã chuẩn hóa (dict 4 float) trong ProgramStore
+
+
+def _normalize_number(value):
+    """ Số (int/float) được đưa về float để 100 và 100.0 cho cùng một khóa, kể cả trong dict/list lồng nhau """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, dict):
+        return {key: _normalize_number(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize_number(item) for item in value]
+    return value
+
+
+def normalize_ybc_rows(ybc_data):
+    """ Các dòng YBC chỉ gồm Y/B/C/Radius dạng float (Radius mặc định 0 như engine); dòng không phải dict giữ nguyên """
+    normalized_rows = []
+    for row in ybc_data:
+        if isinstance(row, dict):
+            normalized_row = {key: _normalize_number(row[key]) for key in YBC_ROW_KEYS if key in row}
+            normalized_row.setdefault('Radius', 0.0) # Engine mặc định Radius = 0
+            normalized_rows.append(normalized_row)
+        else:
+            normalized_rows.append(row)
+    return normalized_rows
+
+
+def canonical_request_key(data_for_centerline_calc, profile_info=None):
+    """ Khóa cache (hex SHA-256) của dữ liệu đầu vào engine cùng với profile của request """
+    normalized_request = {
+        key: _normalize_number(value) for key, value in data_for_centerline_calc.items() if key != 'YBC'
+    }
+    normalized_request['YBC'] = normalize_ybc_rows(data_for_centerline_calc.get('YBC', []))
+    normalized_request['profile'] = _normalize_number(profile_info)
+    normalized_request['_version'] = CACHE_KEY_VERSION
+    canonical_text = json.dumps(normalized_request, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical_text.encode('utf-8')).hexdigest()
+
+
+def content_revision(rows, options_key):
+    """
+    Revision của một chương trình đang chỉnh sửa: hex SHA-256 của các dòng YBC đã chuẩn hóa và khóa tùy chọn.
+    Suy ra từ nội dung nên mọi instance cho cùng revision với cùng chương trình; revision gốc client gửi lên
+    chỉ khớp khi server giữ đúng các dòng mà client đang có.
+    """
+    canonical_text = json.dumps({"rows": rows, "options": options_key}, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical_text.encode('utf-8')).hexdigest()[:32]
+
+
+def estimate_result_bytes(result):
+    """ Ước lượng bộ nhớ của một CenterlineResult, dùng cho giới hạn dung lượng của tầng LRU """
+    estimated_bytes = result.points.nbytes + 200 * len(result.segment_info) + 512
+    if result.trace is not None:
+        estimated_bytes += 600 * len(result.trace)
+    if result.tangents is not None:
+        estimated_bytes += result.tangents.nbytes + result.normals.nbytes
+    if result.mesh is not None:
+        estimated_bytes += result.mesh.vertices.nbytes + result.mesh.normals.nbytes + result.mesh.indices.nbytes
+    if result.clearance is not None:
+        estimated_bytes += 512 + 400 * len(result.clearance['pairs'])
+    if result.undecimated is not None:
+        estimated_bytes += result.undecimated['points'].nbytes + 200 * len(result.undecimated['segment_info'])
+    if result.checkpoints is not None:
+        estimated_bytes += sum(values.nbytes for values in result.checkpoints.values())
+    return estimated_bytes
+
+
+def compact_result(result):
+    """ Mảng điểm (và khung) có thể là view của mảng cấp phát trước lớn hơn; chỉ giữ phần thực sự dùng """
+    if result.points.base is not None:
+        result = dataclasses.replace(result, points=result.points.copy())
+    if result.tangents is not None and result.tangents.base is not None:
+        result = dataclasses.replace(result, tangents=result.tangents.copy(), normals=result.normals.copy())
+    return result
+
+
+def _encode_for_disk(value, arrays):
+    """ Thay mảng NumPy bằng {'__array__': tên} (mảng được gom vào arrays) và TubeMesh bằng {'__mesh__': ...} """
+    if hasattr(value, 'dtype') and hasattr(value, 'shape') and value.shape != ():
+        name = f"a{len(arrays)}"
+        arrays[name] = value
+        return {"__array__": name}
+    if hasattr(value, 'dtype'):
+        return value.item() # Số vô hướng NumPy
+    if dataclasses.is_dataclass(value):
+        return {"__mesh__": {field.name: _encode_for_disk(getattr(value, field.name), arrays)
+                             for field in dataclasses.fields(value)}}
+    if isinstance(value, dict):
+        return {key: _encode_for_disk(item, arrays) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_for_disk(item, arrays) for item in value]
+    return value
+
+
+def _decode_from_disk(value, arrays, mesh_class):
+    if isinstance(value, dict):
+        if set(value) == {"__array__"}:
+            return arrays[value["__array__"]]
+        if set(value) == {"__mesh__"}:
+            return mesh_class(**_decode_from_disk(value["__mesh__"], arrays, mesh_class))
+        return {key: _decode_from_disk(item, arrays, mesh_class) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode_from_disk(item, arrays, mesh_class) for item in value]
+    return value
+
+
+def _engine_classes():
+    """ (np, CenterlineResult, TubeMesh); import khi cần để tầng đĩa không kéo NumPy vào lúc nạp handler """
+    import numpy as np
+    try:
+        from YBC3D_web import CenterlineResult
+        from YBC3D_mesh import TubeMesh
+    except ImportError:
+        from .YBC3D_web import CenterlineResult
+        from .YBC3D_mesh import TubeMesh
+    return np, CenterlineResult, TubeMesh
+
+
+def dump_result(result, cache_file):
+    """ Ghi CenterlineResult vào file nhị phân đang mở theo định dạng .npz không dùng pickle """
+    np, _, _ = _engine_classes()
+    arrays = {}
+    fields = {field.name: _encode_for_disk(getattr(result, field.name), arrays) for field in dataclasses.fields(result)}
+    meta_text = json.dumps({"version": DISK_FORMAT_VERSION, "result": fields}, separators=(',', ':'))
+    np.savez(cache_file, meta=np.frombuffer(meta_text.encode('utf-8'), dtype=np.uint8), **arrays)
+
+
+def load_result(cache_file):
+    """ Đọc CenterlineResult do dump_result ghi; ValueError nếu file không đúng định dạng hoặc khác phiên bản """
+    np, result_class, mesh_class = _engine_classes()
+    with np.load(cache_file, allow_pickle=False) as archive:
+        arrays = {name: archive[name] for name in archive.files}
+    meta_bytes = arrays.pop('meta', None)
+    if meta_bytes is None or meta_bytes.dtype != np.uint8:
+        raise ValueError("File cache không có khối meta")
+    meta = json.loads(meta_bytes.tobytes().decode('utf-8'))
+    if meta.get("version") != DISK_FORMAT_VERSION:
+        raise ValueError(f"Phiên bản file cache không hỗ trợ: {meta.get('version')}")
+    return result_class(**_decode_from_disk(meta["result"], arrays, mesh_class))
+
+
+class ResultCache:
+    """
+    Cache hai tầng cho CenterlineResult:
+      - LRU trong tiến trình, giới hạn theo tổng số byte (max_bytes)
+      - Tùy chọn: thư mục trên đĩa (disk_dir, ví dụ /tmp trên serverless) để dùng lại giữa các lần gọi của instance còn ấm
+    An toàn khi dùng từ nhiều luồng (endpoint batch).
+    """
+
+    def __init__(self, max_bytes, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict() # key -> (result, size_bytes)
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning("Không tạo được thư mục cache %s, tắt tầng đĩa: %s", disk_dir, e)
+                self.disk_dir = None
+
+    def get(self, key):
+        """ Trả về CenterlineResult đã lưu hoặc None """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        result = self._read_disk(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._put_memory(key, result)
+        return result
+
+    def put(self, key, result):
+        """ Lưu kết quả thành công (kết quả lỗi không được lưu) """
+        if result.error:
+            return
+        result = compact_result(result)
+        self._put_memory(key, result)
+        self._write_disk(key, result)
+
+    def stats(self):
+        """ Bộ đếm hit/miss và dung lượng hiện tại """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._current_bytes,
+                "max_bytes": self.max_bytes,
+                "disk_enabled": bool(self.disk_dir)
+            }
+
+    def _put_memory(self, key, result):
+        size_bytes = estimate_result_bytes(result)
+        if size_bytes > self.max_bytes:
+            return # Kết quả lớn hơn toàn bộ cache: không giữ trong bộ nhớ
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._current_bytes -= previous[1]
+            self._entries[key] = (result, size_bytes)
+            self._current_bytes += size_bytes
+            while self._current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + '.npz')
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                return load_result(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Bỏ file cache hỏng %s: %s", path, e)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write_disk(self, key, result):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as cache_file:
+                dump_result(result, cache_file)
+            os.replace(temp_path, path) # Ghi nguyên tử: các tiến trình khác không đọc phải file dở
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Không ghi được file cache %s: %s", path, e)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+
+class ProgramStore:
+    """
+    Trạng thái gần nhất của từng chương trình đang được chỉnh sửa (program_id -> revision, dòng YBC, kết quả có checkpoints),
+    dùng để chỉ tính lại phần đuôi thay đổi. LRU giới hạn theo tổng số byte (max_bytes), như ResultCache;
+    an toàn khi dùng từ nhiều luồng.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._programs = OrderedDict() # program_id -> (entry, size_bytes)
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, program_id):
+        """ Trả về dict {'revision', 'options_key', 'rows', 'result'} hoặc None """
+        with self._lock:
+            stored = self._programs.get(program_id)
+            if stored is None:
+                return None
+            self._programs.move_to_end(program_id)
+            return stored[0]
+
+    def put(self, program_id, revision, options_key, rows, result):
+        result = compact_result(result)
+        size_bytes = estimate_result_bytes(result) + PROGRAM_ROW_BYTES * len(rows)
+        with self._lock:
+            previous = self._programs.pop(program_id, None)
+            if previous is not None:
+                self._current_bytes -= previous[1]
+            if size_bytes > self.max_bytes:
+                return # Chương trình lớn hơn toàn bộ budget: không giữ, lần sau tính lại toàn bộ
+            self._programs[program_id] = ({
+                "revision": revision, "options_key": options_key, "rows": rows, "result": result
+            }, size_bytes)
+            self._current_bytes += size_bytes
+            while self._current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._programs.popitem(last=False)
+                self._current_bytes -= evicted_bytes
@@ -0,0 +1,265 @@
+import math
+import numpy as np
+
+# --- Phân tích khe hở / tự va chạm của ống ---
+# Hai phần của ống va chạm khi khoảng cách giữa hai điểm đường tâm nhỏ hơn đường kính ống, trừ khi hai điểm
+# là lân cận dọc theo ống (khoảng cách theo chiều dài ống <= NEIGHBOR_ARC_FACTOR * diameter: với bán kính uốn
+# nhỏ nhất thực tế R = D / 2, hai điểm trên cùng cung 180 độ cách nhau đúng D).
+# Đường tâm được xét như đường gấp khúc liên tục: các cạnh được chia thành đoạn con dài <= piece_length
+# (chỉ để lập lưới, cạnh ngắn của cung giữ nguyên), các cặp đoạn con gần nhau được tìm bằng lưới đều theo trung điểm,
+# rồi tính khoảng cách chính xác giữa hai đoạn thẳng với ràng buộc khoảng cách theo chiều dài ống > neighbor_arc.
+# Cực tiểu nằm trên biên ràng buộc mà khoảng cách còn giảm khi tiến lại gần nhau dọc ống (như trên một đoạn thẳng dài)
+# chỉ là phần kề nhau của ống và bị bỏ: ống thẳng không có cặp nào, min_distance chỉ phản ánh các lần tiếp cận thật.
+# Kết quả không phụ thuộc bước chia; piece_length chỉ tăng khi số đoạn con vượt MAX_CLEARANCE_PIECES
+# (ống rất dài so với đường kính), nên thời gian và bộ nhớ bị chặn theo kích thước đường tâm thay vì theo Diameter.
+
+NEIGHBOR_ARC_FACTOR = math.pi / 2
+SEARCH_RADIUS_FACTOR = 2.0 # Mọi cặp cách nhau < 2 * diameter đều được xét, nên min_clearance đúng khi < diameter
+MAX_REPORTED_PAIRS = 100
+MAX_CLEARANCE_PIECES = 250000 # Số đoạn con tối đa; vượt thì tăng piece_length
+MAX_CANDIDATE_PAIRS = 50000000 # Tổng số cặp ứng viên tối đa, vượt thì báo lỗi thay vì cạn bộ nhớ
+EXCLUSION_BOUNDARY_RTOL = 1e-9 # Sai số tương đối khi xác định cặp điểm nằm trên biên ràng buộc chiều dài ống
+EXCLUSION_SLOPE_TOLERANCE = 1e-6 # Cosin tối thiểu để coi khoảng cách còn giảm khi hai điểm tiến lại gần nhau
+QUERY_CHUNK_PIECES = 32768 # Số đoạn con truy vấn mỗi lần để giới hạn bộ nhớ của mảng cặp ứng viên
+
+# 13 ô lân cận "một nửa" và chính ô đó: mỗi cặp ô kề nhau chỉ được xét một lần
+HALF_NEIGHBOR_OFFSETS = [(0, 0, 0)] + [
+    (dx, dy, dz)
+    for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+    if (dx, dy, dz) > (0, 0, 0)
+]
+
+
+def split_polyline(points, max_length):
+    """
+    Chia các cạnh của đường gấp khúc thành đoạn con dài <= max_length (cạnh ngắn hơn giữ nguyên).
+    Trả về (starts (M, 3), ends (M, 3), arc_start (M,), lengths (M,), edge_of_piece (M,)):
+    edge k là cạnh từ điểm k đến k + 1, arc_start là chiều dài ống tại đầu đoạn con.
+    """
+    edge_vectors = np.diff(points, axis=0)
+    edge_lengths = np.linalg.norm(edge_vectors, axis=1)
+    subdivisions = np.maximum(1, np.ceil(edge_lengths / max_length)).astype(np.int64)
+    edge_of_piece = np.repeat(np.arange(len(edge_vectors)), subdivisions)
+    first_piece_of_edge = np.cumsum(subdivisions) - subdivisions
+    piece_in_edge = np.arange(len(edge_of_piece)) - first_piece_of_edge[edge_of_piece]
+    fractions = piece_in_edge / subdivisions[edge_of_piece]
+    piece_vectors = (edge_vectors / subdivisions[:, np.newaxis])[edge_of_piece]
+    starts = points[edge_of_piece] + fractions[:, np.newaxis] * edge_vectors[edge_of_piece]
+    lengths = (edge_lengths / subdivisions)[edge_of_piece]
+    cumulative_lengths = np.concatenate(([0.0], np.cumsum(edge_lengths)))
+    arc_start = cumulative_lengths[edge_of_piece] + fractions * edge_lengths[edge_of_piece]
+    return starts, starts + piece_vectors, arc_start, lengths, edge_of_piece
+
+
+def segment_of_edges(segment_info, num_edges):
+    """ Chỉ số đoạn (trong segment_info) của từng cạnh; -1 nếu cạnh không thuộc đoạn nào """
+    segment_of_edge = np.full(num_edges, -1, dtype=np.int64)
+    if not segment_info:
+        return segment_of_edge
+    starts = np.array([segment['start_idx'] for segment in segment_info], dtype=np.int64)
+    edge_counts = np.array([segment['end_idx'] for segment in segment_info], dtype=np.int64) - starts
+    edge_counts = np.maximum(edge_counts, 0)
+    first_of_segment = np.cumsum(edge_counts) - edge_counts
+    edge_indices = np.repeat(starts, edge_counts) + np.arange(edge_counts.sum()) - np.repeat(first_of_segment, edge_counts)
+    valid = (edge_indices >= 0) & (edge_indices < num_edges)
+    segment_of_edge[edge_indices[valid]] = np.repeat(np.arange(len(segment_info)), edge_counts)[valid]
+    return segment_of_edge
+
+
+def constrained_segment_distance(a_start, a_end, b_start, b_end, arc_gap, length_a, length_b, min_separation):
+    """
+    Khoảng cách bình phương nhỏ nhất giữa điểm a(u) trên đoạn a và b(v) trên đoạn b (u, v trong [0, 1]), với ràng buộc
+    khoảng cách theo chiều dài ống arc_gap + v * length_b - u * length_a >= min_separation (đoạn a đứng trước đoạn b,
+    arc_gap là chiều dài ống từ đầu a đến đầu b). Vector hóa trên các cặp; trả về (squared, u, v),
+    squared = inf nếu không có cặp điểm nào thỏa ràng buộc.
+    """
+    direction_a = a_end - a_start
+    direction_b = b_end - b_start
+    offset = a_start - b_start
+    aa = np.einsum('ij,ij->i', direction_a, direction_a)
+    bb = np.einsum('ij,ij->i', direction_b, direction_b)
+    ab = np.einsum('ij,ij->i', direction_a, direction_b)
+    a_offset = np.einsum('ij,ij->i', direction_a, offset)
+    b_offset = np.einsum('ij,ij->i', direction_b, offset)
+    tiny = 1e-300
+
+    # 1. Cặp điểm gần nhất không ràng buộc (hai đoạn thẳng, kẹp vào [0, 1])
+    denominator = aa * bb - ab * ab
+    u = np.where(denominator > 1e-12 * aa * bb, np.clip((ab * b_offset - a_offset * bb) / np.maximum(denominator, tiny), 0.0, 1.0), 0.0)
+    v = (ab * u + b_offset) / np.maximum(bb, tiny)
+    below, above = v < 0.0, v > 1.0
+    u = np.where(below, np.clip(-a_offset / np.maximum(aa, tiny), 0.0, 1.0), u)
+    u = np.where(above, np.clip((ab - a_offset) / np.maximum(aa, tiny), 0.0, 1.0), u)
+    v = np.clip(v, 0.0, 1.0)
+
+    # 2. Nếu vi phạm ràng buộc, cực tiểu (hàm lồi) nằm trên đường biên v = c0 + c1 * u
+    violated = arc_gap + v * length_b - u * length_a < min_separation
+    if violated.any():
+        safe_length_b = np.maximum(length_b, tiny)
+        c0 = (min_separation - arc_gap) / safe_length_b
+        c1 = length_a / safe_length_b
+        # Khoảng u để v = c0 + c1 * u nằm trong [0, 1]
+        u_low = np.where(c1 > 0, np.maximum(0.0, -c0 / np.maximum(c1, tiny)), 0.0)
+        u_high = np.where(c1 > 0, np.minimum(1.0, (1.0 - c0) / np.maximum(c1, tiny)), 1.0)
+        feasible = (u_low <= u_high) & ((c1 > 0) | ((c0 >= 0.0) & (c0 <= 1.0))) & (arc_gap + length_b >= min_separation)
+        # a(u) - b(v) = (offset - c0 * direction_b) + u * (direction_a - c1 * direction_b)
+        base = offset - c0[:, np.newaxis] * direction_b
+        slope = direction_a - c1[:, np.newaxis] * direction_b
+        boundary_u = np.clip(-np.einsum('ij,ij->i', base, slope) / np.maximum(np.einsum('ij,ij->i', slope, slope), tiny),
+                             u_low, u_high)
+        u = np.where(violated, boundary_u, u)
+        v = np.where(violated, c0 + c1 * boundary_u, v)
+    differences = offset + u[:, np.newaxis] * direction_a - v[:, np.newaxis] * direction_b
+    squared = np.einsum('ij,ij->i', differences, differences)
+    if violated.any():
+        squared = np.where(violated & ~feasible, np.inf, squared)
+    return squared, u, v
+
+
+def exclusion_bound(a_start, a_end, b_start, b_end, arc_gap, length_a, length_b, u, v, min_separation):
+    """
+    Cặp điểm gần nhất (kết quả của constrained_segment_distance) chỉ do ràng buộc chiều dài ống quyết định: nằm trên
+    biên arc = min_separation và khoảng cách còn giảm khi hai điểm tiến lại gần nhau dọc ống (ví dụ hai điểm trên cùng
+    một đoạn thẳng). Đó là phần kề nhau của ống, không phải một lần tiếp cận thật.
+    """
+    on_boundary = arc_gap + v * length_b - u * length_a <= min_separation * (1.0 + EXCLUSION_BOUNDARY_RTOL)
+    direction_a = a_end - a_start
+    direction_b = b_end - b_start
+    differences = a_start + u[:, np.newaxis] * direction_a - b_start - v[:, np.newaxis] * direction_b
+    distances = np.sqrt(np.einsum('ij,ij->i', differences, differences))
+    # Đạo hàm của khoảng cách khi a tiến về phía trước / b lùi lại (theo tiếp tuyến đơn vị)
+    approach_a = np.einsum('ij,ij->i', differences, direction_a) / np.maximum(length_a, 1e-300)
+    approach_b = np.einsum('ij,ij->i', differences, direction_b) / np.maximum(length_b, 1e-300)
+    threshold = -EXCLUSION_SLOPE_TOLERANCE * distances
+    return on_boundary & ((approach_a < threshold) | (approach_b < threshold))
+
+
+def find_close_pairs(starts, ends, arc_start, lengths, search_radius, neighbor_arc):
+    """
+    Mọi cặp đoạn con (i < j) có cặp điểm cách nhau < search_radius và cách nhau > neighbor_arc theo chiều dài ống,
+    trừ các cặp mà khoảng cách chỉ do ràng buộc chiều dài ống quyết định (exclusion_bound).
+    Trả về (i, j, u, v, distance) dạng mảng: điểm gần nhất là starts + u * (ends - starts) trên mỗi đoạn con.
+    Ném ValueError nếu số cặp ứng viên vượt MAX_CANDIDATE_PAIRS.
+    """
+    midpoints = (starts + ends) / 2.0
+    cell_size = search_radius + float(lengths.max())
+    cells = np.floor((midpoints - midpoints.min(axis=0)) / cell_size).astype(np.int64) + 1 # +1: ô lân cận -1 vẫn không âm
+    grid_dims = cells.max(axis=0) + 2
+
+    def cell_keys(cell_coordinates):
+        return (cell_coordinates[:, 0] * grid_dims[1] + cell_coordinates[:, 1]) * grid_dims[2] + cell_coordinates[:, 2]
+
+    # Sắp xếp đoạn con theo ô: đoạn con của một ô nằm liền nhau, mỗi ô chỉ cần (vị trí đầu, số đoạn con)
+    keys = cell_keys(cells)
+    order = np.argsort(keys, kind='stable')
+    sorted_cells = cells[order]
+    unique_keys, cell_start, cell_count = np.unique(keys[order], return_index=True, return_counts=True)
+    squared_radius = search_radius * search_radius
+    half_lengths = lengths / 2.0
+
+    found = []
+    candidate_pairs = 0
+    for chunk_start in range(0, len(order), QUERY_CHUNK_PIECES):
+        query = np.arange(chunk_start, min(chunk_start + QUERY_CHUNK_PIECES, len(order)))
+        for offset in HALF_NEIGHBOR_OFFSETS:
+            neighbor_keys = cell_keys(sorted_cells[query] + np.array(offset))
+            slot = np.minimum(np.searchsorted(unique_keys, neighbor_keys), len(unique_keys) - 1)
+            occupied = unique_keys[slot] == neighbor_keys
+            counts = np.where(occupied, cell_count[slot], 0)
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            candidate_pairs += total
+            if candidate_pairs > MAX_CANDIDATE_PAIRS:
+                raise ValueError("đường tâm quá dày đặc so với đường kính để phân tích khe hở")
+            # Bung (query, khoảng [start, start + count)) thành các cặp chỉ số đoạn con gốc
+            pair_i = order[np.repeat(query, counts)]
+            pair_j = order[np.arange(total) + np.repeat(cell_start[slot] - (np.cumsum(counts) - counts), counts)]
+            if offset == (0, 0, 0):
+                distinct = pair_j > pair_i # Trong cùng một ô, mỗi cặp chỉ xét một lần
+            else:
+                distinct = pair_j != pair_i
+            pair_i, pair_j = np.minimum(pair_i[distinct], pair_j[distinct]), np.maximum(pair_i[distinct], pair_j[distinct])
+            # Lọc nhanh: trung điểm đủ gần và hai đoạn con có cặp điểm cách nhau > neighbor_arc theo chiều dài ống
+            gaps = midpoints[pair_i] - midpoints[pair_j]
+            reach = search_radius + half_lengths[pair_i] + half_lengths[pair_j]
+            arc_gap = arc_start[pair_j] - arc_start[pair_i]
+            keep = (np.einsum('ij,ij->i', gaps, gaps) < reach * reach) & (arc_gap + lengths[pair_j] > neighbor_arc)
+            pair_i, pair_j, arc_gap = pair_i[keep], pair_j[keep], arc_gap[keep]
+            if len(pair_i) == 0:
+                continue
+            squared, u, v = constrained_segment_distance(starts[pair_i], ends[pair_i], starts[pair_j], ends[pair_j],
+                                                         arc_gap, lengths[pair_i], lengths[pair_j], neighbor_arc)
+            close = squared < squared_radius
+            close[close] = ~exclusion_bound(starts[pair_i[close]], ends[pair_i[close]], starts[pair_j[close]], ends[pair_j[close]],
+                                            arc_gap[close], lengths[pair_i[close]], lengths[pair_j[close]],
+                                            u[close], v[close], neighbor_arc)
+            found.append((pair_i[close], pair_j[close], u[close], v[close], squared[close]))
+
+    if not found:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0))
+    pair_i, pair_j, u, v, squared = (np.concatenate(parts) for parts in zip(*found))
+    return pair_i, pair_j, u, v, np.sqrt(squared)
+
+
+def analyze_clearance(points, segment_info, diameter, max_reported_pairs=MAX_REPORTED_PAIRS):
+    """
+    Khe hở nhỏ nhất giữa các phần không kề nhau của ống và các cặp đoạn (chỉ số trong segment_info) va chạm.
+    min_distance là khoảng cách đường tâm nhỏ nhất (None nếu không có cặp nào gần hơn search_radius),
+    min_clearance = min_distance - diameter (âm nghĩa là va chạm).
+    Ném ValueError nếu đường tâm quá dày đặc so với diameter (xem MAX_CANDIDATE_PAIRS).
+    """
+    points = np.asarray(points, dtype=float)
+    search_radius = SEARCH_RADIUS_FACTOR * diameter
+    neighbor_arc = NEIGHBOR_ARC_FACTOR * diameter
+    report = {
+        "diameter": diameter, "search_radius": search_radius,
+        "min_distance": None, "min_clearance": None, "interference": False, "num_pairs": 0, "pairs": []
+    }
+    if len(points) < 2:
+        return report
+
+    total_length = float(np.linalg.norm(np.diff(points, axis=0), axis=1).sum())
+    piece_length = max(search_radius, total_length / MAX_CLEARANCE_PIECES)
+    starts, ends, arc_start, lengths, edge_of_piece = split_polyline(points, piece_length)
+    nonzero = lengths > 0 # Điểm trùng nhau không tạo đoạn con
+    starts, ends, arc_start, lengths, edge_of_piece = (values[nonzero] for values in (starts, ends, arc_start, lengths, edge_of_piece))
+    if len(lengths) == 0:
+        return report
+    pair_i, pair_j, u, v, distances = find_close_pairs(starts, ends, arc_start, lengths, search_radius, neighbor_arc)
+    if len(distances) == 0:
+        return report
+
+    closest = int(np.argmin(distances))
+    report["min_distance"] = float(distances[closest])
+    report["min_clearance"] = float(distances[closest] - diameter)
+
+    interfering = distances < diameter - 1e-9
+    if not interfering.any():
+        return report
+    segment_of_edge = segment_of_edges(segment_info, len(points) - 1)
+    segment_a = segment_of_edge[edge_of_piece[pair_i[interfering]]]
+    segment_b = segment_of_edge[edge_of_piece[pair_j[interfering]]]
+    # Chuẩn hóa thứ tự (a <= b) rồi giữ cặp điểm gần nhất cho mỗi cặp đoạn
+    segment_a, segment_b = np.minimum(segment_a, segment_b), np.maximum(segment_a, segment_b)
+    by_distance = np.lexsort((distances[interfering], segment_b, segment_a))
+    pair_keys = np.stack((segment_a[by_distance], segment_b[by_distance]), axis=1)
+    first_of_pair = np.ones(len(by_distance), dtype=bool)
+    first_of_pair[1:] = np.any(pair_keys[1:] != pair_keys[:-1], axis=1)
+    closest_pairs = np.flatnonzero(interfering)[by_distance[first_of_pair]]
+    closest_pairs = closest_pairs[np.argsort(distances[closest_pairs], kind='stable')]
+
+    report["interference"] = True
+    report["num_pairs"] = int(len(closest_pairs))
+    for pair in closest_pairs[:max_reported_pairs]:
+        i, j = pair_i[pair], pair_j[pair]
+        point_i = starts[i] + u[pair] * (ends[i] - starts[i])
+        point_j = starts[j] + v[pair] * (ends[j] - starts[j])
+        if segment_of_edge[edge_of_piece[i]] > segment_of_edge[edge_of_piece[j]]:
+            i, j, point_i, point_j = j, i, point_j, point_i
+        report["pairs"].append({
+            "segment_a": int(segment_of_edge[edge_of_piece[i]]), "segment_b": int(segment_of_edge[edge_of_piece[j]]),
+            "distance": float(distances[pair]), "clearance": float(distances[pair] - diameter),
+            "point_a": point_i.tolist(), "point_b": point_j.tolist()
+        })
+    return report
@@ -0,0 +1,98 @@
+import math
+import numpy as np
+
+# --- Thu gọn kết quả đường tâm cho các cụm lắp ráp rất lớn ---
+# 1. Giản lược điểm (Douglas-Peucker trên từng đoạn): bỏ các điểm cách dây cung <= tolerance. Điểm đầu/cuối
+#    của mọi đoạn luôn được giữ, nên segment_info vẫn tương ứng 1-1 với các dòng YBC và chỉ cần đánh lại chỉ số.
+#    Các đoạn được xử lý đồng thời theo từng mức chia đôi (vector hóa), không đệ quy theo từng đoạn.
+# 2. Độ chính xác của mảng điểm khi xuất ra: 'float64' (giữ nguyên), 'float32', hoặc 'int16' lượng tử hóa
+#    theo hộp bao: điểm ~= origin + values * scale, sai số <= scale / 2 = kích thước hộp / (4 * 32767) trên mỗi trục.
+
+POINT_PRECISIONS = ('float64', 'float32', 'int16')
+QUANTIZATION_LEVELS = 32767 # int16 đối xứng [-32767, 32767] quanh tâm hộp bao
+DECIMATION_TIE_RTOL = 1e-9 # Sai số tương đối khi so sánh khoảng cách đến dây cung của các điểm (Douglas-Peucker)
+FLOAT32_SIGNIFICANT_DIGITS = 7 # Số chữ số có nghĩa của float32, dùng khi làm tròn điểm trong JSON
+
+
+def decimation_mask(points, segment_bounds, tolerance):
+    """
+    Mặt nạ (N,) các điểm được giữ sau khi giản lược Douglas-Peucker từng đoạn với độ lệch dây cung tolerance.
+    segment_bounds: mảng (S, 2) chỉ số (trong points) điểm đầu/cuối của các đoạn; điểm đầu, điểm cuối của points
+    và mọi điểm đầu/cuối đoạn luôn được giữ.
+    """
+    points = np.asarray(points, dtype=float)
+    keep = np.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return keep
+    keep[[0, -1]] = True
+    segment_bounds = np.asarray(segment_bounds, dtype=np.int64).reshape(-1, 2)
+    keep[segment_bounds.ravel()] = True
+
+    squared_tolerance = tolerance * tolerance
+    starts, ends = segment_bounds[:, 0], segment_bounds[:, 1]
+    while True:
+        # Chỉ còn các khoảng có điểm bên trong
+        open_intervals = ends - starts >= 2
+        starts, ends = starts[open_intervals], ends[open_intervals]
+        if len(starts) == 0:
+            return keep
+        counts = ends - starts - 1
+        first_of_interval = np.cumsum(counts) - counts
+        interval_of_point = np.repeat(np.arange(len(starts)), counts)
+        inner = np.arange(counts.sum()) - first_of_interval[interval_of_point] + starts[interval_of_point] + 1
+
+        # Khoảng cách bình phương từ điểm bên trong đến dây cung [start, end]
+        chord_start = points[starts][interval_of_point]
+        chords = points[ends][interval_of_point] - chord_start
+        offsets = points[inner] - chord_start
+        chord_squared = np.einsum('ij,ij->i', chords, chords)
+        along = np.clip(np.einsum('ij,ij->i', offsets, chords) / np.maximum(chord_squared, 1e-300), 0.0, 1.0)
+        deviations = offsets - along[:, np.newaxis] * chords
+        squared_distance = np.einsum('ij,ij->i', deviations, deviations)
+
+        # Điểm xa nhất của mỗi khoảng: chia đôi tại đó nếu vượt tolerance, ngược lại bỏ mọi điểm bên trong.
+        # Các điểm cách đều dây cung (cung đối xứng) được coi là bằng nhau trong sai số làm tròn và luôn chọn điểm đầu,
+        # để kết quả không đổi khi đường tâm bị dời hình (ghép phần đuôi, xem YBC3D_web.splice_resumed_result)
+        max_squared = np.maximum.reduceat(squared_distance, first_of_interval)
+        farthest = np.flatnonzero(squared_distance >= max_squared[interval_of_point] * (1.0 - DECIMATION_TIE_RTOL))
+        farthest_intervals, first_farthest = np.unique(interval_of_point[farthest], return_index=True)
+        split_points = inner[farthest[first_farthest]]
+        split = max_squared[farthest_intervals] > squared_tolerance
+        split_intervals, split_points = farthest_intervals[split], split_points[split]
+        keep[split_points] = True
+        starts, ends = (np.concatenate((starts[split_intervals], split_points)),
+                        np.concatenate((split_points, ends[split_intervals])))
+
+
+def quantize_points(points):
+    """
+    Lượng tử hóa mảng (N, 3) thành int16 theo hộp bao: trả về (values (N, 3) int16, origin (3,), scale (3,))
+    với points ~= origin + values * scale. Trục có kích thước 0 dùng scale = 1.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    if len(points) == 0:
+        return np.empty((0, 3), dtype=np.int16), np.zeros(3), np.ones(3)
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    origin = (lower + upper) / 2.0
+    scale = (upper - lower) / (2.0 * QUANTIZATION_LEVELS)
+    scale[scale <= 0] = 1.0
+    values = np.clip(np.rint((points - origin) / scale), -QUANTIZATION_LEVELS, QUANTIZATION_LEVELS).astype(np.int16)
+    return values, origin, scale
+
+
+def dequantize_points(values, origin, scale):
+    """ Ngược của quantize_points: mảng (N, 3) float64 """
+    return np.asarray(origin, dtype=float) + np.asarray(values, dtype=float).reshape(-1, 3) * np.asarray(scale, dtype=float)
+
+
+def round_points(points, significant_digits=FLOAT32_SIGNIFICANT_DIGITS):
+    """
+    Làm tròn mảng điểm đến significant_digits chữ số có nghĩa so với tọa độ có trị tuyệt đối lớn nhất
+    (độ phân giải tương đương float32), để số trong JSON ngắn hơn.
+    """
+    points = np.asarray(points, dtype=float)
+    largest = float(np.abs(points).max()) if points.size else 0.0
+    if largest == 0.0:
+        return points
+    decimals = max(0, significant_digits - math.ceil(math.log10(largest)))
+    return np.round(points, decimals)
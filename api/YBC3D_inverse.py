@@ -0,0 +1,1487 @@
+import math
+from dataclasses import dataclass
+import numpy as np
+
+try:
+    from YBC3D_web import compute_centerline
+except ImportError:
+    from .YBC3D_web import compute_centerline
+
+# --- Chế độ ngược: khớp chương trình YBC từ đường tâm đo được ---
+# 1. Phân đoạn theo lô: chia từ trên xuống tại điểm xa dây cung nhất đến khi mỗi đoạn khớp một đường thẳng hoặc một
+#    đường tròn (bình phương tối thiểu, mọi điểm cách đường khớp <= tolerance), rồi gộp các phần kề nhau và dời điểm
+#    nối để mỗi phần đi xa nhất có thể; mỗi bước khớp mọi đoạn cùng lúc, không lặp Python theo điểm hay phần.
+#    tolerance mặc định tỉ lệ với nhiễu ước lượng từ dữ liệu, nên dữ liệu lấy mẫu lại đều hoặc có nhiễu vẫn được tách
+#    đúng. Hai phần kề nhau chung điểm nối hoặc cách nhau một khoảng chứa điểm tiếp tuyến (nằm giữa các điểm đo).
+#    Cung quá ngắn để khớp riêng (hai đầu cung đã nằm trong tolerance của đoạn thẳng kề) thành góc giữa hai đường thẳng,
+#    với bán kính chọn sao cho cung tiếp tuyến với hai đường thẳng đi sát các điểm đo nhất.
+# 2. Chương trình ban đầu từ các phần đã khớp: điểm tiếp tuyến là chân đường vuông góc từ tâm cung xuống đường thẳng kề,
+#    B là góc quét giữa hai điểm tiếp tuyến, C là góc xoay giữa pháp tuyến của hai cung liên tiếp, Y là khoảng cách
+#    giữa hai điểm tiếp tuyến.
+# 3. Tinh chỉnh Levenberg-Marquardt mọi Y, B, C, Radius và tư thế cùng lúc, cực tiểu tổng bình phương khoảng cách từ
+#    điểm đo đến đường tâm của engine. Đạo hàm theo một tham số của dòng k là chuyển động cứng (twist) của mọi phần
+#    sau dòng k, nên J^T J được cộng dồn theo phần (hậu tố) thay vì lập ma trận Jacobian đầy đủ. Hai dòng uốn liền nhau
+#    gần như một cung (do nhiễu tách ra) được gộp khi sai số vẫn trong max_residual.
+# Engine luôn bắt đầu tại gốc tọa độ, hướng +X, Up +Z: tư thế (origin, rotation) đưa kết quả của engine về
+# hệ tọa độ của dữ liệu đo, và sai số (residual) được đo đến đường tâm do chính engine tính lại từ chương trình đã khớp.
+
+NOISE_TOLERANCE_FACTOR = 6.0 # tolerance mặc định = hệ số * độ lệch chuẩn nhiễu ước lượng
+MIN_RELATIVE_TOLERANCE = 1e-7 # Sàn của tolerance mặc định, tương đối so với kích thước hộp bao (dữ liệu không nhiễu)
+MAX_RESIDUAL_FACTOR = 2.0 # max_residual mặc định = hệ số * tolerance
+MIN_ARC_POINTS = 4 # Số điểm đo tối thiểu trên một cung (ba điểm luôn nằm trên một đường tròn)
+MAX_REFINE_ITERATIONS = 100
+REFINE_RELATIVE_DECREASE = 1e-12 # Dừng tinh chỉnh khi tổng bình phương sai số giảm ít hơn tỉ lệ này
+WINDOW_RELATIVE_DECREASE = 1e-6 # Như trên cho các cửa sổ của refine_in_windows (chỉ là bước khởi tạo)
+REFINE_NEGLIGIBLE_RESIDUAL = 1e-6 # Sai số trung bình phương nhỏ hơn hệ số * tolerance coi như đã khớp đúng
+MIN_SWEEP_RAD = 1e-6 # Góc quét nhỏ nhất giữ trong khi tinh chỉnh (B âm sẽ đảo chiều cung)
+DUPLICATE_POINT_TOLERANCE = 1e-9
+# Bán kính nhỏ hơn hệ số * khoảng cách lấy mẫu (trung vị) không được dữ liệu xác định: cung nằm gọn giữa hai điểm đo,
+# thường là dấu hiệu phân đoạn đã vỡ thành các dòng uốn nhỏ
+MIN_RADIUS_SPACING_FACTOR = 0.5
+# Trung vị độ dài sai phân bậc ba của nhiễu Gauss độc lập: sqrt(20) * sigma trên mỗi trục, trung vị của phân phối chi
+# 3 bậc tự do là 1.5382
+THIRD_DIFFERENCE_MEDIAN = 1.5382 * math.sqrt(20.0)
+POSE_PARAMETERS = 6 # Tịnh tiến (3) và xoay quanh origin (3)
+# Chương trình dài được khởi tạo theo cửa sổ (xem refine_in_windows): số dòng giữ lại của mỗi cửa sổ và số dòng gối lên
+# cửa sổ sau
+WINDOW_ROWS = 40
+WINDOW_OVERLAP = 8
+CORNER_RADIUS_GRID = 61 # Tìm bán kính cung ở góc: lưới log bán kính trên 6 bậc độ lớn,
+GOLDEN_SECTION_ITERATIONS = 40 # rồi tìm kiếm tỉ lệ vàng quanh điểm tốt nhất
+GRAM_CHUNK_POINTS = 32 # Số điểm mỗi khối khi cộng J^T J theo phần (xem _gram_by_piece)
+# Điểm cách dây cung quá hệ số * tolerance: đoạn không thể khớp đường thẳng (mọi điểm và hai đầu mút cách đường thẳng
+# khớp <= tolerance thì mọi điểm cách dây cung <= 2 * tolerance); chỉ để bỏ qua khớp thử khi chia từ trên xuống
+CHORD_LINE_FACTOR = 3.0
+CORNER_ROUNDING = 1e-12 # Sai số làm tròn khoảng cách, tương đối so với kích thước các điểm quanh góc
+
+
+@dataclass
+class InverseFitResult:
+    """
+    Kết quả của fit_ybc_program. ybc rỗng khi không khớp được (error khác rỗng); khi khớp được nhưng sai số lớn nhất
+    vượt max_residual hoặc có bán kính không hợp lý thì error cũng khác rỗng (converged = False) nhưng chương trình
+    và sai số vẫn được trả về để chẩn đoán.
+    Điểm của engine q được đưa về hệ đo bằng origin + rotation @ q (cột của rotation: hướng X, Y, Z của engine).
+    """
+    ybc: list # Các dòng {'Y', 'B', 'C', 'Radius'} như đầu vào của compute_centerline
+    origin: np.ndarray
+    rotation: np.ndarray # Ma trận (3, 3)
+    point_residuals: np.ndarray = None # Khoảng cách (N,) từ từng điểm đo đến đường tâm tính lại từ ybc
+    row_residuals: np.ndarray = None # Sai số lớn nhất của các điểm thuộc từng dòng ybc
+    end_point_error: float = None # Khoảng cách giữa điểm cuối đo được và điểm cuối của engine
+    tolerance: float = None # Độ lệch cho phép khi phân đoạn (mm)
+    max_residual: float = None # Sai số lớn nhất cho phép (mm)
+    error: str = ""
+
+    @property
+    def converged(self):
+        return bool(self.ybc) and not self.error and self.point_residuals is not None and \
+            (len(self.point_residuals) == 0 or float(self.point_residuals.max()) <= self.max_residual)
+
+    def to_dict(self):
+        if not self.ybc:
+            return {"error": self.error, "YBC": []}
+        residuals = self.point_residuals
+        result = {
+            "YBC": self.ybc,
+            "converged": self.converged,
+            "pose": {"origin": self.origin.tolist(), "rotation": self.rotation.tolist()},
+            "tolerance": self.tolerance,
+            "residuals": {
+                "max": float(residuals.max()) if len(residuals) else 0.0,
+                "max_allowed": self.max_residual,
+                "rms": float(np.sqrt(np.mean(residuals ** 2))) if len(residuals) else 0.0,
+                "end_point": self.end_point_error,
+                "rows": self.row_residuals.tolist()
+            }
+        }
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+def _failed(error):
+    return InverseFitResult(ybc=[], origin=np.zeros(3), rotation=np.eye(3), error=error)
+
+
+def _unit_rows(vectors):
+    """ Chuẩn hóa từng hàng; hàng có độ dài ~0 trở thành vector 0 """
+    lengths = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+    safe_lengths = np.where(lengths > 1e-12, lengths, 1.0)
+    return vectors / safe_lengths[:, np.newaxis] * (lengths > 1e-12)[:, np.newaxis], lengths
+
+
+def _skew(vector):
+    """ Ma trận [vector]x: _skew(a) @ b = a x b (nhanh hơn np.cross với một cặp vector) """
+    x, y, z = vector
+    return np.array([[0.0, -z, y], [z, 0.0, -x], [-y, x, 0.0]])
+
+
+def _perpendicular(vector):
+    """ Một vector đơn vị vuông góc với vector """
+    helper = np.array([0.0, 0.0, 1.0]) if abs(vector[2]) < 0.9 else np.array([1.0, 0.0, 0.0])
+    perpendicular = np.cross(vector, helper)
+    return perpendicular / np.linalg.norm(perpendicular)
+
+
+def _rotation_matrix(rotation_vector):
+    """ Ma trận quay Rodrigues của vector quay (trục * góc) """
+    angle = float(np.linalg.norm(rotation_vector))
+    if angle < 1e-15:
+        return np.eye(3)
+    x, y, z = rotation_vector / angle
+    skew = np.array([[0.0, -z, y], [z, 0.0, -x], [-y, x, 0.0]])
+    return np.eye(3) + math.sin(angle) * skew + (1.0 - math.cos(angle)) * skew @ skew
+
+
+def estimate_noise(points):
+    """
+    Độ lệch chuẩn nhiễu đo (mm) ước lượng từ sai phân bậc ba của các điểm liên tiếp: trên đoạn thẳng và cung lấy mẫu
+    đều, sai phân bậc ba gần bằng 0 nên phần còn lại là nhiễu. Dùng trung vị nên các điểm nối và cạnh dài không ảnh hưởng.
+    """
+    if len(points) < 4:
+        return 0.0
+    third = points[3:] - 3.0 * points[2:-1] + 3.0 * points[1:-2] - points[:-3]
+    return float(np.median(np.linalg.norm(third, axis=1))) / THIRD_DIFFERENCE_MEDIAN
+
+
+def _runs(starts, ends):
+    """
+    Chỉ số phẳng của các đoạn điểm [starts[r], ends[r]] nối liền nhau: (chỉ số điểm, đoạn của từng phần tử,
+    vị trí đầu mỗi đoạn trong mảng phẳng, số điểm mỗi đoạn). Mỗi đoạn có ít nhất một điểm.
+    """
+    counts = ends - starts + 1
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    run_of = np.repeat(np.arange(len(starts)), counts)
+    return np.arange(int(counts.sum())) - offsets[run_of] + starts[run_of], run_of, offsets, counts
+
+
+def fit_lines(points, starts, ends):
+    """
+    Đường thẳng bình phương tối thiểu cho từng đoạn points[starts[r]:ends[r] + 1], mọi đoạn cùng lúc:
+    (điểm (R, 3), hướng đơn vị theo chiều đi (R, 3), độ lệch lớn nhất (R,))
+    """
+    index, run_of, offsets, counts = _runs(starts, ends)
+    centroids = np.add.reduceat(points[index], offsets) / counts[:, np.newaxis]
+    relative = points[index] - centroids[run_of]
+    scatter = np.add.reduceat(relative[:, :, np.newaxis] * relative[:, np.newaxis, :], offsets)
+    directions = np.linalg.eigh(scatter)[1][:, :, 2] # eigh sắp xếp trị riêng tăng dần
+    directions *= np.where(np.einsum('ij,ij->i', points[ends] - points[starts], directions) < 0, -1.0, 1.0)[:, np.newaxis]
+    offsets_from_line = relative - np.einsum('ij,ij->i', relative, directions[run_of])[:, np.newaxis] * directions[run_of]
+    deviations = np.sqrt(np.maximum.reduceat(np.einsum('ij,ij->i', offsets_from_line, offsets_from_line), offsets))
+    return centroids, directions, deviations
+
+
+def fit_line(points):
+    """ Đường thẳng bình phương tối thiểu: (một điểm, hướng đơn vị theo chiều đi, độ lệch lớn nhất) """
+    centroids, directions, deviations = fit_lines(points, np.array([0]), np.array([len(points) - 1]))
+    return centroids[0], directions[0], float(deviations[0])
+
+
+def fit_circles(points, starts, ends):
+    """
+    Đường tròn bình phương tối thiểu cho từng đoạn points[starts[r]:ends[r] + 1], mọi đoạn cùng lúc: mặt phẳng (vector
+    riêng nhỏ nhất của ma trận hiệp phương sai), rồi đường tròn Kasa tuyến tính trong mặt phẳng đó. Trả về (tâm (R, 3),
+    pháp tuyến đơn vị sao cho các điểm đi ngược chiều kim đồng hồ quanh nó (R, 3), bán kính (R,), độ lệch lớn nhất (R,));
+    đoạn có các điểm thẳng hàng có bán kính NaN và độ lệch vô cùng.
+    """
+    index, run_of, offsets, counts = _runs(starts, ends)
+    centroids = np.add.reduceat(points[index], offsets) / counts[:, np.newaxis]
+    relative = points[index] - centroids[run_of]
+    axes = np.linalg.eigh(np.add.reduceat(relative[:, :, np.newaxis] * relative[:, np.newaxis, :], offsets))[1]
+    normals, axes_u = axes[:, :, 0], axes[:, :, 2]
+    axes_v = np.cross(normals, axes_u)
+    u = np.einsum('ij,ij->i', relative, axes_u[run_of])
+    v = np.einsum('ij,ij->i', relative, axes_v[run_of])
+    # Kasa: u^2 + v^2 = 2 a u + 2 b v + k. u, v là tọa độ theo hai trục chính quanh trọng tâm nên các cột 2u, 2v, 1
+    # trực giao: bình phương tối thiểu tách thành ba phép chia. Hạng như np.linalg.lstsq với rcond mặc định, theo phần
+    # của v trực giao với u và hằng số (với điểm thẳng hàng, v chỉ còn sai số làm tròn tương quan với u)
+    squares = u * u + v * v
+    u_norms = np.add.reduceat(u * u, offsets)
+    v_norms = np.add.reduceat(v * v, offsets)
+    slopes = np.add.reduceat(u * v, offsets) / np.where(u_norms > 0, u_norms, 1.0)
+    v_residuals = v - (np.add.reduceat(v, offsets) / counts)[run_of] - slopes[run_of] * u
+    column_norms = np.column_stack((4.0 * u_norms, 4.0 * np.add.reduceat(v_residuals * v_residuals, offsets), counts))
+    valid = column_norms.min(axis=1) > (np.finfo(float).eps * counts) ** 2 * column_norms.max(axis=1)
+    safe_u_norms, safe_v_norms = np.where(valid, u_norms, 1.0), np.where(valid, v_norms, 1.0)
+    a = np.add.reduceat(squares * u, offsets) / (2.0 * safe_u_norms)
+    b = np.add.reduceat(squares * v, offsets) / (2.0 * safe_v_norms)
+    squared_radii = np.add.reduceat(squares, offsets) / counts + a * a + b * b
+    valid &= squared_radii > 0
+    radii = np.where(valid, np.sqrt(np.where(valid, squared_radii, 1.0)), np.nan)
+    radial_u, radial_v = u - a[run_of], v - b[run_of]
+    heights = np.einsum('ij,ij->i', relative, normals[run_of])
+    deviations = np.sqrt(np.maximum.reduceat((np.hypot(radial_u, radial_v) - radii[run_of]) ** 2 + heights ** 2, offsets))
+    deviations[~valid] = np.inf
+    # Chiều đi quanh pháp tuyến: tổng tích có hướng của các cặp điểm liên tiếp trong cùng đoạn
+    turns = np.append(radial_u[:-1] * radial_v[1:] - radial_v[:-1] * radial_u[1:], 0.0)
+    turns[offsets + counts - 1] = 0.0
+    normals *= np.where(np.add.reduceat(turns, offsets) < 0, -1.0, 1.0)[:, np.newaxis]
+    centers = centroids + a[:, np.newaxis] * axes_u + b[:, np.newaxis] * axes_v
+    return centers, normals, radii, deviations
+
+
+def fit_circle(points):
+    """
+    Đường tròn bình phương tối thiểu (xem fit_circles): (tâm, pháp tuyến đơn vị sao cho các điểm đi ngược chiều kim
+    đồng hồ quanh nó, bán kính, độ lệch lớn nhất), hoặc None khi các điểm thẳng hàng.
+    """
+    centers, normals, radii, deviations = fit_circles(points, np.array([0]), np.array([len(points) - 1]))
+    if not np.isfinite(deviations[0]):
+        return None
+    return centers[0], normals[0], float(radii[0]), float(deviations[0])
+
+
+def fit_corner_arc(points, first_line, second_line):
+    """
+    Cung tiếp tuyến với hai đường thẳng khớp first_line, second_line (điểm, hướng) tại góc của chúng, cho cung có quá ít
+    điểm đo để khớp đường tròn riêng (hai đoạn thẳng kề đã ôm hai đầu cung). Bán kính được chọn bằng tìm kiếm tỉ lệ vàng
+    (theo log bán kính) cực tiểu tổng bình phương khoảng cách từ points (các điểm của hai đoạn thẳng và khoảng giữa)
+    đến đường thẳng - cung - đường thẳng. Trả về (tâm, pháp tuyến, bán kính, khoảng cách từ đỉnh góc đến giữa cung;
+    0 khi góc nhọn), hoặc None khi hai đường thẳng song song.
+    """
+    (first_anchor, first_direction), (second_anchor, second_direction) = first_line, second_line
+    normal = np.cross(first_direction, second_direction)
+    if np.linalg.norm(normal) < 1e-12:
+        return None
+    normal /= np.linalg.norm(normal)
+    # Đỉnh góc: trung điểm đoạn vuông góc chung của hai đường thẳng (có thể chéo nhau do nhiễu)
+    cosine = float(np.dot(first_direction, second_direction))
+    offset = first_anchor - second_anchor
+    first_along, second_along = float(np.dot(first_direction, offset)), float(np.dot(second_direction, offset))
+    denominator = 1.0 - cosine * cosine
+    vertex = (first_anchor + (cosine * second_along - first_along) / denominator * first_direction +
+              second_anchor + (second_along - cosine * first_along) / denominator * second_direction) / 2.0
+    half = math.acos(min(1.0, max(-1.0, cosine))) / 2.0
+    bisector = second_direction - first_direction
+    bisector /= np.linalg.norm(bisector)
+
+    def corner(radius):
+        tangent_length = radius * math.tan(half)
+        return (vertex + bisector * (radius / math.cos(half)), vertex - tangent_length * first_direction,
+                vertex + tangent_length * second_direction)
+
+    def cost(log_radius):
+        radius = math.exp(log_radius)
+        center, start, end = corner(radius)
+        before = points - start
+        before -= np.minimum(before @ first_direction, 0.0)[:, np.newaxis] * first_direction
+        after = points - end
+        after -= np.maximum(after @ second_direction, 0.0)[:, np.newaxis] * second_direction
+        relative = points - center
+        height = relative @ normal
+        in_plane = relative - height[:, np.newaxis] * normal
+        start_radial = (start - center) / radius
+        angles = np.arctan2(np.cross(start_radial, in_plane) @ normal, in_plane @ start_radial)
+        on_arc = (angles >= 0.0) & (angles <= 2.0 * half)
+        squared = np.minimum(np.einsum('ij,ij->i', before, before), np.einsum('ij,ij->i', after, after))
+        arc_squared = (np.linalg.norm(in_plane, axis=1) - radius) ** 2 + height ** 2
+        return float(np.where(on_arc, np.minimum(squared, arc_squared), squared).sum())
+
+    # Bán kính lớn nhất: điểm tiếp tuyến không vượt quá đầu xa của hai đoạn thẳng. Với bán kính nhỏ, không điểm nào
+    # nằm gần cung nên tổng bình phương gần như không đổi: quét thô trên lưới trước, rồi thu hẹp quanh điểm tốt nhất
+    reach = min(abs(float(np.dot(points[0] - vertex, first_direction))), abs(float(np.dot(points[-1] - vertex, second_direction))))
+    grid = math.log(max(reach, 1e-300) / math.tan(half)) - np.linspace(math.log(1e6), 0.0, CORNER_RADIUS_GRID)
+    # Chọn bán kính lớn nhất trong vùng phẳng quanh cực tiểu: ở đó tổng bình phương chỉ khác nhau do làm tròn, nên
+    # argmin thuần túy phụ thuộc vào vài bit cuối của đường thẳng khớp
+    costs = np.array([cost(log_radius) for log_radius in grid])
+    rounding = len(points) * (CORNER_ROUNDING * float(np.abs(points - vertex).max())) ** 2
+    best = int(np.flatnonzero(costs <= costs.min() + rounding)[-1])
+    if best == 0: # Bán kính nhỏ nhất của lưới là tốt nhất: góc nhọn, không có cung
+        return vertex, normal, math.exp(grid[0]), 0.0
+    lower, upper = grid[max(best - 1, 0)], grid[min(best + 1, len(grid) - 1)]
+    ratio = (math.sqrt(5.0) - 1.0) / 2.0
+    left, right = upper - ratio * (upper - lower), lower + ratio * (upper - lower)
+    left_cost, right_cost = cost(left), cost(right)
+    for _ in range(GOLDEN_SECTION_ITERATIONS):
+        if left_cost <= right_cost:
+            upper, right, right_cost = right, left, left_cost
+            left = upper - ratio * (upper - lower)
+            left_cost = cost(left)
+        else:
+            lower, left, left_cost = left, right, right_cost
+            right = lower + ratio * (upper - lower)
+            right_cost = cost(right)
+    radius = math.exp((lower + upper) / 2.0)
+    return corner(radius)[0], normal, radius, radius * (1.0 / math.cos(half) - 1.0)
+
+
+def _classify(points, starts, ends, tolerance, maybe_line=None):
+    """
+    Loại của từng đoạn: 0 đường thẳng, 1 cung (khi không khớp đường thẳng), -1 không khớp cả hai (trong tolerance).
+    maybe_line: bỏ qua khớp đường thẳng của các đoạn đã biết là không thẳng (mặc định khớp mọi đoạn).
+    """
+    kinds = np.full(len(starts), -1)
+    lines = np.arange(len(starts)) if maybe_line is None else np.flatnonzero(maybe_line)
+    if len(lines):
+        kinds[lines[fit_lines(points, starts[lines], ends[lines])[2] <= tolerance]] = 0
+    candidates = np.flatnonzero((kinds < 0) & (ends - starts + 1 >= MIN_ARC_POINTS))
+    if len(candidates):
+        kinds[candidates[fit_circles(points, starts[candidates], ends[candidates])[3] <= tolerance]] = 1
+    return kinds
+
+
+def _fits(points, kinds, starts, ends, tolerance):
+    """ Đoạn [starts, ends] còn khớp loại kinds (0 đường thẳng, 1 cung) trong tolerance không """
+    fits = np.zeros(len(kinds), dtype=bool)
+    lines = np.flatnonzero(kinds == 0)
+    if len(lines):
+        fits[lines] = fit_lines(points, starts[lines], ends[lines])[2] <= tolerance
+    arcs = np.flatnonzero((kinds == 1) & (ends - starts + 1 >= MIN_ARC_POINTS))
+    if len(arcs):
+        fits[arcs] = fit_circles(points, starts[arcs], ends[arcs])[3] <= tolerance
+    return fits
+
+
+def _farthest_from_chord(points, starts, ends):
+    """ Với từng đoạn có ít nhất ba điểm: (chỉ số điểm xa dây cung nhất, khoảng cách của nó đến dây cung) """
+    index, run_of, offsets, _ = _runs(starts + 1, ends - 1)
+    chords = points[ends] - points[starts]
+    lengths = np.linalg.norm(chords, axis=1)
+    units = chords / np.where(lengths > 0, lengths, 1.0)[:, np.newaxis]
+    relative = points[index] - points[starts][run_of]
+    across = relative - np.einsum('ij,ij->i', relative, units[run_of])[:, np.newaxis] * units[run_of]
+    distances = np.einsum('ij,ij->i', across, across)
+    largest = np.maximum.reduceat(distances, offsets)
+    farthest = distances == largest[run_of]
+    return index[np.flatnonzero(farthest)[np.unique(run_of[farthest], return_index=True)[1]]], np.sqrt(largest)
+
+
+def _merge_pieces(points, kinds, starts, ends, tolerance, merges):
+    """
+    Gộp các phần kề nhau: mỗi lượt thử mọi cặp cùng lúc (khi không cặp nào gộp được thì các bộ ba quanh một phần quá
+    ngắn để là cung, để các mảnh hai điểm của một cung ngắn gộp lại được), gộp các nhóm không chồng nhau mà hợp của
+    chúng vẫn khớp một đường thẳng (chỉ gồm đường thẳng) hoặc một đường tròn, đến khi không gộp được nữa.
+    merges: span -> [phần đã đổi từ lần tính trước (theo phần), loại, đầu, cuối của hợp (theo phần đầu nhóm)], được
+    cập nhật tại chỗ để nhóm không đổi không phải khớp lại ở lượt sau hay lần gọi sau.
+    """
+    span = 2
+    while len(starts) >= span:
+        last_group = len(starts) - span
+        changed = merges[span][0] if span in merges else np.ones(len(starts), dtype=bool)
+        stale = np.convolve(changed, np.ones(span, dtype=int), mode='valid') > 0
+        merged_kinds = np.full(last_group + 1, -1)
+        merged_starts, merged_ends = starts[:last_group + 1].copy(), ends[span - 1:].copy()
+        if span in merges:
+            reuse = np.flatnonzero(~stale)
+            merged_kinds[reuse], merged_starts[reuse], merged_ends[reuse] = (values[reuse] for values in merges[span][1:])
+        if span == 3:
+            stale &= ends[1:-1] - starts[1:-1] + 1 < MIN_ARC_POINTS
+        groups = np.flatnonzero(stale)
+        merged_kinds[groups] = _classify(points, merged_starts[groups], merged_ends[groups], tolerance)
+        # Điểm đầu/cuối của hợp sát phần bên ngoài nhóm (điểm nối chung, hoặc điểm kề đoạn thẳng bên cạnh) có thể bỏ khỏi
+        # hợp, để lại khoảng trống chứa điểm tiếp tuyến; không bỏ điểm ở hai đầu dữ liệu
+        trimmed = groups[merged_kinds[groups] < 0]
+        first = merged_starts[trimmed] + (ends[np.maximum(trimmed - 1, 0)] >= merged_starts[trimmed] - 1) * (trimmed > 0)
+        last = merged_ends[trimmed] - (starts[np.minimum(trimmed + span, len(starts) - 1)] <= merged_ends[trimmed] + 1) * (
+            trimmed < last_group)
+        retry = last - first > 1
+        trimmed, first, last = trimmed[retry], first[retry], last[retry]
+        merged_kinds[trimmed] = _classify(points, first, last, tolerance)
+        # Hợp chỉ gồm đường thẳng mới là đường thẳng; hợp có cung là cung. Đường thẳng hai điểm nằm trọn trong phần bị bỏ
+        # chỉ được nuốt vào đường thẳng (cạnh chứa điểm tiếp tuyến), không vào cung (đoạn feed ngắn giữa hai cung)
+        has_arc = np.convolve(kinds == 1, np.ones(span, dtype=int), mode='valid') > 0
+        swallowed = (first >= ends[trimmed]) | (last <= starts[trimmed + span - 1])
+        merged_kinds[trimmed[swallowed & has_arc[trimmed]]] = -1
+        merged_starts[trimmed], merged_ends[trimmed] = first, last
+        merged_kinds[groups[(merged_kinds[groups] == 0) & has_arc[groups]]] = 1
+        merges[span] = [np.zeros(len(starts), dtype=bool), merged_kinds, merged_starts, merged_ends]
+        candidates = merged_kinds >= 0
+        if not np.any(candidates):
+            if span == 3:
+                break
+            span = 3
+            continue
+        # Trong mỗi chuỗi nhóm gộp được liền nhau, gộp các nhóm không chung phần nào: thứ nhất, thứ span + 1, ...
+        positions = np.arange(len(candidates))
+        run_starts = np.maximum.accumulate(np.where(candidates & ~np.concatenate(([False], candidates[:-1])), positions, 0))
+        selected = candidates & ((positions - run_starts) % span == 0)
+        # Điểm nối giữa hai nhóm được gộp chỉ được bỏ khỏi một trong hai hợp
+        selected[span:] &= ~(selected[:-span] & (merged_ends[:-span] < ends[span - 1:last_group])
+                             & (merged_starts[span:] > starts[span:last_group + 1]))
+        selected = np.flatnonzero(selected)
+        kinds[selected], starts[selected], ends[selected] = (merged_kinds[selected], merged_starts[selected],
+                                                            merged_ends[selected])
+        keep = np.ones(len(starts), dtype=bool)
+        for offset in range(1, span):
+            keep[selected + offset] = False
+        # Kết quả cũ theo phần đầu nhóm, sau khi bỏ các phần đã gộp; nhóm chứa phần vừa gộp được tính lại
+        num_pieces = int(keep.sum())
+        for group_span, (group_changed, *values) in merges.items():
+            group_changed[selected] = True
+            merges[group_span] = [group_changed[keep]] + [value[keep[:len(value)]][:num_pieces - group_span + 1]
+                                                          for value in values]
+        kinds, starts, ends = kinds[keep], starts[keep], ends[keep]
+        span = 2
+    return kinds, starts, ends
+
+
+def _farthest_fits(points, kinds, fixed, good, bad, tolerance):
+    """
+    Đầu mút xa nhất e từ good về phía bad (không gồm bad) sao cho đoạn giữa fixed và e còn khớp loại kinds, biết đoạn
+    giữa fixed và good khớp: bước nhảy gấp đôi từ good rồi chia đôi (phần kéo dài thường ngắn), mọi đoạn cùng lúc.
+    bad > good kéo dài điểm cuối, bad < good lùi điểm đầu.
+    """
+    good, bad = good.copy(), bad.copy()
+    directions = np.sign(bad - good)
+    steps, galloping = np.ones(len(good), dtype=int), np.ones(len(good), dtype=bool)
+    while np.any(np.abs(bad - good) > 1):
+        active = np.flatnonzero(np.abs(bad - good) > 1)
+        jumps = np.minimum(steps[active], np.abs(bad[active] - good[active]) - 1)
+        probes = np.where(galloping[active], good[active] + directions[active] * jumps, (good[active] + bad[active]) // 2)
+        fits = _fits(points, kinds[active], np.minimum(fixed[active], probes), np.maximum(fixed[active], probes),
+                     tolerance)
+        good[active[fits]], bad[active[~fits]] = probes[fits], probes[~fits]
+        steps[active[fits]] *= 2
+        galloping[active[~fits]] = False
+    return good
+
+
+def _extend_pieces(points, kinds, starts, ends, tolerance):
+    """
+    Dời điểm nối giữa các phần kề nhau về sau: phần trước đi xa nhất có thể mà vẫn khớp loại của nó, phần sau bắt đầu
+    tại điểm nối mới hoặc điểm kế tiếp (điểm tiếp tuyến nằm giữa hai điểm đo) và được phân loại lại; điểm nối chỉ được
+    dời khi phần sau vẫn khớp. Các điểm nối chẵn rồi lẻ, để mỗi phần chỉ đổi một đầu trong một lần. Trả về các phần
+    mới và các phần đã đổi.
+    """
+    changed = np.zeros(len(starts), dtype=bool)
+    for parity in (0, 1):
+        joints = np.arange(parity, len(starts) - 1, 2)
+        good = _farthest_fits(points, kinds[joints], starts[joints], ends[joints], ends[joints + 1], tolerance)
+        joints, good = joints[good > ends[joints]], good[good > ends[joints]]
+        if not len(joints):
+            continue
+        following = joints + 1
+        shared = _classify(points, good, ends[following], tolerance)
+        gap = _classify(points, np.minimum(good + 1, ends[following] - 1), ends[following], tolerance)
+        next_starts = np.where(shared >= 0, good, good + 1)
+        next_kinds = np.where(shared >= 0, shared, gap)
+        accept = (next_kinds >= 0) & (next_starts < ends[following])
+        joints, following = joints[accept], following[accept]
+        ends[joints], starts[following], kinds[following] = good[accept], next_starts[accept], next_kinds[accept]
+        changed[joints] = changed[following] = True
+    # Đoạn thẳng ngắn giữa hai cung có thể bị nuốt vào một cung khi chia: với hai cung liền nhau, như khi phân đoạn
+    # tuần tự, cung trước đi xa nhất, cung sau đổi thành đường thẳng xa nhất từ đó, và phần kế tiếp bắt đầu tại cuối
+    # đường thẳng hoặc điểm kế tiếp nếu vẫn khớp. Mỗi lần đổi ba phần nên các bộ ba cách nhau ba
+    for remainder in range(3):
+        joints = np.flatnonzero((kinds[:-2] == 1) & (kinds[1:-1] == 1))
+        joints = joints[joints % 3 == remainder]
+        good = _farthest_fits(points, kinds[joints], starts[joints], ends[joints], ends[joints + 1], tolerance)
+        following = joints + 2
+        line_ends = _farthest_fits(points, np.zeros(len(joints), dtype=int), good, good + 1, ends[following], tolerance)
+        shared = _fits(points, kinds[following], line_ends, ends[following], tolerance)
+        gap = _fits(points, kinds[following], line_ends + 1, ends[following], tolerance) & (line_ends + 1 < ends[following])
+        accept = (line_ends - good >= 2) & (shared | gap)
+        joints, good, line_ends, shared = joints[accept], good[accept], line_ends[accept], shared[accept]
+        ends[joints], kinds[joints + 1], starts[joints + 1], ends[joints + 1] = good, 0, good, line_ends
+        starts[joints + 2] = np.where(shared, line_ends, line_ends + 1)
+        changed[joints] = changed[joints + 1] = changed[joints + 2] = True
+    # Phần sau không chung điểm nối với phần trước (khoảng trống để lại khi gộp): lùi điểm đầu xa nhất có thể về phía
+    # điểm nối mà vẫn khớp, để hai đầu của mỗi phần nằm sát điểm tiếp tuyến
+    following = np.flatnonzero(starts[1:] > ends[:-1]) + 1
+    earlier = _farthest_fits(points, kinds[following], ends[following], starts[following], ends[following - 1] - 1,
+                             tolerance)
+    changed[following[earlier < starts[following]]] = True
+    starts[following] = earlier
+    return kinds, starts, ends, changed
+
+
+def _grow_pieces(points, first, last, tolerance):
+    """
+    Phân đoạn tham lam trên các đoạn [first[r], last[r]], mọi đoạn cùng lúc (từng bước dọc mỗi đoạn): mỗi phần đi xa
+    nhất có thể; cung chỉ được chọn khi nó đi xa hơn đường thẳng cả sau bước kế tiếp (đường tròn luôn ôm thêm được vài
+    điểm ở cuối đoạn thẳng) hoặc đi tới cuối đoạn; phần sau bắt đầu tại điểm cuối của phần trước hoặc điểm kế tiếp
+    (điểm tiếp tuyến nằm giữa hai điểm đo), chọn cách đi xa hơn. Trả về (kinds, starts, ends) theo thứ tự đoạn.
+    """
+    def extents(kind, starts, lasts):
+        """ Điểm cuối xa nhất (<= lasts) của phần loại kind bắt đầu tại starts; -1 nếu không khớp được """
+        kinds = np.full(len(starts), kind)
+        good = starts + (1 if kind == 0 else MIN_ARC_POINTS - 1)
+        valid = np.flatnonzero(good <= lasts)
+        valid = valid[_fits(points, kinds[valid], starts[valid], good[valid], tolerance)]
+        ends = np.full(len(starts), -1)
+        ends[valid] = _farthest_fits(points, kinds[valid], starts[valid], good[valid], lasts[valid] + 1, tolerance)
+        return ends
+
+    def reach(indices, lasts):
+        """ Điểm xa nhất đi tới được bằng một phần bắt đầu tại indices hoặc điểm kế tiếp """
+        reached = lasts.copy()
+        inner = np.flatnonzero(indices < lasts - 1)
+        reached[inner] = -1
+        for offset in (0, 1):
+            starts = indices[inner] + offset
+            reached[inner] = np.maximum.reduce((reached[inner], extents(0, starts, lasts[inner]),
+                                                extents(1, starts, lasts[inner])))
+        return reached
+
+    def choose(starts, lasts):
+        line_ends, arc_ends = extents(0, starts, lasts), extents(1, starts, lasts)
+        arcs = arc_ends > line_ends
+        ahead = np.flatnonzero(arcs & (arc_ends < lasts))
+        arcs[ahead] = reach(arc_ends[ahead], lasts[ahead]) > reach(line_ends[ahead], lasts[ahead])
+        return arcs.astype(int), np.where(arcs, arc_ends, line_ends)
+
+    kinds, ends = choose(first, last)
+    grown = [(np.arange(len(first)), kinds, first, ends)]
+    regions = np.flatnonzero(ends < last)
+    previous = ends[regions]
+    while len(regions):
+        lasts = last[regions]
+        kinds, ends = choose(previous, lasts)
+        starts = previous.copy()
+        following = np.flatnonzero(previous + 1 < lasts)
+        following_kinds, following_ends = choose(previous[following] + 1, lasts[following])
+        farther = following_ends > ends[following]
+        following = following[farther]
+        kinds[following], starts[following], ends[following] = following_kinds[farther], previous[following] + 1, \
+            following_ends[farther]
+        grown.append((regions, kinds, starts, ends))
+        regions, previous = regions[ends < lasts], ends[ends < lasts]
+    regions, kinds, starts, ends = (np.concatenate(values) for values in zip(*grown))
+    order = np.lexsort((starts, regions))
+    return kinds[order], starts[order], ends[order]
+
+
+def split_primitives(points, tolerance):
+    """
+    Phân đoạn theo lô: danh sách ['line' | 'arc', start, end] (chỉ số điểm) theo thứ tự dọc đường tâm; hai phần kề nhau
+    chung điểm nối hoặc cách nhau một khoảng chứa điểm tiếp tuyến, mọi điểm của một phần cách đường thẳng/đường tròn
+    khớp <= tolerance. Mỗi bước khớp mọi đoạn cùng lúc (fit_lines, fit_circles), không lặp Python theo điểm hay phần:
+    1. Chia từ trên xuống: đoạn chưa khớp được chia đôi tại điểm xa dây cung nhất (như Douglas-Peucker).
+    2. Gộp các phần kề nhau còn khớp chung (_merge_pieces), rồi dời điểm nối để mỗi phần đi xa nhất có thể
+       (_extend_pieces), lặp lại đến khi không còn thay đổi.
+    3. Hai cung chung điểm nối thường là một đoạn thẳng ngắn bị nuốt vào cung khi chia: phân đoạn lại tham lam
+       (_grow_pieces) từ phần trước đến phần sau của cặp cung.
+    """
+    kinds, starts, ends = np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    first, last = np.array([0]), np.array([len(points) - 1])
+    while len(first):
+        # Đoạn có điểm cách dây cung quá CHORD_LINE_FACTOR * tolerance không thể khớp đường thẳng: bỏ qua khớp thử
+        splits, chord_distances = np.zeros(len(first), dtype=int), np.zeros(len(first))
+        long = np.flatnonzero(last - first > 1)
+        if len(long):
+            splits[long], chord_distances[long] = _farthest_from_chord(points, first[long], last[long])
+        new_kinds = _classify(points, first, last, tolerance, maybe_line=chord_distances <= CHORD_LINE_FACTOR * tolerance)
+        done = new_kinds >= 0
+        kinds, starts, ends = (np.concatenate((kinds, new_kinds[done])), np.concatenate((starts, first[done])),
+                               np.concatenate((ends, last[done])))
+        # Hai điểm luôn khớp một đường thẳng: đoạn chưa khớp có ít nhất một điểm ở giữa
+        first, last, splits = first[~done], last[~done], splits[~done]
+        first, last = np.concatenate((first, splits)), np.concatenate((splits, last))
+    order = np.argsort(starts, kind='stable')
+    kinds, starts, ends = kinds[order], starts[order], ends[order]
+    merges = {}
+    while True:
+        kinds, starts, ends = _merge_pieces(points, kinds, starts, ends, tolerance, merges)
+        kinds, starts, ends, changed = _extend_pieces(points, kinds, starts, ends, tolerance)
+        if not changed.any():
+            break
+        for entry in merges.values():
+            entry[0] |= changed
+    # Mỗi vùng gồm bốn phần quanh cặp cung: các cặp cách nhau bốn được phân đoạn lại cùng lúc
+    for remainder in range(4):
+        pairs = np.flatnonzero((kinds[:-1] == 1) & (kinds[1:] == 1) & (starts[1:] <= ends[:-1]))
+        pairs = pairs[pairs % 4 == remainder]
+        if not len(pairs):
+            continue
+        lows, highs = np.maximum(pairs - 1, 0), np.minimum(pairs + 2, len(starts) - 1)
+        grown_kinds, grown_starts, grown_ends = _grow_pieces(points, starts[lows], ends[highs], tolerance)
+        keep = np.ones(len(starts), dtype=bool)
+        for offset in range(4):
+            keep[np.minimum(lows + offset, highs)] = False
+        kinds, starts, ends = (np.concatenate((kinds[keep], grown_kinds)), np.concatenate((starts[keep], grown_starts)),
+                               np.concatenate((ends[keep], grown_ends)))
+        order = np.lexsort((ends, starts))
+        kinds, starts, ends = kinds[order], starts[order], ends[order]
+    return [['arc' if kind else 'line', int(start), int(end)] for kind, start, end in zip(kinds, starts, ends)]
+
+
+def segment_primitives(points, tolerance):
+    """
+    Chia đường gấp khúc points thành các phần ['line' | 'arc', start, end] (chỉ số điểm; hai phần kề nhau chung điểm nối
+    hoặc cách nhau một cạnh chứa điểm tiếp tuyến) sao cho mọi điểm của một phần cách đường thẳng/đường tròn khớp với
+    phần đó <= tolerance. Hai đường thẳng liền nhau gần cùng hướng được gộp; gộp hai cung liền nhau cùng đường tròn.
+    Hai đường thẳng liền nhau lệch hướng được nối bằng phần ['corner', cuối đoạn trước, đầu đoạn sau]: cung có quá ít
+    điểm đo (dưới MIN_ARC_POINTS, hoặc hai đầu cung đã nằm trong tolerance của đoạn thẳng kề).
+    Ném ValueError khi hai đường thẳng gặp nhau ở góc nhọn (không có cung cách đỉnh góc quá tolerance).
+    """
+    primitives = split_primitives(points, tolerance)
+
+    # Cạnh chứa điểm tiếp tuyến giữa đoạn thẳng và cung có thể không khớp trọn vào phần nào, và phần giữa của một cung
+    # ngắn mà hai đầu đã nằm trong các đoạn thẳng kề cũng thẳng hàng: các "đoạn thẳng" quá ngắn để là một cung
+    # (dưới MIN_ARC_POINTS điểm) kề một đoạn thẳng khác bị bỏ, để lại khoảng trống giữa hai phần
+    junction_edges = [index for index, (kind, start, end) in enumerate(primitives)
+                      if kind == 'line' and end - start < MIN_ARC_POINTS - 1 and len(primitives) > 1
+                      and any(0 <= other < len(primitives) and primitives[other][0] == 'line'
+                              for other in (index - 1, index + 1))]
+    primitives = [primitive for index, primitive in enumerate(primitives) if index not in junction_edges] or primitives
+
+    # Cung gần như thẳng (đường thẳng cũng khớp mọi điểm trừ hai điểm nối) là một đoạn thẳng
+    long_arcs = [index for index, (kind, start, end) in enumerate(primitives)
+                 if kind == 'arc' and end - start > MIN_ARC_POINTS]
+    if long_arcs:
+        _, _, deviations = fit_lines(points, np.array([primitives[index][1] + 1 for index in long_arcs]),
+                                     np.array([primitives[index][2] - 1 for index in long_arcs]))
+        for index in np.array(long_arcs)[deviations <= tolerance]:
+            primitives[index][0] = 'line'
+
+    # Khớp trước theo lô mọi đường thẳng và hợp của mọi cặp cung liền nhau (theo (đầu, cuối)); vòng lặp dưới chỉ khớp
+    # lại các phần đã được gộp
+    line_fits, circle_fits = {}, {}
+    spans = [(start, end) for kind, start, end in primitives if kind == 'line']
+    if spans:
+        anchors, directions, deviations = fit_lines(points, *np.array(spans).T)
+        line_fits = dict(zip(spans, zip(anchors, directions, deviations)))
+    spans = [(first[1], second[2]) for first, second in zip(primitives, primitives[1:])
+             if first[0] == second[0] == 'arc']
+    if spans:
+        circle_fits = dict(zip(spans, zip(*fit_circles(points, *np.array(spans).T))))
+
+    def line_fit(start, end):
+        if (start, end) not in line_fits:
+            line_fits[start, end] = fit_line(points[start:end + 1])
+        return line_fits[start, end]
+
+    def circle_fit(start, end):
+        if (start, end) not in circle_fits:
+            return fit_circle(points[start:end + 1])
+        fitted = circle_fits[start, end]
+        return fitted if np.isfinite(fitted[3]) else None
+
+    merged = [primitives[0]]
+    pending = primitives[:0:-1] # Ngăn xếp các phần chưa xử lý, phần kế tiếp ở cuối
+    while pending:
+        kind, start, end = pending.pop()
+        previous = merged[-1]
+        if kind == 'line' and previous[0] == 'line':
+            first_line, second_line = line_fit(previous[1], previous[2]), line_fit(start, end)
+            angle = math.acos(min(1.0, float(np.dot(first_line[1], second_line[1]))))
+            previous_length = np.linalg.norm(points[previous[2]] - points[previous[1]])
+            length = np.linalg.norm(points[end] - points[start])
+            if angle * min(previous_length, length) <= tolerance:
+                previous[2] = end
+                continue
+            # Hai đường thẳng gặp nhau ở góc: cung ở giữa quá ngắn để khớp riêng (xem fit_corner_arc)
+            corner = fit_corner_arc(points[previous[1]:end + 1], first_line[:2], second_line[:2])
+            if corner is None or corner[3] <= tolerance:
+                # Không có cung phân biệt được ở góc: với dữ liệu nhiễu, đoạn thẳng ngắn hơn thường là một phần của
+                # cung bên cạnh bị nhận thành đường thẳng; bỏ nó (để lại khoảng trống) rồi xét lại với phần kề tiếp theo
+                if previous_length < length and len(merged) > 1:
+                    merged.pop()
+                    if merged[-1][0] == 'corner':
+                        merged.pop()
+                    pending.append([kind, start, end])
+                    continue
+                if length <= previous_length and pending:
+                    continue
+                raise ValueError(f"Góc nhọn tại điểm {start}: không có cung để khớp bán kính (hãy lấy mẫu dày hơn).")
+            merged.append(['corner', previous[2], start])
+        if kind == 'arc' and previous[0] == 'arc':
+            fitted = circle_fit(previous[1], end)
+            if fitted is not None and fitted[3] <= tolerance:
+                previous[2] = end
+                continue
+        merged.append([kind, start, end])
+    return merged
+
+
+@dataclass
+class _Program:
+    """ Chương trình đang khớp: các dòng uốn (góc rad) và một dòng thẳng cuối tùy chọn, cùng tư thế """
+    feeds: np.ndarray # (M,) Y của mọi dòng, gồm dòng thẳng cuối
+    sweeps: np.ndarray # (K,) B (rad) của các dòng uốn
+    radii: np.ndarray # (K,)
+    rotations: np.ndarray # (K,) C (rad); C của dòng uốn cuối không ảnh hưởng hình dạng
+    has_tail: bool # Dòng cuối là đoạn thẳng không uốn
+    origin: np.ndarray
+    rotation: np.ndarray
+
+    def rows(self):
+        rows = [{"Y": float(self.feeds[k]), "B": math.degrees(self.sweeps[k]), "C": math.degrees(self.rotations[k]),
+                 "Radius": float(self.radii[k])} for k in range(len(self.sweeps))]
+        if self.has_tail:
+            rows.append({"Y": float(self.feeds[-1]), "B": 0.0, "C": 0.0, "Radius": 0.0})
+        return rows
+
+
+def initial_program(points, primitives):
+    """
+    Chương trình ban đầu từ các phần đã phân đoạn (xem segment_primitives), cùng chỉ số phần của engine cho từng điểm:
+    dòng k có phần 2k (đoạn feed) và 2k + 1 (cung). Mọi đường thẳng và cung được khớp cùng lúc (fit_lines, fit_circles).
+    """
+    kinds = np.array([kind for kind, _, _ in primitives])
+    starts = np.array([start for _, start, _ in primitives])
+    ends = np.array([end for _, _, end in primitives])
+    is_line = kinds == 'line'
+    anchors, directions = np.zeros((len(primitives), 3)), np.zeros((len(primitives), 3))
+    if np.any(is_line):
+        anchors[is_line], directions[is_line], _ = fit_lines(points, starts[is_line], ends[is_line])
+    arc_index = np.flatnonzero(~is_line)
+    centers, normals, radii = np.zeros((len(arc_index), 3)), np.zeros((len(arc_index), 3)), np.zeros(len(arc_index))
+    fitted = kinds[arc_index] == 'arc'
+    if np.any(fitted):
+        centers[fitted], normals[fitted], radii[fitted], _ = fit_circles(points, starts[arc_index[fitted]],
+                                                                          ends[arc_index[fitted]])
+    for arc in np.flatnonzero(~fitted):
+        index = arc_index[arc]
+        centers[arc], normals[arc], radii[arc], _ = fit_corner_arc(
+            points[starts[index - 1]:ends[index + 1] + 1], (anchors[index - 1], directions[index - 1]),
+            (anchors[index + 1], directions[index + 1]))
+
+    def foot_on_line(index, point):
+        relative = point - anchors[index]
+        return anchors[index] + np.einsum('ij,ij->i', relative, directions[index])[:, np.newaxis] * directions[index]
+
+    def on_circle(arcs, point):
+        relative = point - centers[arcs]
+        in_plane = relative - np.einsum('ij,ij->i', relative, normals[arcs])[:, np.newaxis] * normals[arcs]
+        return centers[arcs] + in_plane * (radii[arcs] / np.linalg.norm(in_plane, axis=1))[:, np.newaxis]
+
+    def tangent(arcs, point):
+        return np.cross(normals[arcs], point - centers[arcs]) / radii[arcs, np.newaxis]
+
+    # Điểm tiếp tuyến đầu/cuối của từng cung: chân đường vuông góc từ tâm xuống đường thẳng kề,
+    # hoặc hình chiếu của điểm nối lên đường tròn khi hai cung liền nhau (Y = 0) hay ở hai đầu dữ liệu
+    arcs = np.arange(len(arc_index))
+    last_primitive = len(primitives) - 1
+    before, after = np.maximum(arc_index - 1, 0), np.minimum(arc_index + 1, last_primitive)
+    line_before = (arc_index > 0) & is_line[before]
+    line_after = (arc_index < last_primitive) & is_line[after]
+    arc_starts = on_circle(arcs, np.where(line_before[:, np.newaxis], foot_on_line(before, centers),
+                                          points[starts[arc_index]]))
+    arc_ends = on_circle(arcs, np.where(line_after[:, np.newaxis], foot_on_line(after, centers),
+                                        points[ends[arc_index]]))
+    # Góc quét: tổng góc giữa các vector bán kính liên tiếp (đúng cả khi cung > 180 độ), trên đường đi gồm điểm tiếp
+    # tuyến đầu, các điểm giữa của phần và điểm tiếp tuyến cuối
+    interior_counts = np.maximum(ends[arc_index] - starts[arc_index] - 1, 0)
+    path_offsets = np.cumsum(interior_counts + 2) - interior_counts - 2
+    path_arc = np.repeat(arcs, interior_counts + 2)
+    path = np.empty((len(path_arc), 3))
+    path[path_offsets], path[path_offsets + interior_counts + 1] = arc_starts, arc_ends
+    interior_arc = np.repeat(arcs, interior_counts)
+    rank = np.arange(len(interior_arc)) - (np.cumsum(interior_counts) - interior_counts)[interior_arc]
+    path[path_offsets[interior_arc] + 1 + rank] = points[starts[arc_index][interior_arc] + 1 + rank]
+    path -= centers[path_arc]
+    same_arc = np.flatnonzero(path_arc[:-1] == path_arc[1:])
+    steps = np.arctan2(np.einsum('ij,ij->i', np.cross(path[same_arc], path[same_arc + 1]), normals[path_arc[same_arc]]),
+                       np.einsum('ij,ij->i', path[same_arc], path[same_arc + 1]))
+    sweeps = np.maximum(np.bincount(path_arc[same_arc], weights=steps, minlength=len(arcs)), MIN_SWEEP_RAD)
+
+    first, last = np.array([0]), np.array([last_primitive])
+    start_point = (foot_on_line(first, points[:1]) if is_line[0] else on_circle(first, points[:1]))[0]
+    has_tail = bool(is_line[-1])
+    end_point = foot_on_line(last, points[-1:])[0] if has_tail else None
+    # Y: từ cuối cung trước (hoặc điểm đầu) đến điểm tiếp tuyến đầu cung, dọc tiếp tuyến tại đó;
+    # C: góc giữa pháp tuyến của hai cung liền nhau quanh tiếp tuyến cuối cung trước
+    previous_ends = np.vstack((start_point, arc_ends[:-1]))
+    feeds = np.maximum(np.einsum('ij,ij->i', arc_starts - previous_ends, tangent(arcs, arc_starts)), 0.0)
+    if has_tail:
+        previous_end = arc_ends[-1] if len(arcs) else start_point
+        feeds = np.append(feeds, max(0.0, float(np.dot(end_point - previous_end, directions[last_primitive]))))
+    end_tangents = tangent(arcs[:-1], arc_ends[:-1])
+    rotations = np.append(np.arctan2(np.einsum('ij,ij->i', np.cross(normals[:-1], normals[1:]), end_tangents),
+                                     np.einsum('ij,ij->i', normals[:-1], normals[1:])), 0.0)[:len(arcs)]
+
+    if len(arcs):
+        initial_direction = directions[0] if is_line[0] else tangent(first, start_point[np.newaxis])[0]
+        initial_up = normals[0] - np.dot(normals[0], initial_direction) * initial_direction
+        initial_up /= np.linalg.norm(initial_up)
+    else:
+        initial_direction = directions[0]
+        initial_up = _perpendicular(initial_direction)
+
+    # Phần của engine cho từng điểm: đoạn thẳng trước cung k là phần 2k, cung k là 2k + 1, đoạn thẳng cuối là 2K;
+    # điểm trong khoảng trống giữa hai phần thuộc phần trước nó (được gán lại khi tinh chỉnh)
+    labels = 2 * (np.cumsum(~is_line) - ~is_line) + ~is_line
+    pieces = labels[np.maximum(np.searchsorted(starts, np.arange(len(points)), side='right') - 1, 0)].astype(np.int64)
+    program = _Program(
+        feeds=feeds, sweeps=sweeps, radii=radii, rotations=rotations, has_tail=has_tail, origin=start_point.copy(),
+        rotation=np.column_stack((initial_direction, np.cross(initial_up, initial_direction), initial_up))
+    )
+    return program, pieces
+
+
+@dataclass
+class _Model:
+    """ Hình học của chương trình trong hệ đo, từ checkpoints của engine; dòng k: feed từ starts[k] đến feed_ends[k] """
+    starts: np.ndarray # (M, 3)
+    directions: np.ndarray # (M, 3) hướng trong đoạn feed
+    ups: np.ndarray # (M, 3) Up của mặt phẳng uốn (vuông góc với directions)
+    feeds: np.ndarray # (M,)
+    feed_ends: np.ndarray # (M, 3) điểm tiếp tuyến đầu cung
+    ends: np.ndarray # (M, 3) điểm cuối dòng (cuối cung)
+    directions_after: np.ndarray # (M, 3) hướng sau cung
+    sweeps: np.ndarray # (M,) 0 với dòng thẳng
+    radii: np.ndarray # (M,)
+    centers: np.ndarray # (M, 3)
+
+    @property
+    def num_pieces(self):
+        return 2 * len(self.feeds)
+
+
+def _model_from_states(program, positions, directions, ups):
+    """ _Model từ trạng thái trước mỗi dòng (và sau dòng cuối) trong hệ của engine: positions, directions (M+1, 3), ups (M, 3) """
+    positions = program.origin + positions @ program.rotation.T
+    directions = directions @ program.rotation.T
+    ups = ups @ program.rotation.T
+    num_rows = len(program.feeds)
+    sweeps = np.zeros(num_rows)
+    radii = np.zeros(num_rows)
+    sweeps[:len(program.sweeps)] = program.sweeps
+    radii[:len(program.radii)] = program.radii
+    feed_ends = positions[:-1] + program.feeds[:, np.newaxis] * directions[:-1]
+    return _Model(
+        starts=positions[:-1], directions=directions[:-1], ups=ups, feeds=program.feeds, feed_ends=feed_ends,
+        ends=positions[1:], directions_after=directions[1:], sweeps=sweeps, radii=radii,
+        centers=feed_ends + radii[:, np.newaxis] * np.cross(ups, directions[:-1])
+    )
+
+
+def evaluate_model(program):
+    """ Chạy engine với chương trình và đưa trạng thái từng dòng về hệ đo; None nếu engine báo lỗi """
+    result = compute_centerline({"YBC": program.rows(), "Checkpoints": True, "NumArcPoints": 1})
+    if result.error:
+        return None
+    checkpoints = result.checkpoints
+    return _model_from_states(program, checkpoints["point"], checkpoints["direction"], checkpoints["up"][:-1])
+
+
+def chain_model(program):
+    """
+    Như evaluate_model nhưng tính thẳng chuỗi phép dời hình của các dòng (cùng quy ước với engine) thay vì chạy engine
+    từng dòng: dùng trong vòng lặp tinh chỉnh, nơi mô hình được tính lại sau mỗi bước thử.
+    Trong khung (D, U, D x U) trước dòng: feed Y dọc D; uốn B quanh U với tâm ở -Radius * (D x U); xoay C quanh hướng mới.
+    """
+    num_rows = len(program.feeds)
+    num_bends = len(program.sweeps)
+    sweeps, radii, rotations = np.zeros(num_rows), np.zeros(num_rows), np.zeros(num_rows)
+    # Engine bỏ qua lần uốn có B hoặc Radius ~0 (nhưng vẫn xoay C)
+    bent = (np.abs(program.sweeps) > math.radians(1e-6)) & (program.radii >= 1e-9)
+    sweeps[:num_bends] = np.where(bent, program.sweeps, 0.0)
+    radii[:num_bends] = program.radii
+    rotations[:num_bends] = program.rotations
+    cos_b, sin_b, cos_c, sin_c = np.cos(sweeps), np.sin(sweeps), np.cos(rotations), np.sin(rotations)
+    # Cột: D, U, D x U sau dòng, theo khung trước dòng
+    turns = np.empty((num_rows, 3, 3))
+    turns[:, :, 0] = np.column_stack((cos_b, np.zeros(num_rows), -sin_b))
+    turns[:, :, 1] = np.column_stack((sin_b * sin_c, cos_c, cos_b * sin_c))
+    turns[:, :, 2] = np.column_stack((sin_b * cos_c, -sin_c, cos_b * cos_c))
+    moves = np.column_stack((program.feeds + radii * sin_b, np.zeros(num_rows), radii * (cos_b - 1.0)))
+    frames = np.empty((num_rows + 1, 3, 3))
+    frames[0] = np.column_stack(((1.0, 0.0, 0.0), (0.0, 0.0, 1.0), (0.0, -1.0, 0.0))) # Hướng +X, Up +Z
+    for k in range(num_rows):
+        frames[k + 1] = frames[k] @ turns[k]
+    positions = np.concatenate((np.zeros((1, 3)), np.cumsum(np.einsum('kij,kj->ki', frames[:-1], moves), axis=0)))
+    return _model_from_states(program, positions, frames[:, :, 0], frames[:-1, :, 1])
+
+
+def closest_points(points, pieces, model):
+    """
+    Điểm gần nhất trên phần pieces (N,) của mô hình cho từng điểm đo. Trả về (closest (N, 3), distances (N,),
+    basis (N, 2, 3): hai vector đơn vị của mặt phẳng pháp tuyến, vector thứ hai bằng 0 khi điểm gần nhất là đầu mút,
+    at_end (N,): điểm gần nhất là đầu mút cuối của phần).
+    """
+    rows = pieces // 2
+    on_arc = pieces % 2 == 1
+    closest = np.empty_like(points)
+    tangents = np.empty_like(points)
+    fallback_normals = np.empty_like(points) # Dùng khi điểm đo nằm đúng trên đường tâm
+    interior = np.empty(len(points), dtype=bool)
+    at_end = np.empty(len(points), dtype=bool)
+
+    feed = ~on_arc
+    feed_rows = rows[feed]
+    directions = model.directions[feed_rows]
+    along = np.einsum('ij,ij->i', points[feed] - model.starts[feed_rows], directions)
+    lengths = model.feeds[feed_rows]
+    closest[feed] = model.starts[feed_rows] + np.clip(along, 0.0, lengths)[:, np.newaxis] * directions
+    tangents[feed] = directions
+    fallback_normals[feed] = model.ups[feed_rows]
+    interior[feed] = (along > 0) & (along < lengths)
+    at_end[feed] = along >= lengths
+
+    if on_arc.any():
+        arc_rows = rows[on_arc]
+        centers, ups, radii = model.centers[arc_rows], model.ups[arc_rows], model.radii[arc_rows]
+        relative = points[on_arc] - centers
+        start_radials = (model.feed_ends[arc_rows] - centers) / radii[:, np.newaxis]
+        radials, in_plane_lengths = _unit_rows(relative - np.einsum('ij,ij->i', relative, ups)[:, np.newaxis] * ups)
+        radials[in_plane_lengths <= 1e-12] = start_radials[in_plane_lengths <= 1e-12]
+        angles = np.mod(np.arctan2(np.einsum('ij,ij->i', np.cross(start_radials, radials), ups),
+                                   np.einsum('ij,ij->i', start_radials, radials)), 2.0 * np.pi)
+        sweeps = model.sweeps[arc_rows]
+        beyond = angles > sweeps
+        to_end = beyond & (angles - sweeps < 2.0 * np.pi - angles)
+        arc_closest = centers + radii[:, np.newaxis] * radials
+        arc_closest[to_end] = model.ends[arc_rows[to_end]]
+        arc_closest[beyond & ~to_end] = model.feed_ends[arc_rows[beyond & ~to_end]]
+        closest[on_arc] = arc_closest
+        tangents[on_arc] = np.cross(ups, radials)
+        fallback_normals[on_arc] = radials
+        interior[on_arc] = ~beyond
+        at_end[on_arc] = to_end
+
+    normals, distances = _unit_rows(points - closest)
+    normals[distances <= 1e-12] = fallback_normals[distances <= 1e-12]
+    basis = np.stack((normals, np.cross(tangents, normals) * interior[:, np.newaxis]), axis=1)
+    return closest, distances, basis, at_end
+
+
+def _piece_spheres(model):
+    """
+    Mặt cầu bao từng phần (tâm (2M, 3), bán kính (2M,)): đoạn feed trong mặt cầu đường kính là chính nó, cung không quá
+    180 độ trong mặt cầu đường kính là dây cung (mọi điểm trên cung nhìn dây cung dưới góc >= 90 độ), cung lớn hơn trong
+    mặt cầu cùng tâm với đường tròn.
+    """
+    centers = np.empty((model.num_pieces, 3))
+    radii = np.empty(model.num_pieces)
+    centers[0::2] = (model.starts + model.feed_ends) / 2.0
+    radii[0::2] = model.feeds / 2.0
+    large = model.sweeps > np.pi
+    centers[1::2] = np.where(large[:, np.newaxis], model.centers, (model.feed_ends + model.ends) / 2.0)
+    radii[1::2] = np.where(large, model.radii, np.linalg.norm(model.ends - model.feed_ends, axis=1) / 2.0)
+    return centers, radii
+
+
+def assign_pieces(points, pieces, model):
+    """
+    Gán lại mỗi điểm cho phần gần nhất trong các phần cách phần hiện tại không quá 2 (điểm tiếp tuyến di chuyển).
+    Chỉ tính khoảng cách đến phần có mặt cầu bao gần hơn khoảng cách hiện tại (thường chỉ các điểm gần chỗ nối).
+    """
+    num_rows = len(model.feeds)
+    best_pieces = pieces.copy()
+    best_distances = np.full(len(points), np.inf)
+    sphere_centers, sphere_radii = _piece_spheres(model)
+    for shift in (0, -1, 1, -2, 2):
+        candidates = np.clip(pieces + shift, 0, model.num_pieces - 1)
+        # Phần cung của dòng thẳng không tồn tại
+        candidates = np.where((candidates % 2 == 1) & (model.sweeps[np.minimum(candidates // 2, num_rows - 1)] <= 0),
+                              candidates - 1, candidates)
+        bounds = np.linalg.norm(points - sphere_centers[candidates], axis=1) - sphere_radii[candidates]
+        near = np.flatnonzero(bounds < best_distances)
+        if len(near) == 0:
+            continue
+        distances = closest_points(points[near], candidates[near], model)[1]
+        better = distances < best_distances[near]
+        best_pieces[near[better]] = candidates[near[better]]
+        best_distances[near[better]] = distances[better]
+    return best_pieces, best_distances
+
+
+def _piece_order(pieces):
+    """ Thứ tự sắp xếp điểm theo phần (None khi pieces đã tăng dần, trường hợp thường gặp) và vị trí đầu mỗi phần """
+    order = None if np.all(pieces[1:] >= pieces[:-1]) else np.argsort(pieces, kind='stable')
+    sorted_pieces = pieces if order is None else pieces[order]
+    return order, sorted_pieces, np.flatnonzero(np.diff(sorted_pieces, prepend=-1))
+
+
+def _sum_by_piece(values, pieces, num_pieces):
+    """ Tổng values (N, ...) theo chỉ số phần pieces (N,): mảng (num_pieces, ...) """
+    order, sorted_pieces, firsts = _piece_order(pieces)
+    flat = values.reshape(len(values), -1)
+    sums = np.zeros((num_pieces, flat.shape[1]))
+    sums[sorted_pieces[firsts]] = np.add.reduceat(flat if order is None else flat[order], firsts, axis=0)
+    return sums.reshape((num_pieces,) + values.shape[1:])
+
+
+def _gram_by_piece(rows, pieces, num_pieces):
+    """
+    Tổng rows[n]^T rows[n] theo phần (rows (N, R, C) -> (num_pieces, C, C)). Các điểm của mỗi phần được xếp thành khối
+    GRAM_CHUNK_POINTS điểm (đệm 0), nhân ma trận theo lô rồi cộng các khối: không tạo mảng (N, C, C).
+    """
+    order, sorted_pieces, firsts = _piece_order(pieces)
+    if order is not None:
+        rows = rows[order]
+    counts = np.diff(np.append(firsts, len(pieces)))
+    chunk_counts = -(-counts // GRAM_CHUNK_POINTS)
+    chunk_firsts = np.concatenate(([0], np.cumsum(chunk_counts)[:-1]))
+    piece_of = np.repeat(np.arange(len(firsts)), counts)
+    positions = np.arange(len(pieces)) - firsts[piece_of]
+    padded = np.zeros((int(chunk_counts.sum()), GRAM_CHUNK_POINTS) + rows.shape[1:])
+    padded[chunk_firsts[piece_of] + positions // GRAM_CHUNK_POINTS, positions % GRAM_CHUNK_POINTS] = rows
+    padded = padded.reshape(len(padded), -1, rows.shape[2])
+    sums = np.zeros((num_pieces, rows.shape[2], rows.shape[2]))
+    sums[sorted_pieces[firsts]] = np.add.reduceat(np.matmul(np.swapaxes(padded, 1, 2), padded), chunk_firsts, axis=0)
+    return sums
+
+
+def _block_tridiagonal_solve(diagonal, lower, upper, rhs):
+    """
+    Nghiệm của hệ ba đường chéo khối lower[k] y[k-1] + diagonal[k] y[k] + upper[k] y[k+1] = rhs[k] (lower[0], upper[-1]
+    bỏ qua) bằng rút gọn tuần hoàn (cyclic reduction): khử các khối lẻ theo hai khối chẵn kề bên cùng lúc cho mọi khối,
+    còn lại hệ cùng dạng trên các khối chẵn. log2(số khối) mức, mỗi mức là các phép toán NumPy theo lô trên các khối.
+    Ném np.linalg.LinAlgError nếu một khối suy biến.
+    """
+    count = len(diagonal)
+    if count == 1:
+        return np.linalg.solve(diagonal, rhs[:, :, np.newaxis])[:, :, 0]
+    size = diagonal.shape[1]
+    num_even, num_odd = (count + 1) // 2, count // 2
+    # y[lẻ] = odd_rhs - odd_lower @ y[lẻ - 1] - odd_upper @ y[lẻ + 1]
+    solved = np.linalg.solve(diagonal[1::2], np.concatenate((lower[1::2], upper[1::2], rhs[1::2, :, np.newaxis]), axis=2))
+    odd_lower, odd_upper, odd_rhs = solved[:, :, :size], solved[:, :, size:2 * size], solved[:, :, 2 * size]
+    reduced_diagonal, reduced_rhs = diagonal[0::2].copy(), rhs[0::2].copy()
+    reduced_lower, reduced_upper = np.zeros_like(reduced_diagonal), np.zeros_like(reduced_diagonal)
+    left = lower[2::2] # Khối chẵn 2e (e >= 1) với khối lẻ 2e - 1 bên trái
+    reduced_diagonal[1:] -= left @ odd_upper[:num_even - 1]
+    reduced_lower[1:] = -left @ odd_lower[:num_even - 1]
+    reduced_rhs[1:] -= np.einsum('kij,kj->ki', left, odd_rhs[:num_even - 1])
+    right = upper[0::2][:num_odd] # Khối chẵn 2e với khối lẻ 2e + 1 bên phải
+    reduced_diagonal[:num_odd] -= right @ odd_lower
+    reduced_upper[:num_odd] = -right @ odd_upper
+    reduced_rhs[:num_odd] -= np.einsum('kij,kj->ki', right, odd_rhs)
+    even = _block_tridiagonal_solve(reduced_diagonal, reduced_lower, reduced_upper, reduced_rhs)
+    odd = odd_rhs - np.einsum('kij,kj->ki', odd_lower, even[:num_odd])
+    odd[:num_even - 1] -= np.einsum('kij,kj->ki', odd_upper[:num_even - 1], even[1:])
+    solution = np.empty_like(rhs)
+    solution[0::2], solution[1::2] = even, odd
+    return solution
+
+
+@dataclass
+class _ChainSystem:
+    """
+    Hệ phương trình chuẩn của normal_equations dưới dạng chuỗi: biến trạng thái Omega_k (6) là tổng twist của mọi tham số
+    đứng trước dòng k (tư thế và các dòng 0..k-1), điều khiển u_k (4) là Y, Radius, B, C của dòng k
+    (cột không có tham số được đệm). Sai số trên các phần của dòng k chỉ phụ thuộc (Omega_k, u_k), và
+    Omega_{k+1} = Omega_k + twists[k] @ u_k. Giữ Omega_k làm ẩn với ràng buộc đó (nhân tử lambda_k), hệ KKT của
+    (J^T J + damping * D) x = -J^T r là hệ ba đường chéo khối 16x16 (lambda_{k-1}, Omega_k, u_k), giải đúng bằng
+    _block_tridiagonal_solve: thời gian và bộ nhớ tuyến tính theo số dòng, không có vòng lặp Python theo dòng.
+    """
+    stage_hessians: np.ndarray # (M, 10, 10) theo (Omega_k, u_k)
+    stage_gradients: np.ndarray # (M, 10)
+    twists: np.ndarray # (M, 6, 4) twist của Y, Radius, B, C của dòng k (cột 0 với tham số không có)
+    pose_hessian: np.ndarray # (6, 6) của tư thế (đầu mút điểm đầu)
+    pose_gradient: np.ndarray # (6,)
+    pose_twists: np.ndarray # (6, 6) Omega_0 = pose_twists @ tham số tư thế
+    parameters: np.ndarray # (M, 4) chỉ số của Y, Radius, B, C trong vector tham số phẳng, -1 khi không có
+    diagonal: np.ndarray # Đường chéo của J^T J theo vector tham số phẳng (thang đo của damping)
+
+    def matrix(self):
+        """ J^T J và J^T r đầy đủ (chỉ để kiểm tra với số dòng nhỏ): Omega_k = (ma trận tiền tố) @ x """
+        num_parameters = len(self.diagonal)
+        jtj = np.zeros((num_parameters, num_parameters))
+        jtr = np.zeros(num_parameters)
+        prefix = np.zeros((6, num_parameters))
+        prefix[:, :POSE_PARAMETERS] = self.pose_twists
+        jtj[:POSE_PARAMETERS, :POSE_PARAMETERS] += self.pose_hessian
+        jtr[:POSE_PARAMETERS] += self.pose_gradient
+        for hessian, gradient, twists, columns in zip(self.stage_hessians, self.stage_gradients, self.twists,
+                                                      self.parameters):
+            present = columns >= 0
+            selection = np.zeros((10, num_parameters))
+            selection[:6] = prefix
+            selection[6 + np.flatnonzero(present), columns[present]] = 1.0
+            jtj += selection.T @ hessian @ selection
+            jtr += selection.T @ gradient
+            prefix[:, columns[present]] += twists[:, present]
+        return jtj, jtr
+
+    def gradient(self):
+        """ J^T r theo vector tham số phẳng: tham số của dòng k nhận tổng gradient theo Omega của mọi dòng sau k """
+        state_gradients = self.stage_gradients[:, :6]
+        after = np.concatenate((np.cumsum(state_gradients[:0:-1], axis=0)[::-1], np.zeros((1, 6)))) # Tổng từ dòng k + 1
+        gradient = np.zeros(len(self.diagonal))
+        gradient[:POSE_PARAMETERS] = self.pose_gradient + self.pose_twists.T @ state_gradients.sum(axis=0)
+        row_gradients = self.stage_gradients[:, 6:] + np.einsum('kij,ki->kj', self.twists, after)
+        present = self.parameters >= 0
+        gradient[self.parameters[present]] = row_gradients[present]
+        return gradient
+
+    def solve(self, damping, fixed_pose=False):
+        """
+        Bước x của (J^T J + damping * diag(diagonal)) x = -J^T r, hoặc chỉ theo các tham số dòng (tư thế giữ nguyên) khi
+        fixed_pose; ném np.linalg.LinAlgError nếu hệ suy biến.
+        Khối k, theo hàng: ràng buộc Omega_k - Omega_{k-1} - twists[k-1] u_{k-1} = 0, rồi đạo hàm theo Omega_k và u_k.
+        Tư thế p được khử vào khối 0: Omega_0 = pose_twists p với (H_p + damping) p + g_p = pose_twists^T lambda_{-1}.
+        """
+        num_rows = len(self.stage_hessians)
+        present = self.parameters >= 0
+        control_damping = np.where(present, damping * self.diagonal[np.maximum(self.parameters, 0)], 1.0)
+        identity = np.eye(6)
+        diagonal = np.zeros((num_rows, 16, 16))
+        diagonal[:, :6, 6:12] = identity
+        diagonal[:, 6:12, :6] = identity
+        diagonal[:, 6:, 6:] = self.stage_hessians
+        diagonal[:, np.arange(12, 16), np.arange(12, 16)] += control_damping
+        upper = np.zeros((num_rows, 16, 16))
+        upper[:-1, 6:12, :6] = -identity
+        upper[:-1, 12:, :6] = -np.swapaxes(self.twists[:-1], 1, 2)
+        lower = np.zeros((num_rows, 16, 16))
+        lower[1:] = np.swapaxes(upper[:-1], 1, 2)
+        rhs = np.zeros((num_rows, 16))
+        rhs[:, 6:] = -self.stage_gradients
+        if not fixed_pose:
+            pose_system = self.pose_hessian + np.diag(damping * self.diagonal[:POSE_PARAMETERS])
+            diagonal[0, :6, :6] = -self.pose_twists @ np.linalg.solve(pose_system, self.pose_twists.T)
+            rhs[0, :6] = -self.pose_twists @ np.linalg.solve(pose_system, self.pose_gradient)
+        solution = _block_tridiagonal_solve(diagonal, lower, upper, rhs)
+
+        step = np.empty(len(self.diagonal))
+        step[:POSE_PARAMETERS] = 0.0 if fixed_pose else \
+            np.linalg.solve(pose_system, self.pose_twists.T @ solution[0, :6] - self.pose_gradient)
+        step[self.parameters[present]] = solution[:, 12:][present]
+        return step
+
+
+def normal_equations(points, pieces, program, model):
+    """
+    J^T J và J^T r của sai số điểm (hai thành phần trong mặt phẳng pháp tuyến) và sai số hai đầu mút, theo các tham số
+    [tịnh tiến (3), xoay quanh origin (3), rồi Y_k, Radius_k, B_k (rad), C_k (rad) của từng dòng uốn, Y của dòng thẳng cuối].
+    Tham số p làm mọi phần có chỉ số >= first_piece[p] chuyển động cứng với vận tốc omega x x + velocity (twist xi_p),
+    nên sai số của điểm trên phần i tuyến tính theo tổng twist Omega_i của các tham số đứng trước: -g . Omega_i với
+    g = (x × n, n). Ngoài ra Y, Radius, B có đạo hàm riêng trên phần của chính dòng đó (điểm chạm đầu mút, bán kính cung).
+    Trả về (_ChainSystem, tổng bình phương sai số).
+    """
+    num_bends = len(program.sweeps)
+    num_rows = len(program.feeds)
+    num_pieces = model.num_pieces
+    closest, distances, basis, at_end = closest_points(points, pieces, model)
+
+    # Theo phần: khối của Omega (J = -g), của tham số riêng (J = l) và khối chéo
+    residuals = np.stack((distances, np.zeros(len(points))), axis=1)
+    g = np.concatenate((np.cross(closest[:, np.newaxis, :], basis), basis), axis=2) # (N, 2, 6)
+    rows = pieces // 2
+    row_index = np.minimum(rows, num_rows - 1)
+    on_feed = pieces % 2 == 0
+    # Vận tốc điểm gần nhất theo tham số riêng: Y trên phần feed, Radius và B trên phần cung
+    local_velocities = np.stack((
+        model.directions[row_index] * (at_end & on_feed)[:, np.newaxis],
+        (closest - model.feed_ends[row_index]) / np.where(model.radii > 0, model.radii, 1.0)[row_index][:, np.newaxis],
+        np.cross(model.ups[row_index], model.ends[row_index] - model.centers[row_index]) * at_end[:, np.newaxis],
+    ), axis=1) # (N, 3, 3)
+    local_values = -np.einsum('nkj,nlj->nkl', basis, local_velocities) # (N, 2, 3): l = -n . v
+    piece_hessians = np.zeros((num_pieces, 9, 9)) # Theo (Omega, Y, Radius, B)
+    piece_gradients = np.zeros((num_pieces, 9))
+    extended = np.concatenate((-g, local_values), axis=2) # (N, 2, 9)
+    piece_hessians += _gram_by_piece(extended, pieces, num_pieces)
+    piece_gradients += _sum_by_piece(np.einsum('nki,nk->ni', extended, residuals), pieces, num_pieces)
+
+    # Điểm cuối: sai số -(A . Omega + V . tham số riêng) với A . Omega = omega x e + velocity
+    end_point = model.ends[-1]
+    end_piece = num_pieces - 2 if program.has_tail else num_pieces - 1
+    last_row = num_rows - 1
+    end_jacobian = np.zeros((3, 9))
+    end_jacobian[:, :3] = _skew(end_point)
+    end_jacobian[:, 3:6] = -np.eye(3)
+    if end_piece % 2 == 0:
+        end_jacobian[:, 6] = -model.directions[last_row]
+    else:
+        end_jacobian[:, 7] = -(end_point - model.feed_ends[last_row]) / model.radii[last_row]
+        end_jacobian[:, 8] = -np.cross(model.ups[last_row], end_point - model.centers[last_row])
+    end_residual = points[-1] - end_point
+    piece_hessians[end_piece] += end_jacobian.T @ end_jacobian
+    piece_gradients[end_piece] += end_jacobian.T @ end_residual
+
+    # Twist của từng tham số dòng: (omega, velocity - omega x điểm trên trục)
+    twists = np.zeros((num_rows, 6, 4))
+    twists[:, 3:, 0] = model.directions # Y: tịnh tiến các phần sau feed
+    bends = np.arange(num_bends)
+    twists[bends, 3:, 1] = (model.ends[bends] - model.feed_ends[bends]) / model.radii[bends, np.newaxis] # Radius
+    twists[bends, :3, 2] = model.ups[bends] # B: quay quanh trục uốn qua tâm cung
+    twists[bends, 3:, 2] = -np.cross(model.ups[bends], model.centers[bends])
+    rotated = bends[:-1] # C: quay quanh hướng ống tại cuối cung (C của dòng uốn cuối không ảnh hưởng hình dạng)
+    twists[rotated, :3, 3] = model.directions_after[rotated]
+    twists[rotated, 3:, 3] = -np.cross(model.directions_after[rotated], model.ends[rotated])
+
+    # Khối của dòng k theo (Omega_k, Y, Radius, B, C): phần feed theo (Omega_k, Y), phần cung theo
+    # (Omega_k + twist_Y * Y, Radius, B)
+    stage_hessians = np.zeros((num_rows, 10, 10))
+    stage_gradients = np.zeros((num_rows, 10))
+    feed_index = [0, 1, 2, 3, 4, 5, 6]
+    stage_hessians[:, :7, :7] = piece_hessians[0::2][:, feed_index][:, :, feed_index]
+    stage_gradients[:, :7] = piece_gradients[0::2][:, feed_index]
+    arc_map = np.zeros((num_rows, 8, 10))
+    arc_map[:, :6, :6] = np.eye(6)
+    arc_map[:, :6, 6] = twists[:, :, 0]
+    arc_map[:, 6, 7] = 1.0
+    arc_map[:, 7, 8] = 1.0
+    arc_index = [0, 1, 2, 3, 4, 5, 7, 8]
+    arc_hessians = piece_hessians[1::2][:, arc_index][:, :, arc_index]
+    stage_hessians += np.einsum('kai,kab,kbj->kij', arc_map, arc_hessians, arc_map)
+    stage_gradients += np.einsum('kai,ka->ki', arc_map, piece_gradients[1::2][:, arc_index])
+
+    # Chỉ số trong vector tham số phẳng (thứ tự của _apply_step)
+    parameters = np.full((num_rows, 4), -1, dtype=np.int64)
+    index = POSE_PARAMETERS
+    for k in range(num_bends):
+        width = 4 if k + 1 < num_bends else 3
+        parameters[k, :width] = np.arange(index, index + width)
+        index += width
+    if program.has_tail:
+        parameters[-1, 0] = index
+        index += 1
+
+    # Tư thế: Omega_0 = pose_twists @ (tịnh tiến, xoay quanh origin); điểm đầu có sai số -(tịnh tiến)
+    pose_twists = np.zeros((6, 6))
+    pose_twists[3:, :3] = np.eye(3)
+    pose_twists[:3, 3:] = np.eye(3)
+    pose_twists[3:, 3:] = _skew(program.origin)
+    start_residual = points[0] - program.origin
+    pose_hessian = np.zeros((6, 6))
+    pose_hessian[:3, :3] = np.eye(3)
+    pose_gradient = np.zeros(6)
+    pose_gradient[:3] = -start_residual
+
+    # Đường chéo của J^T J: tham số riêng trên phần của chính nó cộng twist trên mọi phần sau (tổng hậu tố)
+    suffix_hessians = np.concatenate((np.cumsum(piece_hessians[::-1, :6, :6], axis=0)[::-1], np.zeros((1, 6, 6))))
+    diagonal = np.zeros(index)
+    diagonal[:POSE_PARAMETERS] = np.einsum('ip,ij,jp->p', pose_twists, suffix_hessians[0], pose_twists) + \
+        np.diag(pose_hessian)
+    first_after = np.stack((2 * np.arange(num_rows) + 1,) + (2 * np.arange(num_rows) + 2,) * 3, axis=1) # (M, 4)
+    row_diagonal = np.einsum('kpi,kpij,kpj->kp', np.swapaxes(twists, 1, 2), suffix_hessians[first_after],
+                             np.swapaxes(twists, 1, 2))
+    row_diagonal[:, 0] += piece_hessians[0::2, 6, 6]
+    row_diagonal[:, 1] += piece_hessians[1::2, 7, 7]
+    row_diagonal[:, 2] += piece_hessians[1::2, 8, 8]
+    present = parameters >= 0
+    diagonal[parameters[present]] = row_diagonal[present]
+    diagonal += 1e-12 * max(float(diagonal.max()), 1e-300)
+
+    cost = float(np.dot(distances, distances) + np.dot(start_residual, start_residual) + np.dot(end_residual, end_residual))
+    system = _ChainSystem(stage_hessians=stage_hessians, stage_gradients=stage_gradients, twists=twists,
+                          pose_hessian=pose_hessian, pose_gradient=pose_gradient, pose_twists=pose_twists,
+                          parameters=parameters, diagonal=diagonal)
+    return system, cost
+
+
+def _fit_cost(points, distances, model, program):
+    """ Tổng bình phương sai số (cùng định nghĩa với normal_equations) từ khoảng cách distances của các điểm đo """
+    start_error = points[0] - program.origin
+    end_error = points[-1] - model.ends[-1]
+    return float(np.dot(distances, distances) + np.dot(start_error, start_error) + np.dot(end_error, end_error))
+
+
+def _apply_step(program, step, min_radius):
+    """ Chương trình sau bước step (cùng thứ tự tham số với normal_equations); Y >= 0, Radius >= min_radius, 0 < B <= 360 """
+    num_bends = len(program.sweeps)
+    feeds = program.feeds.copy()
+    sweeps, radii, rotations = program.sweeps.copy(), program.radii.copy(), program.rotations.copy()
+    index = POSE_PARAMETERS
+    for k in range(num_bends):
+        feeds[k] += step[index]
+        radii[k] += step[index + 1]
+        sweeps[k] += step[index + 2]
+        index += 3
+        if k + 1 < num_bends:
+            rotations[k] += step[index]
+            index += 1
+    if program.has_tail:
+        feeds[-1] += step[index]
+    # Không để Radius về 0 trong một bước: tối đa giảm 10 lần
+    radii = np.maximum(np.maximum(radii, program.radii * 0.1), min_radius)
+    return _Program(feeds=np.maximum(feeds, 0.0), sweeps=np.clip(sweeps, MIN_SWEEP_RAD, 2.0 * np.pi), radii=radii,
+                    rotations=rotations, has_tail=program.has_tail, origin=program.origin + step[:3],
+                    rotation=_rotation_matrix(step[3:6]) @ program.rotation)
+
+
+def refine_program(points, program, pieces, tolerance, fixed_pose=False, relative_decrease=REFINE_RELATIVE_DECREASE):
+    """
+    Levenberg-Marquardt trên mọi tham số (xem normal_equations); các điểm được gán lại phần gần nhất sau mỗi bước.
+    Mỗi bước giải hệ chuỗi bằng _ChainSystem.solve và tính mô hình bằng chain_model: chi phí tuyến tính theo số dòng.
+    Dừng khi tổng bình phương sai số giảm (thực tế, hoặc theo mô hình tuyến tính của bước) ít hơn relative_decrease
+    lần chính nó, hoặc khi sai số đã ở mức làm tròn (REFINE_NEGLIGIBLE_RESIDUAL * tolerance).
+    Bán kính không nhỏ hơn tolerance (cung nhỏ hơn không phân biệt được với góc nhọn).
+    Trả về (program, pieces, model) tốt nhất.
+    """
+    model = chain_model(program)
+    pieces, _ = assign_pieces(points, pieces, model)
+    negligible_cost = len(points) * (REFINE_NEGLIGIBLE_RESIDUAL * tolerance) ** 2
+    damping = 1e-3
+    for _ in range(MAX_REFINE_ITERATIONS):
+        system, cost = normal_equations(points, pieces, program, model)
+        if cost <= negligible_cost:
+            break
+        gradient = system.gradient()
+        improved = False
+        while damping < 1e12:
+            try:
+                step = system.solve(damping, fixed_pose)
+            except np.linalg.LinAlgError:
+                damping *= 10.0
+                continue
+            # Mức giảm theo mô hình tuyến tính: -2 g.x - x.JTJ.x = -g.x + damping * x.D.x
+            predicted = float(damping * np.dot(system.diagonal * step, step) - np.dot(gradient, step))
+            if predicted <= relative_decrease * cost:
+                break
+            trial = _apply_step(program, step, tolerance)
+            trial_model = chain_model(trial)
+            trial_pieces, trial_distances = assign_pieces(points, pieces, trial_model)
+            trial_cost = _fit_cost(points, trial_distances, trial_model, trial)
+            if trial_cost < cost:
+                program, model, pieces = trial, trial_model, trial_pieces
+                damping = max(damping / 10.0, 1e-12)
+                improved = cost - trial_cost > relative_decrease * cost
+                break
+            damping *= 4.0
+        if not improved:
+            break
+    return program, pieces, model
+
+
+def refine_in_windows(points, program, pieces, tolerance):
+    """
+    Khởi tạo cho chương trình dài: sai số nhỏ của từng dòng trong initial_program cộng dồn dọc chuỗi (hàng trăm mm sau
+    hàng nghìn dòng), khi đó Levenberg-Marquardt toàn cục cần rất nhiều bước. Tinh chỉnh lần lượt các cửa sổ
+    WINDOW_ROWS dòng (cộng WINDOW_OVERLAP dòng gối lên cửa sổ sau, kết thúc bằng đoạn feed có điểm đo) như một chương
+    trình riêng; trừ cửa sổ đầu, tư thế được giữ cố định tại trạng thái đầu dòng của cửa sổ trước, nên chương trình ghép
+    từ các dòng được giữ lại tính ra đúng chuỗi của từng cửa sổ. pieces là chỉ số phần của initial_program (tăng dần).
+    Trả về chương trình ghép, chưa tinh chỉnh toàn cục; chương trình không đổi khi chuỗi ban đầu đã khớp mọi điểm trong
+    tolerance (không có sai số cộng dồn, ví dụ dữ liệu của engine).
+    """
+    num_rows = len(program.feeds)
+    num_bends = len(program.sweeps)
+    if num_bends <= 2 * WINDOW_ROWS or assign_pieces(points, pieces, chain_model(program))[1].max() <= tolerance:
+        return program
+    feed_counts = np.bincount(pieces, minlength=2 * num_rows)[0::2]
+    feeds, sweeps, radii, rotations = program.feeds.copy(), program.sweeps.copy(), program.radii.copy(), program.rotations.copy()
+    origin, rotation = program.origin, program.rotation
+    first = 0
+    window_origin, window_rotation = origin, rotation
+    while True:
+        following = first + WINDOW_ROWS # Dòng đầu của cửa sổ sau
+        last = following + WINDOW_OVERLAP # Đoạn feed cuối của cửa sổ (Y tự do, không giữ lại)
+        while last < num_bends and feed_counts[last] == 0:
+            last += 1
+        final = last >= num_bends or num_bends - following <= WINDOW_ROWS
+        stop = num_rows if final else last + 1
+        bends = num_bends if final else last
+        begin = int(np.searchsorted(pieces, 2 * first))
+        end = len(points) if final else int(np.searchsorted(pieces, 2 * last, side='right'))
+        window = _Program(
+            feeds=feeds[first:stop].copy(), sweeps=sweeps[first:bends].copy(), radii=radii[first:bends].copy(),
+            rotations=rotations[first:bends].copy(), has_tail=program.has_tail if final else True,
+            origin=window_origin, rotation=window_rotation
+        )
+        if not final:
+            # Đoạn feed cuối chỉ có điểm đo đến points[end - 1] (với dữ liệu của engine có thể chỉ là điểm đầu đoạn):
+            # Y ban đầu theo điểm đó, để điểm cuối của cửa sổ khớp ngay từ đầu
+            tail = chain_model(window)
+            window.feeds[-1] = max(0.0, float(np.dot(points[end - 1] - tail.starts[-1], tail.directions[-1])))
+        window, _, model = refine_program(points[begin:end], window, pieces[begin:end] - 2 * first, tolerance,
+                                          fixed_pose=first > 0, relative_decrease=WINDOW_RELATIVE_DECREASE)
+        if first == 0:
+            origin, rotation = window.origin, window.rotation
+        kept_rows = num_rows if final else following
+        kept_bends = min(kept_rows, num_bends)
+        feeds[first:kept_rows] = window.feeds[:kept_rows - first]
+        sweeps[first:kept_bends] = window.sweeps[:kept_bends - first]
+        radii[first:kept_bends] = window.radii[:kept_bends - first]
+        rotations[first:kept_bends] = window.rotations[:kept_bends - first]
+        if final:
+            break
+        head = following - first
+        direction, up = model.directions[head], model.ups[head]
+        window_origin = model.starts[head]
+        window_rotation = np.column_stack((direction, np.cross(up, direction), up))
+        first = following
+    return _Program(feeds=feeds, sweeps=sweeps, radii=radii, rotations=rotations, has_tail=program.has_tail,
+                    origin=origin, rotation=rotation)
+
+
+def merge_split_bends(points, program, pieces, model, tolerance, max_residual):
+    """
+    Gộp hai dòng uốn liền nhau gần như là một cung (Y ở giữa ~0, C ~0: cùng mặt phẳng, cùng chiều), do nhiễu làm phân
+    đoạn tách một cung thành hai. Mỗi lần gộp được tinh chỉnh lại và chỉ giữ khi sai số lớn nhất vẫn <= max_residual.
+    Trả về (program, pieces, model).
+    """
+    k = 0
+    while k + 1 < len(program.sweeps):
+        arc_lengths = program.radii[k:k + 2] * program.sweeps[k:k + 2]
+        coplanar = abs(program.rotations[k]) * float(arc_lengths.min()) <= tolerance
+        if not coplanar or program.feeds[k + 1] > math.sqrt(8.0 * float(program.radii[k + 1]) * tolerance):
+            k += 1
+            continue
+        # Cung gộp giữ tổng độ dài hai cung; đoạn thẳng ngắn ở giữa và dòng k + 1 được bỏ
+        sweeps, radii = program.sweeps.copy(), program.radii.copy()
+        sweeps[k] = program.sweeps[k] + program.sweeps[k + 1]
+        radii[k] = float(arc_lengths.sum()) / sweeps[k]
+        rotations = program.rotations.copy()
+        rotations[k] = program.rotations[k + 1]
+        merged = _Program(feeds=np.delete(program.feeds, k + 1), sweeps=np.delete(sweeps, k + 1),
+                          radii=np.delete(radii, k + 1), rotations=np.delete(rotations, k + 1),
+                          has_tail=program.has_tail, origin=program.origin, rotation=program.rotation)
+        merged_pieces = np.where(pieces // 2 == k + 1, 2 * k + 1, np.where(pieces // 2 > k + 1, pieces - 2, pieces))
+        merged, merged_pieces, merged_model = refine_program(points, merged, merged_pieces, tolerance)
+        if closest_points(points, merged_pieces, merged_model)[1].max() <= max_residual:
+            program, pieces, model = merged, merged_pieces, merged_model
+        else:
+            k += 1
+    return program, pieces, model
+
+
+def fit_ybc_program(points, tolerance=None, max_residual=None, min_radius=None):
+    """
+    Khớp chương trình YBC cho đường tâm đo được points (N, 3) (đường gấp khúc có thứ tự, gồm cả điểm trên cung,
+    lấy mẫu bất kỳ, có thể có nhiễu). tolerance (mm): độ lệch cho phép của điểm so với đường thẳng/đường tròn khi phân đoạn,
+    mặc định tỉ lệ với nhiễu ước lượng. max_residual (mm): sai số lớn nhất cho phép sau khi khớp, mặc định
+    MAX_RESIDUAL_FACTOR * tolerance; vượt quá thì kết quả có error (chương trình vẫn được trả về để chẩn đoán).
+    min_radius (mm): bán kính uốn nhỏ nhất có thể (ví dụ theo đường kính ống); bán kính khớp nhỏ hơn min_radius hoặc
+    MIN_RADIUS_SPACING_FACTOR * khoảng cách lấy mẫu cũng cho kết quả có error, converged = False.
+    Trả về InverseFitResult; lỗi được báo qua InverseFitResult.error.
+    Giới hạn: các lần uốn liền nhau cùng mặt phẳng, cùng bán kính mà không có đoạn thẳng ở giữa được khớp thành một cung;
+    cung có dưới MIN_ARC_POINTS điểm đo chỉ khớp được khi nằm giữa hai đoạn thẳng, và đoạn thẳng hay cung chỉ dài vài
+    bước lấy mẫu có thể không tách được (kết quả khi đó có error, converged = False).
+    """
+    try:
+        points = np.asarray(points, dtype=float)
+    except (TypeError, ValueError):
+        return _failed("Dữ liệu không hợp lệ: 'points' phải là danh sách [x, y, z].")
+    if points.ndim != 2 or points.shape[1] != 3 or not np.all(np.isfinite(points)):
+        return _failed("Dữ liệu không hợp lệ: 'points' phải là danh sách [x, y, z] với giá trị hữu hạn.")
+
+    # Bỏ điểm trùng liên tiếp; cleaned_index ánh xạ điểm gốc sang điểm đã làm sạch
+    keep = np.ones(len(points), dtype=bool)
+    if len(points) > 1:
+        keep[1:] = np.linalg.norm(np.diff(points, axis=0), axis=1) > DUPLICATE_POINT_TOLERANCE
+    cleaned_index = np.cumsum(keep) - 1
+    if keep.sum() < 2:
+        return _failed("Dữ liệu không hợp lệ: cần ít nhất hai điểm phân biệt.")
+    # Tính trong hệ tọa độ đặt gốc tại trọng tâm (ổn định số khi tọa độ lớn)
+    reference = points[keep].mean(axis=0)
+    cleaned = points[keep] - reference
+
+    if tolerance is None:
+        tolerance = max(NOISE_TOLERANCE_FACTOR * estimate_noise(cleaned),
+                        MIN_RELATIVE_TOLERANCE * float(np.linalg.norm(np.ptp(cleaned, axis=0))))
+    if max_residual is None:
+        max_residual = MAX_RESIDUAL_FACTOR * tolerance
+
+    try:
+        primitives = segment_primitives(cleaned, tolerance)
+    except ValueError as e:
+        return _failed(f"Không khớp được: {e}")
+    program, pieces = initial_program(cleaned, primitives)
+    if not np.all(np.isfinite(program.radii)) or np.any(program.radii <= 0):
+        return _failed("Không khớp được: bán kính cung không xác định (dữ liệu quá nhiễu hoặc cung quá phẳng).")
+    program = refine_in_windows(cleaned, program, pieces, tolerance)
+    program, pieces, model = refine_program(cleaned, program, pieces, tolerance)
+    program, pieces, model = merge_split_bends(cleaned, program, pieces, model, tolerance, max_residual)
+    model = evaluate_model(program)
+    if model is None:
+        return _failed("Không khớp được: chương trình khớp không tính lại được bằng engine.")
+
+    # Sai số được đo đến đường tâm do engine tính lại; điểm được gán cho phần gần nhất
+    _, point_residuals, _, _ = closest_points(cleaned, pieces, model)
+    row_residuals = np.zeros(len(program.feeds))
+    np.maximum.at(row_residuals, pieces // 2, point_residuals)
+    result = InverseFitResult(
+        ybc=program.rows(), origin=program.origin + reference, rotation=program.rotation,
+        point_residuals=point_residuals[cleaned_index], row_residuals=row_residuals,
+        end_point_error=float(np.linalg.norm(model.ends[-1] - cleaned[-1])),
+        tolerance=float(tolerance), max_residual=float(max_residual)
+    )
+    if not result.converged:
+        result.error = (f"Không khớp được: sai số lớn nhất {float(point_residuals.max()):.6g} mm vượt MaxResidual "
+                        f"{max_residual:.6g} mm (tăng Tolerance với dữ liệu nhiễu, hoặc dữ liệu không phải đường thẳng/cung).")
+        return result
+    spacing = float(np.median(np.linalg.norm(np.diff(cleaned, axis=0), axis=1)))
+    radius_floor = max(MIN_RADIUS_SPACING_FACTOR * spacing, min_radius or 0.0)
+    implausible = np.flatnonzero(program.radii < radius_floor)
+    if len(implausible):
+        k = int(implausible[0])
+        result.error = (f"Không khớp được: bán kính {float(program.radii[k]):.6g} mm của dòng {k + 1} nhỏ hơn "
+                        f"{radius_floor:.6g} mm (bán kính nhỏ nhất hoặc nửa khoảng cách lấy mẫu): dữ liệu không xác định "
+                        f"được cung này (hãy lấy mẫu dày hơn).")
+    return result
@@ -0,0 +1,163 @@
+import math
+from dataclasses import dataclass
+import numpy as np
+
+# --- Tạo lưới bề mặt ống (quét biên dạng dọc đường tâm) ---
+# Mỗi điểm đường tâm có một vòng ring_vertices đỉnh; giữa hai điểm liên tiếp là một dải gồm ring_edges tứ giác
+# (2 tam giác, 6 chỉ số mỗi tứ giác). Vì vậy đỉnh của điểm i nằm ở [i * ring_vertices, (i + 1) * ring_vertices)
+# và chỉ số của dải giữa điểm i và i + 1 nằm ở [i * 6 * ring_edges, (i + 1) * 6 * ring_edges):
+# các đoạn liền kề dùng chung vòng đỉnh ở điểm nối, và nhóm chỉ số của một đoạn suy ra trực tiếp từ start_idx/end_idx.
+
+DEFAULT_RADIAL_SEGMENTS = 16 # Số đỉnh trên vòng của ống tròn
+MESH_PROFILE_TYPES = ('round', 'square', 'rectangle')
+
+
+@dataclass
+class TubeMesh:
+    """ Lưới tam giác có chỉ số; vertices/normals (V, 3) float32, indices (I,) uint32 dùng chỉ số đỉnh toàn cục """
+    vertices: np.ndarray
+    normals: np.ndarray
+    indices: np.ndarray
+    ring_vertices: int
+    ring_edges: int
+
+    def to_dict(self):
+        return {
+            "vertices": self.vertices.ravel().tolist(),
+            "normals": self.normals.ravel().tolist(),
+            "indices": self.indices.tolist(),
+            "ring_vertices": self.ring_vertices,
+            "ring_edges": self.ring_edges
+        }
+
+
+def profile_cross_section(profile_info, radial_segments=DEFAULT_RADIAL_SEGMENTS):
+    """
+    Mặt cắt của biên dạng trong hệ (normal, binormal) của đường tâm.
+    Trả về (offsets (K, 2), vertex_normals (K, 2), edges (E, 2)); các cạnh đi ngược chiều kim đồng hồ
+    khi nhìn từ phía tiếp tuyến, nên tam giác hướng ra ngoài.
+    Ném ValueError nếu biên dạng hoặc kích thước không hợp lệ.
+    """
+    if not isinstance(profile_info, dict) or profile_info.get('type') not in MESH_PROFILE_TYPES:
+        raise ValueError("Loại biên dạng không được hỗ trợ để tạo lưới.")
+    dimensions = profile_info.get('dimensions') or {}
+
+    def positive_dimension(key):
+        value = dimensions.get(key)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0:
+            raise ValueError(f"Kích thước '{key}' của biên dạng không hợp lệ.")
+        return float(value)
+
+    profile_type = profile_info['type']
+    if profile_type == 'round':
+        radius = positive_dimension('diameter') / 2.0
+        angles = np.arange(radial_segments) * (2.0 * math.pi / radial_segments)
+        vertex_normals = np.column_stack((np.cos(angles), np.sin(angles)))
+        offsets = radius * vertex_normals
+        edges = np.column_stack((np.arange(radial_segments), (np.arange(radial_segments) + 1) % radial_segments))
+        return offsets, vertex_normals, edges
+
+    if profile_type == 'square':
+        half_height = half_width = positive_dimension('side') / 2.0
+    else:
+        half_width = positive_dimension('width') / 2.0 # Dọc theo binormal
+        half_height = positive_dimension('height') / 2.0 # Dọc theo normal
+    # Bốn góc ngược chiều kim đồng hồ; mỗi mặt có 2 đỉnh riêng để pháp tuyến phẳng (cạnh sắc)
+    corners = np.array([[half_height, -half_width], [half_height, half_width],
+                        [-half_height, half_width], [-half_height, -half_width]])
+    face_normals = np.array([[1.0, 0.0], [0.0, 1.0], [-1.0, 0.0], [0.0, -1.0]])
+    offsets = np.empty((8, 2))
+    offsets[0::2] = corners
+    offsets[1::2] = np.roll(corners, -1, axis=0)
+    vertex_normals = np.repeat(face_normals, 2, axis=0)
+    edges = np.column_stack((np.arange(0, 8, 2), np.arange(1, 8, 2)))
+    return offsets, vertex_normals, edges
+
+
+def build_tube_mesh(points, tangents, normals, profile_info, radial_segments=DEFAULT_RADIAL_SEGMENTS, point_offset=0):
+    """
+    Quét mặt cắt của profile_info dọc theo points với khung (tangents, normals) tại từng điểm, vector hóa toàn bộ.
+    point_offset: chỉ số toàn cục của points[0] (khi chỉ tạo lưới cho phần đuôi), chỉ số đỉnh trong indices là toàn cục.
+    """
+    offsets, vertex_normals, edges = profile_cross_section(profile_info, radial_segments)
+    points = np.asarray(points, dtype=float)
+    binormals = np.cross(tangents, normals)
+    num_points = points.shape[0]
+    ring_vertices = offsets.shape[0]
+    ring_edges = edges.shape[0]
+
+    # (P, K, 3): điểm tâm + u * normal + v * binormal
+    vertices = (points[:, np.newaxis, :]
+                + offsets[np.newaxis, :, 0, np.newaxis] * normals[:, np.newaxis, :]
+                + offsets[np.newaxis, :, 1, np.newaxis] * binormals[:, np.newaxis, :])
+    vertex_normal_vectors = (vertex_normals[np.newaxis, :, 0, np.newaxis] * normals[:, np.newaxis, :]
+                             + vertex_normals[np.newaxis, :, 1, np.newaxis] * binormals[:, np.newaxis, :])
+
+    # Hai tam giác cho mỗi cạnh của mặt cắt giữa vòng i và vòng i + 1
+    ring_starts = (point_offset + np.arange(max(num_points - 1, 0), dtype=np.int64)) * ring_vertices
+    current_a = ring_starts[:, np.newaxis] + edges[np.newaxis, :, 0]
+    current_b = ring_starts[:, np.newaxis] + edges[np.newaxis, :, 1]
+    next_a = current_a + ring_vertices
+    next_b = current_b + ring_vertices
+    indices = np.stack((current_a, current_b, next_b, current_a, next_b, next_a), axis=-1)
+
+    return TubeMesh(
+        vertices=vertices.reshape(-1, 3).astype(np.float32),
+        normals=vertex_normal_vectors.reshape(-1, 3).astype(np.float32),
+        indices=indices.reshape(-1).astype(np.uint32),
+        ring_vertices=ring_vertices,
+        ring_edges=ring_edges
+    )
+
+
+def merge_tube_mesh(base_mesh, tail_mesh, point_offset):
+    """ Ghép lưới phần đuôi (tạo với point_offset) vào lưới đầy đủ trước đó, giống cách ghép mảng điểm """
+    return TubeMesh(
+        vertices=np.concatenate((base_mesh.vertices[:point_offset * base_mesh.ring_vertices], tail_mesh.vertices)),
+        normals=np.concatenate((base_mesh.normals[:point_offset * base_mesh.ring_vertices], tail_mesh.normals)),
+        indices=np.concatenate((base_mesh.indices[:point_offset * 6 * base_mesh.ring_edges], tail_mesh.indices)),
+        ring_vertices=tail_mesh.ring_vertices,
+        ring_edges=tail_mesh.ring_edges
+    )
+
+
+def transform_tube_mesh(mesh, ring_centers, rotation, translation, twist=0.0, point_shift=0):
+    """
+    Lưới mesh sau phép dời hình x -> rotation @ x + translation, rồi xoay mỗi vòng đỉnh thêm góc twist (rad) quanh
+    tiếp tuyến tại tâm vòng; ring_centers (R, 3) là tâm các vòng của mesh sau phép dời hình.
+    Chỉ số đỉnh được dời point_shift điểm. Tiếp tuyến của vòng là tích có hướng của pháp tuyến đỉnh đầu của hai cạnh
+    đầu tiên của mặt cắt (các cạnh đi ngược chiều kim đồng hồ), nên không cần khung tại từng điểm.
+    """
+    ring_vertices = mesh.ring_vertices
+    indices = (mesh.indices.astype(np.int64) + point_shift * ring_vertices).astype(np.uint32)
+    if abs(twist) <= 1e-12 or len(mesh.vertices) == 0:
+        return TubeMesh(
+            vertices=(mesh.vertices @ rotation.T.astype(np.float32) + translation.astype(np.float32)).astype(np.float32),
+            normals=(mesh.normals @ rotation.T.astype(np.float32)).astype(np.float32),
+            indices=indices, ring_vertices=ring_vertices, ring_edges=mesh.ring_edges
+        )
+
+    # Mỗi vòng một ma trận quay: twist quanh tiếp tuyến (sau phép dời hình) nhân rotation
+    vertices = mesh.vertices.reshape(-1, ring_vertices, 3)
+    normals = mesh.normals.reshape(-1, ring_vertices, 3)
+    first_edge_vertex = int(mesh.indices[0]) % ring_vertices
+    second_edge_vertex = int(mesh.indices[6]) % ring_vertices
+    axes = np.cross(normals[:, first_edge_vertex].astype(float), normals[:, second_edge_vertex].astype(float)) @ rotation.T
+    axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+    cos_t, sin_t = math.cos(twist), math.sin(twist)
+    cross_matrices = np.zeros((len(axes), 3, 3))
+    cross_matrices[:, 0, 1], cross_matrices[:, 0, 2], cross_matrices[:, 1, 2] = -axes[:, 2], axes[:, 1], -axes[:, 0]
+    cross_matrices -= cross_matrices.transpose(0, 2, 1)
+    twist_matrices = (cos_t * np.eye(3) + sin_t * cross_matrices
+                      + (1.0 - cos_t) * axes[:, :, np.newaxis] * axes[:, np.newaxis, :])
+    ring_matrices = (twist_matrices @ rotation).transpose(0, 2, 1).astype(np.float32) # Nhân bên phải với vector hàng
+
+    ring_centers = np.asarray(ring_centers, dtype=float)
+    old_centers = (ring_centers - translation) @ rotation # Tâm vòng trước phép dời hình
+    moved_vertices = (vertices - old_centers[:, np.newaxis, :].astype(np.float32)) @ ring_matrices \
+        + ring_centers[:, np.newaxis, :].astype(np.float32)
+    return TubeMesh(
+        vertices=moved_vertices.reshape(-1, 3).astype(np.float32),
+        normals=(normals @ ring_matrices).reshape(-1, 3).astype(np.float32),
+        indices=indices, ring_vertices=ring_vertices, ring_edges=mesh.ring_edges
+    )
@@ -0,0 +1,135 @@
+import bisect
+import threading
+import time
+
+# --- Đo thời gian theo từng pha của request và tổng hợp dạng Prometheus ---
+# RequestTimer ghi thời gian các pha (parse, validate, compute, serialize, ...) và kích thước (rows, points, bytes)
+# của một request; MetricsRegistry gộp chúng thành histogram cho endpoint /api/metrics.
+# Khi tắt (YBC_METRICS=0), các handler dùng NULL_TIMER với các phương thức rỗng.
+
+PHASE_BUCKETS_SECONDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+
+class Histogram:
+    """ Histogram tích lũy kiểu Prometheus với các ngưỡng cố định """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1) # Phần tử cuối là +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip(self.buckets + (float('inf'),), self.bucket_counts):
+            cumulative_count += bucket_count
+            le = '+Inf' if upper_bound == float('inf') else repr(upper_bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative_count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum!r}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class RequestTimer:
+    """ Thời gian từng pha (ms, theo thứ tự) và kích thước đầu vào/đầu ra của một request """
+    __slots__ = ('started_at', '_last_mark', 'phases', 'sizes')
+
+    def __init__(self):
+        self.started_at = self._last_mark = time.perf_counter()
+        self.phases = {}
+        self.sizes = {}
+
+    def mark(self, phase):
+        """ Kết thúc pha 'phase': cộng thời gian kể từ lần mark trước (hoặc từ đầu request) """
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last_mark) * 1000.0
+        self._last_mark = now
+
+    def set_size(self, name, value):
+        if value is not None:
+            self.sizes[name] = value
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started_at) * 1000.0
+
+    def server_timing_header(self, total_ms):
+        """ Giá trị header Server-Timing, ví dụ 'parse;dur=0.21, compute;dur=12.40, total;dur=13.02' """
+        entries = [f"{phase};dur={duration_ms:.2f}" for phase, duration_ms in self.phases.items()]
+        entries.append(f"total;dur={total_ms:.2f}")
+        return ', '.join(entries)
+
+
+class _NullRequestTimer:
+    """ RequestTimer khi tắt đo đạc: không ghi gì """
+    __slots__ = ()
+
+    def mark(self, phase):
+        pass
+
+    def set_size(self, name, value):
+        pass
+
+
+NULL_TIMER = _NullRequestTimer()
+
+
+class MetricsRegistry:
+    """ Histogram theo (route, pha) và (route, loại kích thước), bộ đếm request theo (route, mã trạng thái); an toàn đa luồng """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phase_histograms = {}
+        self._size_histograms = {}
+        self._request_counts = {}
+
+    def observe_request(self, route, status_code, timer, total_ms):
+        with self._lock:
+            count_key = (route, status_code)
+            self._request_counts[count_key] = self._request_counts.get(count_key, 0) + 1
+            for phase, duration_ms in list(timer.phases.items()) + [('total', total_ms)]:
+                histogram = self._phase_histograms.get((route, phase))
+                if histogram is None:
+                    histogram = self._phase_histograms[(route, phase)] = Histogram(PHASE_BUCKETS_SECONDS)
+                histogram.observe(duration_ms / 1000.0)
+            for kind, value in timer.sizes.items():
+                histogram = self._size_histograms.get((route, kind))
+                if histogram is None:
+                    histogram = self._size_histograms[(route, kind)] = Histogram(SIZE_BUCKETS)
+                histogram.observe(value)
+
+    def render_prometheus(self, extra_gauges=None, extra_counters=None):
+        """
+        Văn bản theo định dạng Prometheus 0.0.4; extra_gauges/extra_counters: dict tên -> giá trị số.
+        Giá trị chỉ tăng (tích lũy) phải là counter để rate()/increase() dùng được.
+        """
+        with self._lock:
+            lines = [
+                "# HELP ybc_requests_total Số request theo route và mã trạng thái.",
+                "# TYPE ybc_requests_total counter",
+            ]
+            for (route, status_code), count in sorted(self._request_counts.items()):
+                lines.append(f'ybc_requests_total{{route="{route}",status="{status_code}"}} {count}')
+            lines += [
+                "# HELP ybc_request_phase_seconds Thời gian từng pha xử lý request.",
+                "# TYPE ybc_request_phase_seconds histogram",
+            ]
+            for (route, phase), histogram in sorted(self._phase_histograms.items()):
+                lines += histogram.render("ybc_request_phase_seconds", f'route="{route}",phase="{phase}"')
+            lines += [
+                "# HELP ybc_request_size Kích thước đầu vào/đầu ra của request (rows, points, request_bytes, response_bytes).",
+                "# TYPE ybc_request_size histogram",
+            ]
+            for (route, kind), histogram in sorted(self._size_histograms.items()):
+                lines += histogram.render("ybc_request_size", f'route="{route}",kind="{kind}"')
+        for name, value in (extra_counters or {}).items():
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        for name, value in (extra_gauges or {}).items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return '\n'.join(lines) + '\n'
@@ -1,7 +1,28 @@
 import math
 import numpy as np
 import json
-import sys # Vẫn cần thiết để ghi log lỗi ra stderr
+import logging
+import os
+from dataclasses import dataclass
+
+try:
+    from YBC3D_mesh import build_tube_mesh, merge_tube_mesh, transform_tube_mesh, TubeMesh, DEFAULT_RADIAL_SEGMENTS
+except ImportError:
+    from .YBC3D_mesh import build_tube_mesh, merge_tube_mesh, transform_tube_mesh, TubeMesh, DEFAULT_RADIAL_SEGMENTS
+try:
+    from YBC3D_clearance import analyze_clearance
+except ImportError:
+    from .YBC3D_clearance import analyze_clearance
+try:
+    from YBC3D_compact import decimation_mask, quantize_points, round_points
+except ImportError:
+    from .YBC3D_compact import decimation_mask, quantize_points, round_points
+
+# Logger của engine; mức log được cấu hình bởi lớp web (biến môi trường YBC_LOG_LEVEL)
+logger = logging.getLogger("YBC3D_web")
+
+# Bật trace theo từng bước cho mọi request (YBC_TRACE=1), hoặc theo từng request qua khóa 'Trace'
+TRACE_ENABLED_BY_DEFAULT = os.environ.get('YBC_TRACE', '').strip().lower() in ('1', 'true', 'yes', 'on')
 
 # --- Hàm phụ trợ --- (Giữ nguyên)
 def rotate_vector(vector, axis, angle_rad):
@@ -19,27 +40,385 @@ def rotate_vector(vector, axis, angle_rad):
     result = vector * cos_a + np.cross(axis, vector) * sin_a + axis * np.dot(axis, vector) * (1 - cos_a)
     return np.asarray(result, dtype=float)
 
+def rotate_vector_batch(vector, axis, angles_rad):
+    """ Quay vector quanh trục với nhiều góc cùng lúc (Rodrigues vector hóa), trả về mảng (N, 3) """
+    vector = np.asarray(vector, dtype=float)
+    angles_rad = np.asarray(angles_rad, dtype=float)
+    axis = np.asarray(axis, dtype=float)
+    norm_axis = np.linalg.norm(axis)
+    if norm_axis < 1e-9: # Giống rotate_vector: trục zero thì giữ nguyên vector
+        return np.tile(vector, (angles_rad.shape[0], 1))
+    axis = axis / norm_axis
+    cos_a = np.cos(angles_rad)[:, np.newaxis]
+    sin_a = np.sin(angles_rad)[:, np.newaxis]
+    # Các số hạng không phụ thuộc góc chỉ tính một lần cho cả cung
+    return vector * cos_a + np.cross(axis, vector) * sin_a + (axis * np.dot(axis, vector)) * (1 - cos_a)
+
+# --- Chia lưới cung uốn ---
+DEFAULT_NUM_ARC_POINTS = 30 # Số điểm cố định trên mỗi cung khi không dùng chia lưới thích ứng
+DEFAULT_MIN_ARC_POINTS = 2
+DEFAULT_MAX_ARC_POINTS = 256
+# Giới hạn cứng phía server, kiểm tra trước khi cấp phát; có thể cấu hình qua biến môi trường
+ARC_POINTS_LIMIT = int(os.environ.get('YBC_ARC_POINTS_LIMIT', '10000')) # Số điểm tối đa trên một cung
+CENTERLINE_POINTS_LIMIT = int(os.environ.get('YBC_CENTERLINE_POINTS_LIMIT', '2000000')) # Tổng số điểm tối đa của đường tâm
+
+def read_positive_option(data_dict, key, default, integer=False):
+    """ Đọc tùy chọn số dương từ data_dict; giá trị không hợp lệ thì cảnh báo và dùng mặc định """
+    value = data_dict.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0 or (integer and int(value) != value):
+        logger.warning("Giá trị %s '%s' không hợp lệ, dùng mặc định: %s", key, value, default)
+        return default
+    return int(value) if integer else float(value)
+
+def read_flag_option(data_dict, key, default=False):
+    """ Đọc tùy chọn bật/tắt: chỉ nhận bool hoặc 0/1; chuỗi như "false" ném ValueError thay vì bị coi là bật """
+    value = data_dict.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    raise ValueError(f"'{key}' phải là true/false hoặc 0/1 (nhận được {value!r}).")
+
+def adaptive_arc_point_count(bend_angle_rad, radius, chord_tolerance=None, max_step_rad=None,
+                             min_points=DEFAULT_MIN_ARC_POINTS, max_points=DEFAULT_MAX_ARC_POINTS):
+    """
+    Số điểm trên cung uốn sao cho độ lệch dây cung <= chord_tolerance và bước góc <= max_step_rad,
+    giới hạn trong [min_points, max_points].
+    """
+    sweep_rad = abs(bend_angle_rad)
+    required_points = 1
+    # Bước góc không nhỏ hơn sweep / max_points (số điểm bị giới hạn bởi max_points), nên phép chia luôn hữu hạn
+    min_step_rad = sweep_rad / max_points
+    if chord_tolerance is not None:
+        # Độ lệch lớn nhất giữa dây cung và cung với bước góc t: r * (1 - cos(t / 2)) = 2 * r * sin(t / 4)^2 <= tol
+        # =>  t <= 4 * asin(sqrt(tol / (2 * r))). Dạng asin không bị làm tròn về 0 như 2 * acos(1 - tol / r) khi tol / r
+        # rất nhỏ (bán kính rất lớn); bước >= sweep (cung gần thẳng) cho một đoạn dây cung.
+        max_step_for_tolerance = 4.0 * math.asin(math.sqrt(min(1.0, chord_tolerance / (2.0 * radius))))
+        required_points = max(required_points, math.ceil(sweep_rad / max(max_step_for_tolerance, min_step_rad) - 1e-9))
+    if max_step_rad is not None:
+        required_points = max(required_points, math.ceil(sweep_rad / max(max_step_rad, min_step_rad) - 1e-9))
+    return min(max(required_points, min_points), max_points)
+
+# --- Kết quả tính toán dạng Python/NumPy ---
+@dataclass
+class CenterlineResult:
+    """
+    Kết quả của compute_centerline. Các vector là mảng NumPy, không cần parse JSON.
+    error khác rỗng nghĩa là dữ liệu đầu vào không hợp lệ hoặc không tính được; khi đó points rỗng.
+    """
+    points: np.ndarray # Mảng (N, 3) các điểm đường tâm
+    segment_info: list # Các dict {'type', 'start_idx', 'end_idx', ...} như trong kết quả JSON
+    final_point: np.ndarray
+    final_direction: np.ndarray
+    final_up_vector: np.ndarray
+    diameter: float
+    error: str = ""
+    trace: list = None # Trạng thái từng bước, chỉ có khi bật trace
+    # Khi tính tiếp từ ResumeState: points[0] là điểm có chỉ số toàn cục point_offset,
+    # segment_info chỉ chứa các đoạn từ chỉ số segment_offset trở đi (chỉ số điểm là toàn cục)
+    step_offset: int = 0
+    point_offset: int = 0
+    segment_offset: int = 0
+    # Trạng thái trước mỗi bước (và sau bước cuối), chỉ có khi bật 'Checkpoints':
+    # {'point', 'direction', 'up', 'normal': mảng (M+1, 3), 'num_points', 'num_segments': mảng (M+1,)}, chỉ số toàn cục
+    checkpoints: dict = None
+    # Khung tại từng điểm (mảng (N, 3), cùng chỉ số với points): tiếp tuyến và pháp tuyến vật liệu
+    # (khung tối thiểu xoay: chỉ quay theo các cung uốn, không theo C). Chỉ có khi bật 'Frames'.
+    tangents: np.ndarray = None
+    normals: np.ndarray = None
+    mesh: object = None # TubeMesh (YBC3D_mesh.py), chỉ có khi có 'MeshProfile'
+    clearance: dict = None # Báo cáo khe hở/tự va chạm (YBC3D_clearance.py), chỉ có khi bật 'Clearance'
+    # Đường tâm trước khi giản lược, để tính lại khe hở trên kết quả đã ghép (chỉ có khi bật cả 'DecimateTolerance',
+    # 'Clearance' và 'Checkpoints'): {'points', 'segment_info', 'point_offset', 'num_points'} với chỉ số điểm chưa giản lược
+    undecimated: dict = None
+    # Phần đuôi không đổi của kết quả trước được ghép lại sau kết quả này bằng phép dời hình, xem suffix_transform
+    suffix: dict = None
+
+    def binormals(self):
+        """ Binormal tại từng điểm (tangent x normal), mảng (N, 3); None nếu không có khung """
+        if self.tangents is None:
+            return None
+        return np.cross(self.tangents, self.normals)
+
+    @classmethod
+    def empty(cls, diameter, error=""):
+        """ Kết quả rỗng với khung tọa độ mặc định an toàn """
+        return cls(
+            points=np.empty((0, 3)), segment_info=[],
+            final_point=np.array([0.0, 0.0, 0.0]), final_direction=np.array([1.0, 0.0, 0.0]),
+            final_up_vector=np.array([0.0, 0.0, 1.0]), diameter=diameter, error=error
+        )
+
+    def resume_state(self, step):
+        """
+        ResumeState để tính lại từ bước 'step' (chỉ số toàn cục, 0-based) khi các dòng trước đó không đổi.
+        Cần kết quả được tính với 'Checkpoints'.
+        """
+        checkpoint_index = step - self.step_offset
+        return {
+            "step": step,
+            "point": self.checkpoints["point"][checkpoint_index].tolist(),
+            "direction": self.checkpoints["direction"][checkpoint_index].tolist(),
+            "up": self.checkpoints["up"][checkpoint_index].tolist(),
+            "normal": self.checkpoints["normal"][checkpoint_index].tolist(),
+            "num_points": int(self.checkpoints["num_points"][checkpoint_index]),
+            "num_segments": int(self.checkpoints["num_segments"][checkpoint_index]),
+            **({"undecimated_num_points": int(self.undecimated["num_points"][checkpoint_index])}
+               if self.undecimated is not None else {})
+        }
+
+    def to_dict(self, precision='float64'):
+        """
+        Dictionary tương thích JSON, cùng cấu trúc với chuỗi trả về của calculate_centerline_from_data.
+        precision: độ chính xác của 'centerline_points' (YBC3D_compact.POINT_PRECISIONS). 'float32' làm tròn tọa độ
+        đến 7 chữ số có nghĩa; 'int16' thay 'centerline_points' bằng 'centerline_points_quantized'
+        {'origin', 'scale', 'values': list phẳng 3N số nguyên}, điểm ~= origin + values * scale.
+        """
+        if self.error:
+            return {
+                "error": self.error,
+                "centerline_points": [], "segment_info": [],
+                "final_point": [0,0,0], "final_direction": [1,0,0], # Giá trị mặc định an toàn
+                "diameter": self.diameter
+            }
+        output_data = {}
+        if precision == 'int16':
+            values, origin, scale = quantize_points(self.points)
+            output_data["centerline_points_quantized"] = {
+                "origin": origin.tolist(), "scale": scale.tolist(), "values": values.ravel().tolist()
+            }
+        else:
+            output_data["centerline_points"] = (round_points(self.points) if precision == 'float32' else self.points).tolist()
+        output_data.update({
+            "segment_info": self.segment_info,
+            "final_point": self.final_point.tolist(),
+            "final_direction": self.final_direction.tolist(),
+            "final_up_vector": self.final_up_vector.tolist(), # Thêm thông tin vector Up cuối cùng
+            "diameter": self.diameter
+        })
+        if self.trace is not None:
+            output_data["trace"] = self.trace
+        if self.step_offset:
+            output_data["step_offset"] = self.step_offset
+            output_data["point_offset"] = self.point_offset
+            output_data["segment_offset"] = self.segment_offset
+        if self.checkpoints is not None:
+            output_data["checkpoints"] = {key: values.tolist() for key, values in self.checkpoints.items()}
+        if self.normals is not None:
+            # Mặt cắt biên dạng đặt tại điểm i trong mặt phẳng (point_normals[i], point_binormals[i])
+            output_data["point_normals"] = self.normals.tolist()
+            output_data["point_binormals"] = self.binormals().tolist()
+        if self.mesh is not None:
+            output_data["mesh"] = self.mesh.to_dict()
+        if self.clearance is not None:
+            output_data["clearance"] = self.clearance
+        if self.suffix is not None:
+            output_data["suffix"] = {
+                "point_start": self.suffix["point_start"], "segment_start": self.suffix["segment_start"],
+                "transform": suffix_matrix(self.suffix).ravel().tolist(), "twist": self.suffix["twist"]
+            }
+        return output_data
+
+
+def merge_resumed_result(base_result, tail_result):
+    """
+    Ghép kết quả đầy đủ (base_result, có checkpoints, step_offset = 0) với phần đuôi tính từ
+    base_result.resume_state(k), trả về kết quả đầy đủ cho chương trình mới.
+    """
+    kept_steps = tail_result.step_offset - base_result.step_offset
+    checkpoints = None
+    if base_result.checkpoints is not None and tail_result.checkpoints is not None:
+        checkpoints = {
+            key: np.concatenate((base_result.checkpoints[key][:kept_steps], tail_result.checkpoints[key]))
+            for key in base_result.checkpoints
+        }
+    tangents = normals = mesh = None
+    if base_result.tangents is not None and tail_result.tangents is not None:
+        tangents = np.concatenate((base_result.tangents[:tail_result.point_offset], tail_result.tangents))
+        normals = np.concatenate((base_result.normals[:tail_result.point_offset], tail_result.normals))
+    if base_result.mesh is not None and tail_result.mesh is not None:
+        mesh = merge_tube_mesh(base_result.mesh, tail_result.mesh, tail_result.point_offset)
+    undecimated = None
+    if base_result.undecimated is not None and tail_result.undecimated is not None:
+        base_undecimated, tail_undecimated = base_result.undecimated, tail_result.undecimated
+        undecimated = {
+            "points": np.concatenate((base_undecimated["points"][:tail_undecimated["point_offset"]], tail_undecimated["points"])),
+            "segment_info": base_undecimated["segment_info"][:tail_result.segment_offset] + tail_undecimated["segment_info"],
+            "point_offset": 0,
+            "num_points": np.concatenate((base_undecimated["num_points"][:kept_steps], tail_undecimated["num_points"]))
+        }
+    return CenterlineResult(
+        points=np.concatenate((base_result.points[:tail_result.point_offset], tail_result.points)),
+        segment_info=base_result.segment_info[:tail_result.segment_offset] + tail_result.segment_info,
+        final_point=tail_result.final_point,
+        final_direction=tail_result.final_direction,
+        final_up_vector=tail_result.final_up_vector,
+        diameter=tail_result.diameter,
+        checkpoints=checkpoints,
+        tangents=tangents,
+        normals=normals,
+        mesh=mesh,
+        undecimated=undecimated
+    )
+
+
+def suffix_transform(base_result, middle_result, suffix_step):
+    """
+    Phép biến đổi đưa phần đuôi không đổi của base_result (các dòng từ bước suffix_step) về sau middle_result
+    (các dòng đã sửa, tính từ base_result.resume_state(k)). Mỗi thao tác của engine chỉ phụ thuộc trạng thái (P, D, U)
+    và dòng YBC, nên phần đuôi mới là ảnh của phần đuôi cũ qua phép dời hình x -> rotation @ x + translation;
+    riêng pháp tuyến vật liệu (không quay theo C) lệch thêm góc 'twist' (rad) không đổi quanh tiếp tuyến.
+    Trả về dict {'step', 'point_start', 'segment_start', 'rotation', 'translation', 'twist'} với chỉ số của base_result.
+    """
+    suffix_index = suffix_step - base_result.step_offset
+    old_state = {key: base_result.checkpoints[key][suffix_index] for key in ('point', 'direction', 'up', 'normal')}
+    new_state = {key: middle_result.checkpoints[key][-1] for key in ('point', 'direction', 'up', 'normal')}
+    frame_before = np.column_stack((old_state['direction'], old_state['up'], np.cross(old_state['direction'], old_state['up'])))
+    frame_after = np.column_stack((new_state['direction'], new_state['up'], np.cross(new_state['direction'], new_state['up'])))
+    rotation = frame_after @ frame_before.T
+    rotated_normal = rotation @ old_state['normal']
+    suffix = {
+        "step": suffix_step,
+        "point_start": int(base_result.checkpoints['num_points'][suffix_index]) - 1,
+        "segment_start": int(base_result.checkpoints['num_segments'][suffix_index]),
+        "rotation": rotation,
+        "translation": new_state['point'] - rotation @ old_state['point'],
+        "twist": math.atan2(np.dot(np.cross(rotated_normal, new_state['normal']), new_state['direction']),
+                            np.dot(rotated_normal, new_state['normal']))
+    }
+    if base_result.undecimated is not None:
+        suffix["undecimated_point_start"] = int(base_result.undecimated['num_points'][suffix_index]) - 1
+    return suffix
+
+
+def suffix_matrix(suffix):
+    """ Ma trận 4x4 (thuần nhất) của phép dời hình trong suffix """
+    matrix = np.eye(4)
+    matrix[:3, :3] = suffix['rotation']
+    matrix[:3, 3] = suffix['translation']
+    return matrix
+
+
+def _twist_normals(tangents, normals, twist):
+    """ Pháp tuyến xoay thêm góc twist quanh tiếp tuyến (cùng chỉ số) """
+    return math.cos(twist) * normals + math.sin(twist) * np.cross(tangents, normals)
+
+
+def _shift_segments(segment_info, point_shift):
+    return [dict(segment, start_idx=segment['start_idx'] + point_shift, end_idx=segment['end_idx'] + point_shift)
+            for segment in segment_info]
+
+
+def splice_resumed_result(base_result, middle_result):
+    """
+    Kết quả đầy đủ cho chương trình mới = phần đầu của base_result + middle_result + phần đuôi không đổi của
+    base_result sau phép biến đổi middle_result.suffix (suffix_transform). Chỉ biến đổi mảng đã lưu, không tính lại
+    các dòng của phần đuôi. Không hỗ trợ trace (các bước trong trace không được biến đổi).
+    """
+    suffix = middle_result.suffix
+    rotation, translation, twist = suffix['rotation'], suffix['translation'], suffix['twist']
+    head = merge_resumed_result(base_result, middle_result)
+    point_start, segment_start = suffix['point_start'], suffix['segment_start']
+    point_shift = len(head.points) - 1 - point_start
+    segment_shift = len(head.segment_info) - segment_start
+    suffix_index = suffix['step'] - base_result.step_offset
+
+    def moved(points):
+        return points @ rotation.T + translation
+
+    checkpoints = head.checkpoints
+    if checkpoints is not None:
+        suffix_directions = base_result.checkpoints['direction'][suffix_index + 1:] @ rotation.T
+        moved_checkpoints = {
+            "point": moved(base_result.checkpoints['point'][suffix_index + 1:]),
+            "direction": suffix_directions,
+            "up": base_result.checkpoints['up'][suffix_index + 1:] @ rotation.T,
+            "normal": _twist_normals(suffix_directions, base_result.checkpoints['normal'][suffix_index + 1:] @ rotation.T, twist),
+            "num_points": base_result.checkpoints['num_points'][suffix_index + 1:] + point_shift,
+            "num_segments": base_result.checkpoints['num_segments'][suffix_index + 1:] + segment_shift
+        }
+        checkpoints = {key: np.concatenate((checkpoints[key], moved_checkpoints[key])) for key in checkpoints}
+    tangents, normals = head.tangents, head.normals
+    if tangents is not None:
+        suffix_tangents = base_result.tangents[point_start + 1:] @ rotation.T
+        tangents = np.concatenate((tangents, suffix_tangents))
+        normals = np.concatenate((normals, _twist_normals(suffix_tangents, base_result.normals[point_start + 1:] @ rotation.T, twist)))
+    suffix_points = moved(base_result.points[point_start + 1:])
+    mesh = head.mesh
+    if mesh is not None:
+        # Vòng đỉnh của các điểm sau điểm nối và các dải tam giác từ điểm nối
+        base_mesh = base_result.mesh
+        suffix_mesh = transform_tube_mesh(TubeMesh(
+            vertices=base_mesh.vertices[(point_start + 1) * base_mesh.ring_vertices:],
+            normals=base_mesh.normals[(point_start + 1) * base_mesh.ring_vertices:],
+            indices=base_mesh.indices[point_start * 6 * base_mesh.ring_edges:],
+            ring_vertices=base_mesh.ring_vertices, ring_edges=base_mesh.ring_edges
+        ), suffix_points, rotation, translation, twist, point_shift)
+        mesh = merge_tube_mesh(mesh, suffix_mesh, len(head.points))
+    undecimated = head.undecimated
+    if undecimated is not None:
+        base_undecimated = base_result.undecimated
+        undecimated_start = suffix['undecimated_point_start']
+        undecimated_shift = len(undecimated['points']) - 1 - undecimated_start
+        undecimated = {
+            "points": np.concatenate((undecimated['points'], moved(base_undecimated['points'][undecimated_start + 1:]))),
+            "segment_info": undecimated['segment_info'] + _shift_segments(base_undecimated['segment_info'][segment_start:], undecimated_shift),
+            "point_offset": 0,
+            "num_points": np.concatenate((undecimated['num_points'], base_undecimated['num_points'][suffix_index + 1:] + undecimated_shift))
+        }
+    return CenterlineResult(
+        points=np.concatenate((head.points, suffix_points)),
+        segment_info=head.segment_info + _shift_segments(base_result.segment_info[segment_start:], point_shift),
+        final_point=rotation @ base_result.final_point + translation,
+        final_direction=rotation @ base_result.final_direction,
+        final_up_vector=rotation @ base_result.final_up_vector,
+        diameter=head.diameter,
+        checkpoints=checkpoints,
+        tangents=tangents,
+        normals=normals,
+        mesh=mesh,
+        undecimated=undecimated
+    )
+
+
 # --- Hàm chính đã được chỉnh sửa để phù hợp với môi trường web ---
 def calculate_centerline_from_data(data_dict):
     """
-    Tính toán đường tâm ống từ dictionary dữ liệu YBCR.
-    data_dict: một dictionary chứa 'Diameter' (tùy chọn) và 'YBC' (bắt buộc).
+    Tính toán đường tâm ống từ dictionary dữ liệu YBCR (hàm tương thích, bao quanh compute_centerline).
     Trả về một chuỗi JSON chứa kết quả hoặc thông tin lỗi.
     """
+    return json.dumps(compute_centerline(data_dict).to_dict(), separators=(',', ':'))
+
+
+def compute_centerline(data_dict):
+    """
+    Tính toán đường tâm ống từ dictionary dữ liệu YBCR.
+    data_dict: một dictionary chứa 'Diameter' (tùy chọn), 'YBC' (bắt buộc),
+               'NumArcPoints' (tùy chọn) và 'Trace' (tùy chọn, ghi trạng thái từng bước vào kết quả).
+               Chia lưới thích ứng (tùy chọn): 'ArcTolerance' (độ lệch dây cung tối đa, mm) và/hoặc
+               'MaxArcStepDeg' (bước góc tối đa, độ), giới hạn bởi 'MinArcPoints'/'MaxArcPoints'.
+               Khi có một trong hai, số điểm mỗi cung được tính theo Radius và B thay cho NumArcPoints.
+               Tính tăng dần (tùy chọn): 'Checkpoints' ghi trạng thái trước mỗi bước vào kết quả;
+               'ResumeState' (xem CenterlineResult.resume_state) tính tiếp từ một bước, khi đó 'YBC' chỉ chứa các dòng từ bước đó.
+               Lưới bề mặt (tùy chọn): 'MeshProfile' (dict 'profile' như của request) quét biên dạng dọc đường tâm,
+               'MeshRadialSegments' là số đỉnh trên vòng của ống tròn.
+               Khung tại từng điểm (tùy chọn): 'Frames' trả về tiếp tuyến/pháp tuyến/binormal của khung tối thiểu xoay.
+               Khe hở (tùy chọn): 'Clearance' tìm các phần không kề nhau của ống gần hơn Diameter (bỏ qua khi có 'ResumeState',
+               vì cần toàn bộ đường tâm: gọi analyze_clearance trên kết quả đã ghép).
+               Giản lược điểm (tùy chọn): 'DecimateTolerance' (mm) bỏ các điểm cách dây cung của đoạn không quá giá trị này
+               (Douglas-Peucker, xem YBC3D_compact.py); chỉ số điểm trong segment_info được đánh lại.
+    Trả về CenterlineResult; lỗi được báo qua CenterlineResult.error.
+    """
     tube_diameter = 30.0  # Giá trị mặc định
-    error_response_template = {
-        "error": "",
-        "centerline_points": [], "segment_info": [],
-        "final_point": [0,0,0], "final_direction": [1,0,0], # Giá trị mặc định an toàn
-        "diameter": tube_diameter
-    }
 
     # 1. Đọc và kiểm tra dữ liệu đầu vào từ data_dict
     if not isinstance(data_dict, dict):
-        print("ERROR: Input data_dict is not a dictionary.", file=sys.stderr)
-        error_response = error_response_template.copy()
-        error_response["error"] = "Dữ liệu đầu vào không hợp lệ (không phải dictionary)."
-        return json.dumps(error_response, separators=(',', ':'))
+        logger.error("Input data_dict is not a dictionary.")
+        return CenterlineResult.empty(tube_diameter, error="Dữ liệu đầu vào không hợp lệ (không phải dictionary).")
 
     # Đọc Diameter
     try:
@@ -48,53 +427,116 @@ def calculate_centerline_from_data(data_dict):
             if isinstance(diameter_from_input, (int, float)):
                 if float(diameter_from_input) > 0:
                     tube_diameter = float(diameter_from_input)
-                    print(f"INFO: Đọc Diameter từ input: {tube_diameter}", file=sys.stderr)
                 else:
-                    print(f"WARNING: Diameter '{diameter_from_input}' không hợp lệ (<=0), dùng mặc định: {tube_diameter}", file=sys.stderr)
+                    logger.warning("Diameter '%s' không hợp lệ (<=0), dùng mặc định: %s", diameter_from_input, tube_diameter)
             else:
-                print(f"WARNING: Giá trị Diameter '{diameter_from_input}' không phải là số, dùng mặc định: {tube_diameter}", file=sys.stderr)
-        else:
-            print(f"INFO: Key 'Diameter' không tìm thấy trong input. Dùng mặc định: {tube_diameter}", file=sys.stderr)
+                logger.warning("Giá trị Diameter '%s' không phải là số, dùng mặc định: %s", diameter_from_input, tube_diameter)
     except Exception as e:
-        print(f"WARNING: Lỗi khi xử lý Diameter từ input, dùng mặc định: {tube_diameter}. Error: {e}", file=sys.stderr)
+        logger.warning("Lỗi khi xử lý Diameter từ input, dùng mặc định: %s. Error: %s", tube_diameter, e)
         # tube_diameter đã có giá trị mặc định, không cần gán lại
 
-    error_response_template["diameter"] = tube_diameter # Cập nhật diameter cho template lỗi
-
     # Kiểm tra key 'YBC'
     if 'YBC' not in data_dict or not isinstance(data_dict['YBC'], list):
-        print("ERROR: Input data_dict thiếu key 'YBC' hoặc 'YBC' không phải là một list.", file=sys.stderr)
-        error_response = error_response_template.copy()
-        error_response["error"] = "Dữ liệu đầu vào không đúng cấu trúc (thiếu 'YBC' hoặc 'YBC' không phải list)."
-        return json.dumps(error_response, separators=(',', ':'))
+        logger.error("Input data_dict thiếu key 'YBC' hoặc 'YBC' không phải là một list.")
+        return CenterlineResult.empty(tube_diameter, error="Dữ liệu đầu vào không đúng cấu trúc (thiếu 'YBC' hoặc 'YBC' không phải list).")
 
     bend_data = data_dict['YBC']
-    print(f"INFO: Đọc {len(bend_data)} dòng YBC từ input data", file=sys.stderr)
-
-    if not bend_data and len(bend_data) == 0: # Xử lý trường hợp list YBC rỗng
-        print("INFO: Danh sách 'YBC' rỗng. Trả về kết quả rỗng.", file=sys.stderr)
+    try:
+        trace_enabled = read_flag_option(data_dict, 'Trace', TRACE_ENABLED_BY_DEFAULT)
+        record_checkpoints = read_flag_option(data_dict, 'Checkpoints')
+        frames_requested = read_flag_option(data_dict, 'Frames')
+        clearance_requested = read_flag_option(data_dict, 'Clearance')
+    except ValueError as e:
+        logger.error("Tùy chọn không hợp lệ: %s", e)
+        return CenterlineResult.empty(tube_diameter, error=f"Dữ liệu không hợp lệ: {e}")
+    resume_state = data_dict.get('ResumeState')
+    mesh_profile = data_dict.get('MeshProfile')
+    record_frames = frames_requested or mesh_profile is not None # Lưới cần khung tại từng điểm
+
+    if not bend_data and len(bend_data) == 0 and resume_state is None: # Xử lý trường hợp list YBC rỗng
         # Vẫn trả về cấu trúc hợp lệ với các mảng rỗng và giá trị mặc định
-        empty_output = {
-            "centerline_points": [], "segment_info": [],
-            "final_point": [0,0,0], "final_direction": [1,0,0],
-            "diameter": tube_diameter
-        }
-        return json.dumps(empty_output, separators=(',', ':'))
+        return CenterlineResult.empty(tube_diameter)
 
 
     # 2. Khởi tạo trạng thái và danh sách kết quả (Giống code gốc)
     current_point = np.array([0.0, 0.0, 0.0])
     current_direction = np.array([1.0, 0.0, 0.0]) # Hướng ban đầu dọc theo trục X
     current_up_vector = np.array([0.0, 0.0, 1.0]) # Vector Up ban đầu dọc theo trục Z (xác định mặt phẳng uốn ban đầu XY)
-    centerline_points_forward = [current_point.copy()]
+    current_material_normal = current_up_vector.copy() # Pháp tuyến gắn với ống: quay theo cung uốn, không đổi khi xoay C
+    step_offset = 0 # Chỉ số toàn cục của dòng đầu tiên trong bend_data
+    point_offset = 0 # Chỉ số toàn cục của điểm đầu tiên trong mảng điểm
+    segment_offset = 0 # Số đoạn đã có trước dòng đầu tiên
+    if resume_state is not None:
+        # Tính tiếp từ trạng thái đã lưu: điểm đầu tiên trùng với điểm cuối của phần không đổi
+        try:
+            current_point = np.array(resume_state['point'], dtype=float).reshape(3)
+            current_direction = np.array(resume_state['direction'], dtype=float).reshape(3)
+            current_up_vector = np.array(resume_state['up'], dtype=float).reshape(3)
+            current_material_normal = np.array(resume_state.get('normal', resume_state['up']), dtype=float).reshape(3)
+            step_offset = int(resume_state['step'])
+            point_offset = int(resume_state['num_points']) - 1
+            segment_offset = int(resume_state['num_segments'])
+            if step_offset < 0 or point_offset < 0 or segment_offset < 0:
+                raise ValueError("chỉ số âm")
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error("ResumeState không hợp lệ: %s", e)
+            return CenterlineResult.empty(tube_diameter, error="Dữ liệu không hợp lệ: ResumeState không đúng định dạng.")
     segment_details = []
-    start_idx_for_segment = 0
-    num_arc_points = data_dict.get('NumArcPoints', 30) # Cho phép tùy chỉnh số điểm trên cung, mặc định 30
-
-    print("\n--- Bắt đầu tính toán (Sequence: Feed -> Bend -> Rotate) ---", file=sys.stderr)
+    start_idx_for_segment = point_offset
+    num_arc_points = read_positive_option(data_dict, 'NumArcPoints', DEFAULT_NUM_ARC_POINTS, integer=True) # Cho phép tùy chỉnh số điểm trên cung, mặc định 30
+
+    # Chia lưới thích ứng: số điểm mỗi cung theo độ lệch dây cung và/hoặc bước góc tối đa
+    chord_tolerance = read_positive_option(data_dict, 'ArcTolerance', None)
+    max_arc_step_deg = read_positive_option(data_dict, 'MaxArcStepDeg', None)
+    adaptive_tessellation = chord_tolerance is not None or max_arc_step_deg is not None
+    max_arc_step_rad = math.radians(max_arc_step_deg) if max_arc_step_deg is not None else None
+    min_arc_points = read_positive_option(data_dict, 'MinArcPoints', DEFAULT_MIN_ARC_POINTS, integer=True)
+    max_arc_points = read_positive_option(data_dict, 'MaxArcPoints', DEFAULT_MAX_ARC_POINTS, integer=True)
+    if min_arc_points > max_arc_points:
+        logger.warning("MinArcPoints (%d) lớn hơn MaxArcPoints (%d), dùng MaxArcPoints cho cả hai.", min_arc_points, max_arc_points)
+        min_arc_points = max_arc_points
+    for option_key, option_value in (('NumArcPoints', num_arc_points), ('MinArcPoints', min_arc_points), ('MaxArcPoints', max_arc_points)):
+        if option_value > ARC_POINTS_LIMIT:
+            return CenterlineResult.empty(tube_diameter, error=f"Dữ liệu không hợp lệ: {option_key} vượt quá giới hạn {ARC_POINTS_LIMIT} điểm mỗi cung.")
+
+    # Cấp phát trước mảng (N, 3): mỗi dòng YBC thêm tối đa 1 điểm feed + số điểm cung.
+    # Với số điểm cố định, dung lượng này là chính xác; với chia lưới thích ứng, mảng được nới khi cần.
+    arc_points_per_row_reserved = min_arc_points if adaptive_tessellation else num_arc_points
+    if 1 + len(bend_data) * (1 + arc_points_per_row_reserved) > CENTERLINE_POINTS_LIMIT:
+        return CenterlineResult.empty(tube_diameter, error=f"Dữ liệu không hợp lệ: đường tâm vượt quá giới hạn {CENTERLINE_POINTS_LIMIT} điểm.")
+    centerline_points_forward = np.empty((1 + len(bend_data) * (1 + arc_points_per_row_reserved), 3), dtype=float)
+    centerline_points_forward[0] = current_point
+    num_points = 1
+    if record_frames:
+        # Khung tại từng điểm, cùng dung lượng với mảng điểm
+        point_tangents = np.empty_like(centerline_points_forward)
+        point_normals = np.empty_like(centerline_points_forward)
+        point_tangents[0] = current_direction
+        point_normals[0] = current_material_normal
+    # Hệ số góc của các điểm trên cung, dùng chung cho mọi bước uốn khi số điểm cố định
+    arc_fractions = np.arange(1, num_arc_points + 1) / float(num_arc_points)
+
+    trace_steps = [] if trace_enabled else None # Chỉ cấp phát và định dạng trạng thái khi trace được bật
+
+    if record_checkpoints:
+        # Trạng thái (P, D, U, số điểm, số đoạn) trước mỗi bước; hàng cuối là trạng thái sau bước cuối
+        checkpoint_points = np.empty((len(bend_data) + 1, 3))
+        checkpoint_directions = np.empty((len(bend_data) + 1, 3))
+        checkpoint_ups = np.empty((len(bend_data) + 1, 3))
+        checkpoint_normals = np.empty((len(bend_data) + 1, 3))
+        checkpoint_num_points = np.empty(len(bend_data) + 1, dtype=np.int64)
+        checkpoint_num_segments = np.empty(len(bend_data) + 1, dtype=np.int64)
 
     # 3. Vòng lặp xử lý YBCR
-    for i, bend_props in enumerate(bend_data):
+    for row_index, bend_props in enumerate(bend_data):
+        i = step_offset + row_index # Chỉ số toàn cục của dòng, dùng trong thông báo lỗi
+        if record_checkpoints:
+            checkpoint_points[row_index] = current_point
+            checkpoint_directions[row_index] = current_direction
+            checkpoint_ups[row_index] = current_up_vector
+            checkpoint_normals[row_index] = current_material_normal
+            checkpoint_num_points[row_index] = point_offset + num_points
+            checkpoint_num_segments[row_index] = segment_offset + len(segment_details)
         try:
             y = float(bend_props['Y'])
             b_deg = float(bend_props['B'])
@@ -105,35 +547,36 @@ def calculate_centerline_from_data(data_dict):
                 # print(f"WARNING: Radius âm ({r}) ở dòng {i+1}. Lấy giá trị tuyệt đối.", file=sys.stderr)
                 # r = abs(r)
                 # Hoặc coi là lỗi:
-                print(f"ERROR: Radius không thể âm ({r}) ở dòng {i+1}.", file=sys.stderr)
-                error_response = error_response_template.copy()
-                error_response["error"] = f"Dữ liệu không hợp lệ: Radius không thể âm (dòng {i+1})."
-                return json.dumps(error_response, separators=(',', ':'))
+                logger.error("Radius không thể âm (%s) ở dòng %d.", r, i + 1)
+                return CenterlineResult.empty(tube_diameter, error=f"Dữ liệu không hợp lệ: Radius không thể âm (dòng {i+1}).")
 
         except KeyError as ke:
-            print(f"ERROR: Thiếu key {ke} trong một mục của YBC (dòng {i+1})", file=sys.stderr)
-            error_response = error_response_template.copy()
-            error_response["error"] = f"Dữ liệu không hợp lệ: Thiếu key {str(ke)} (dòng {i+1})."
-            return json.dumps(error_response, separators=(',', ':'))
+            logger.error("Thiếu key %s trong một mục của YBC (dòng %d)", ke, i + 1)
+            return CenterlineResult.empty(tube_diameter, error=f"Dữ liệu không hợp lệ: Thiếu key {str(ke)} (dòng {i+1}).")
         except ValueError as ve:
-            print(f"ERROR: Giá trị không phải là số trong một mục của YBC (dòng {i+1}): {ve}", file=sys.stderr)
-            error_response = error_response_template.copy()
-            error_response["error"] = f"Dữ liệu không hợp lệ: Giá trị không phải số (dòng {i+1})."
-            return json.dumps(error_response, separators=(',', ':'))
-
-        print(f"\nProcessing Step {i+1}: Y={y}, B={b_deg}, C={c_deg}, R={r}", file=sys.stderr)
-        print(f"  State before: P={current_point.tolist()}, D={current_direction.tolist()}, U={current_up_vector.tolist()}", file=sys.stderr)
+            logger.error("Giá trị không phải là số trong một mục của YBC (dòng %d): %s", i + 1, ve)
+            return CenterlineResult.empty(tube_diameter, error=f"Dữ liệu không hợp lệ: Giá trị không phải số (dòng {i+1}).")
+
+        if trace_steps is not None:
+            step_trace = {
+                "step": i + 1, "Y": y, "B": b_deg, "C": c_deg, "Radius": r,
+                "point_before": current_point.tolist(),
+                "direction_before": current_direction.tolist(),
+                "up_before": current_up_vector.tolist(),
+                "bend_center": None, "notes": []
+            }
 
         # 1. Feed Y_i (Đẩy ống)
         if abs(y) > 1e-9: # Chỉ thực hiện nếu y khác 0
             current_point = current_point + y * current_direction
-            centerline_points_forward.append(current_point.copy())
-            print(f"  After Feed Y{i+1}: P={current_point.tolist()}", file=sys.stderr)
-            end_idx_for_segment = len(centerline_points_forward) - 1
+            centerline_points_forward[num_points] = current_point
+            if record_frames:
+                point_tangents[num_points] = current_direction
+                point_normals[num_points] = current_material_normal
+            num_points += 1
+            end_idx_for_segment = point_offset + num_points - 1
             segment_details.append({'type': 'Y', 'value': y, 'start_idx': start_idx_for_segment, 'end_idx': end_idx_for_segment})
             start_idx_for_segment = end_idx_for_segment
-        else:
-            print(f"  Feed Y{i+1} skipped (Y is zero or too small)", file=sys.stderr)
 
         # Lưu trạng thái trước khi uốn và xoay
         direction_before_bend_or_rotate = current_direction.copy()
@@ -142,10 +585,11 @@ def calculate_centerline_from_data(data_dict):
         # 2. Bend B_i (Uốn ống)
         if abs(b_deg) > 1e-6: # Chỉ uốn nếu góc B khác 0
             if r < 1e-9: # Bán kính phải đủ lớn để uốn
-                print(f"  WARNING: Bend B{i+1} skipped. Radius R ({r}) is zero or too small for bending.", file=sys.stderr)
+                logger.warning("Bend B%d skipped. Radius R (%s) is zero or too small for bending.", i + 1, r)
+                if trace_steps is not None:
+                    step_trace["notes"].append("bend_skipped_zero_radius")
             else:
                 b_rad = math.radians(b_deg)
-                print(f"  Bending B{i+1}={b_deg} deg, R={r}. Using Up vector U_bend_plane={up_vector_for_bend_plane.tolist()} to define bend plane.", file=sys.stderr)
 
                 # Vector vuông góc với hướng tiến (D) và vector Up (U_bend_plane), nằm trong mặt phẳng uốn.
                 # Vector này chỉ hướng từ điểm uốn đến tâm của cung tròn uốn.
@@ -155,10 +599,8 @@ def calculate_centerline_from_data(data_dict):
                 norm_perp_vector = np.linalg.norm(perp_vector_to_center)
 
                 if norm_perp_vector < 1e-9:
-                    print(f"  ERROR: Cannot perform bend B{i+1}. Direction vector and Up vector for bend plane are parallel. D={direction_before_bend_or_rotate.tolist()}, U_bend_plane={up_vector_for_bend_plane.tolist()}", file=sys.stderr)
-                    error_response = error_response_template.copy()
-                    error_response["error"] = f"Lỗi tính toán: Không thể uốn ở bước {i+1} (Direction và Up song song)."
-                    return json.dumps(error_response, separators=(',', ':'))
+                    logger.error("Cannot perform bend B%d. Direction vector and Up vector for bend plane are parallel.", i + 1)
+                    return CenterlineResult.empty(tube_diameter, error=f"Lỗi tính toán: Không thể uốn ở bước {i+1} (Direction và Up song song).")
 
                 perp_vector_to_center_normalized = perp_vector_to_center / norm_perp_vector
                 bend_center = current_point + r * perp_vector_to_center_normalized # Tâm của cung tròn uốn
@@ -167,39 +609,60 @@ def calculate_centerline_from_data(data_dict):
                 # Quay quanh trục này.
                 bend_axis = up_vector_for_bend_plane
 
-                print(f"    Bend Axis (U_bend_plane): {bend_axis.tolist()}", file=sys.stderr)
-                print(f"    Direction to Bend Center (perp_vec_norm): {perp_vector_to_center_normalized.tolist()}", file=sys.stderr)
-                print(f"    Bend Center: {bend_center.tolist()}", file=sys.stderr)
+                if trace_steps is not None:
+                    step_trace["bend_center"] = bend_center.tolist()
 
                 start_vector_from_center_to_point = current_point - bend_center # Vector từ tâm đến điểm bắt đầu uốn trên cung
 
-                for j in range(1, num_arc_points + 1):
-                    angle_step_rad = b_rad * (j / float(num_arc_points)) # Góc quay từng bước
-                    # Quay vector từ tâm đến điểm hiện tại quanh trục uốn
-                    arc_point_vector_from_center = rotate_vector(start_vector_from_center_to_point, bend_axis, angle_step_rad)
-                    centerline_points_forward.append((bend_center + arc_point_vector_from_center).copy())
+                if adaptive_tessellation:
+                    bend_arc_points = adaptive_arc_point_count(b_rad, r, chord_tolerance, max_arc_step_rad, min_arc_points, max_arc_points)
+                    bend_arc_fractions = np.arange(1, bend_arc_points + 1) / float(bend_arc_points)
+                    # Nới mảng, vẫn giữ chỗ tối thiểu cho các dòng còn lại
+                    required_capacity = num_points + bend_arc_points + (len(bend_data) - row_index - 1) * (1 + min_arc_points)
+                    if required_capacity > CENTERLINE_POINTS_LIMIT:
+                        return CenterlineResult.empty(tube_diameter, error=f"Dữ liệu không hợp lệ: đường tâm vượt quá giới hạn {CENTERLINE_POINTS_LIMIT} điểm.")
+                    if required_capacity > centerline_points_forward.shape[0]:
+                        grown_capacity = min(max(required_capacity, 2 * centerline_points_forward.shape[0]), CENTERLINE_POINTS_LIMIT)
+                        grown_points = np.empty((grown_capacity, 3), dtype=float)
+                        grown_points[:num_points] = centerline_points_forward[:num_points]
+                        centerline_points_forward = grown_points
+                        if record_frames:
+                            grown_tangents = np.empty_like(grown_points)
+                            grown_normals = np.empty_like(grown_points)
+                            grown_tangents[:num_points] = point_tangents[:num_points]
+                            grown_normals[:num_points] = point_normals[:num_points]
+                            point_tangents, point_normals = grown_tangents, grown_normals
+                else:
+                    bend_arc_points = num_arc_points
+                    bend_arc_fractions = arc_fractions
+                if trace_steps is not None:
+                    step_trace["arc_points"] = bend_arc_points
+
+                # Quay vector từ tâm đến điểm bắt đầu quanh trục uốn cho tất cả các góc của cung trong một lần
+                arc_angles_rad = b_rad * bend_arc_fractions
+                arc_vectors_from_center = rotate_vector_batch(start_vector_from_center_to_point, bend_axis, arc_angles_rad)
+                centerline_points_forward[num_points:num_points + bend_arc_points] = bend_center + arc_vectors_from_center
+                if record_frames:
+                    # Tiếp tuyến và pháp tuyến vật liệu quay cùng trục, cùng góc với điểm trên cung
+                    point_tangents[num_points:num_points + bend_arc_points] = rotate_vector_batch(direction_before_bend_or_rotate, bend_axis, arc_angles_rad)
+                    point_normals[num_points:num_points + bend_arc_points] = rotate_vector_batch(current_material_normal, bend_axis, arc_angles_rad)
+                num_points += bend_arc_points
 
                 # Cập nhật điểm và hướng hiện tại sau khi uốn
-                current_point = centerline_points_forward[-1]
+                current_point = centerline_points_forward[num_points - 1].copy()
                 current_direction = rotate_vector(direction_before_bend_or_rotate, bend_axis, b_rad)
                 # Chuẩn hóa lại current_direction để tránh tích lũy sai số
                 norm_current_d = np.linalg.norm(current_direction)
                 if norm_current_d > 1e-9:
                     current_direction = current_direction / norm_current_d
                 else: # Hiếm khi xảy ra nếu logic đúng
-                    print(f"  ERROR: Zero direction vector after bend B{i+1}. This should not happen.", file=sys.stderr)
-                    error_response = error_response_template.copy()
-                    error_response["error"] = f"Lỗi tính toán: Hướng vector bằng không sau khi uốn ở bước {i+1}."
-                    return json.dumps(error_response, separators=(',', ':'))
-
+                    logger.error("Zero direction vector after bend B%d. This should not happen.", i + 1)
+                    return CenterlineResult.empty(tube_diameter, error=f"Lỗi tính toán: Hướng vector bằng không sau khi uốn ở bước {i+1}.")
+                current_material_normal = rotate_vector(current_material_normal, bend_axis, b_rad)
 
-                print(f"  After Bend B{i+1}: P={current_point.tolist()}, New D={current_direction.tolist()}", file=sys.stderr)
-                end_idx_for_segment = len(centerline_points_forward) - 1
+                end_idx_for_segment = point_offset + num_points - 1
                 segment_details.append({'type': 'B', 'angle': b_deg, 'radius': r, 'start_idx': start_idx_for_segment, 'end_idx': end_idx_for_segment})
                 start_idx_for_segment = end_idx_for_segment
-        else:
-            print(f"  Bend B{i+1} skipped (B angle is zero or too small).", file=sys.stderr)
-
 
         # 3. Rotate C_i (Xoay mặt phẳng uốn cho bước tiếp theo)
         # Thao tác này sẽ cập nhật current_up_vector để sử dụng cho bước uốn (B) tiếp theo.
@@ -213,8 +676,6 @@ def calculate_centerline_from_data(data_dict):
             # Về cơ bản, đó là current_up_vector *trước* khi nó được cập nhật bởi C_i này.
             up_vector_to_be_rotated = up_vector_for_bend_plane # Hoặc current_up_vector nếu B không xảy ra, nhưng logic này đã bao hàm
 
-            print(f"  Rotate C{i+1}={c_deg} deg: Rotating Up vector ({up_vector_to_be_rotated.tolist()}) around current Direction D ({axis_for_C_rotation.tolist()})", file=sys.stderr)
-
             new_up_vector = rotate_vector(up_vector_to_be_rotated, axis_for_C_rotation, c_rad)
 
             # Ổn định new_up_vector: đảm bảo nó vuông góc với current_direction (axis_for_C_rotation)
@@ -225,50 +686,147 @@ def calculate_centerline_from_data(data_dict):
 
             if norm_orthogonal_up_vector >= 1e-9:
                 current_up_vector = orthogonal_up_vector / norm_orthogonal_up_vector # Chuẩn hóa
-                print(f"    New Up vector for next step (U_next): {current_up_vector.tolist()}", file=sys.stderr)
             else:
                 # Trường hợp này xảy ra nếu new_up_vector song song với current_direction sau khi xoay,
                 # điều này có nghĩa là up_vector_to_be_rotated ban đầu đã song song với current_direction,
                 # hoặc một lỗi tính toán nghiêm trọng.
                 # Điều này không nên xảy ra nếu D và U luôn vuông góc.
-                print(f"    WARNING: Up vector became parallel to Direction after C{i+1} rotation or zero norm. U_input={up_vector_to_be_rotated.tolist()}, D_axis={axis_for_C_rotation.tolist()}, Rotated_U_raw={new_up_vector.tolist()}", file=sys.stderr)
+                logger.warning("Up vector became parallel to Direction after C%d rotation or zero norm. Keeping previous Up vector.", i + 1)
+                if trace_steps is not None:
+                    step_trace["notes"].append("up_vector_kept_after_c_rotation")
                 # Cố gắng phục hồi bằng cách chọn một vector vuông góc mặc định nếu có thể,
                 # ví dụ, nếu D không phải là (0,0,1), thì U_new có thể là (0,0,1) x D.
                 # Tuy nhiên, để đơn giản, ở đây chỉ cảnh báo và có thể giữ U cũ.
                 # Hoặc, nghiêm trọng hơn, đây có thể là một lỗi logic cần được sửa.
                 # Giữ lại current_up_vector từ trước khi xoay C có thể không đúng.
                 # current_up_vector = up_vector_to_be_rotated # Tạm thời giữ U cũ để tránh lỗi, nhưng cần xem xét lại
-                print(f"    Keeping previous Up vector due to issue: {current_up_vector.tolist()}", file=sys.stderr)
-
-
-        else:
-            print(f"  Rotate C{i+1} skipped (C angle is zero or too small). Up vector remains: {current_up_vector.tolist()}", file=sys.stderr)
-            # Nếu C=0, current_up_vector không thay đổi so với up_vector_for_bend_plane
-            # current_up_vector = up_vector_for_bend_plane # Đã đúng
-
-        print(f"  End of Step {i+1}: P={current_point.tolist()}, D={current_direction.tolist()}, Final U for this step (U_next)={current_up_vector.tolist()}", file=sys.stderr)
-
 
-    # 4. Chuẩn bị dữ liệu Output JSON
-    print("\n--- Tính toán Forward hoàn tất ---", file=sys.stderr)
+        # Nếu C=0, current_up_vector không thay đổi so với up_vector_for_bend_plane
+        # current_up_vector = up_vector_for_bend_plane # Đã đúng
+
+        if trace_steps is not None:
+            step_trace["point"] = current_point.tolist()
+            step_trace["direction"] = current_direction.tolist()
+            step_trace["up"] = current_up_vector.tolist()
+            step_trace["num_points"] = point_offset + num_points
+            trace_steps.append(step_trace)
+
+
+    # 4. Chuẩn bị kết quả (mảng NumPy, việc serialize do lớp gọi đảm nhận)
+    checkpoints = None
+    if record_checkpoints:
+        checkpoint_points[-1] = current_point
+        checkpoint_directions[-1] = current_direction
+        checkpoint_ups[-1] = current_up_vector
+        checkpoint_normals[-1] = current_material_normal
+        checkpoint_num_points[-1] = point_offset + num_points
+        checkpoint_num_segments[-1] = segment_offset + len(segment_details)
+        checkpoints = {
+            "point": checkpoint_points, "direction": checkpoint_directions, "up": checkpoint_ups, "normal": checkpoint_normals,
+            "num_points": checkpoint_num_points, "num_segments": checkpoint_num_segments
+        }
     P_final_forward = current_point.copy()
     D_final_forward = current_direction.copy()
     U_final = current_up_vector.copy() # Vector Up cuối cùng
 
-    print(f"Final Point: {P_final_forward.tolist()}", file=sys.stderr)
-    print(f"Final Direction: {D_final_forward.tolist()}", file=sys.stderr)
-    print(f"Final Up Vector: {U_final.tolist()}", file=sys.stderr)
-
-    output_data = {
-        "centerline_points": [p.tolist() for p in centerline_points_forward],
-        "segment_info": segment_details,
-        "final_point": P_final_forward.tolist(),
-        "final_direction": D_final_forward.tolist(),
-        "final_up_vector": U_final.tolist(), # Thêm thông tin vector Up cuối cùng
-        "diameter": tube_diameter
-    }
+    result_points = centerline_points_forward[:num_points]
+    if record_frames:
+        result_tangents, result_normals = point_tangents[:num_points], point_normals[:num_points]
 
-    return json.dumps(output_data, separators=(',', ':'))
+    clearance = None
+    if clearance_requested and resume_state is None:
+        # Khe hở được tính trên đường tâm đầy đủ, trước khi giản lược điểm
+        try:
+            clearance = analyze_clearance(result_points, segment_details, tube_diameter)
+        except ValueError as e:
+            logger.error("Không phân tích được khe hở: %s", e)
+            return CenterlineResult.empty(tube_diameter, error=f"Dữ liệu không hợp lệ: {e}")
+
+    # Giản lược điểm (tùy chọn): bỏ các điểm cách dây cung <= DecimateTolerance, giữ điểm đầu/cuối của mọi đoạn.
+    # Chỉ số trong segment_info, checkpoints và trace được đánh lại, nên ResumeState và các phần tiếp theo vẫn khớp.
+    decimate_tolerance = read_positive_option(data_dict, 'DecimateTolerance', None)
+    undecimated = None
+    if decimate_tolerance is not None and clearance_requested and checkpoints is not None:
+        # Giữ bản chưa giản lược để khe hở của kết quả ghép từ các phần (ResumeState) bằng khe hở khi tính toàn bộ
+        undecimated_offset = int(resume_state.get('undecimated_num_points', point_offset + 1)) - 1 \
+            if resume_state is not None else 0
+        index_shift = undecimated_offset - point_offset
+        undecimated = {
+            "points": result_points,
+            "segment_info": [dict(segment, start_idx=segment['start_idx'] + index_shift, end_idx=segment['end_idx'] + index_shift)
+                             for segment in segment_details],
+            "point_offset": undecimated_offset,
+            "num_points": checkpoints['num_points'] + index_shift
+        }
+    if decimate_tolerance is not None and num_points > 2:
+        keep = decimation_mask(result_points, [(segment['start_idx'] - point_offset, segment['end_idx'] - point_offset)
+                                               for segment in segment_details], decimate_tolerance)
+        new_index = point_offset + np.cumsum(keep) - 1 # Chỉ số toàn cục mới của từng điểm được giữ
+        for segment in segment_details:
+            segment['start_idx'] = int(new_index[segment['start_idx'] - point_offset])
+            segment['end_idx'] = int(new_index[segment['end_idx'] - point_offset])
+        if checkpoints is not None:
+            checkpoints['num_points'] = new_index[checkpoints['num_points'] - 1 - point_offset] + 1
+        if trace_steps is not None:
+            for step_trace in trace_steps:
+                step_trace['num_points'] = int(new_index[step_trace['num_points'] - 1 - point_offset]) + 1
+        result_points = result_points[keep]
+        if record_frames:
+            result_tangents, result_normals = result_tangents[keep], result_normals[keep]
+
+    mesh = None
+    if mesh_profile is not None:
+        radial_segments = read_positive_option(data_dict, 'MeshRadialSegments', DEFAULT_RADIAL_SEGMENTS, integer=True)
+        try:
+            mesh = build_tube_mesh(result_points, result_tangents, result_normals, mesh_profile,
+                                   max(radial_segments, 3), point_offset)
+        except ValueError as e:
+            logger.error("Không tạo được lưới bề mặt: %s", e)
+            return CenterlineResult.empty(tube_diameter, error=f"Dữ liệu không hợp lệ: {e}")
+
+    return CenterlineResult(
+        points=result_points,
+        segment_info=segment_details,
+        final_point=P_final_forward,
+        final_direction=D_final_forward,
+        final_up_vector=U_final,
+        diameter=tube_diameter,
+        trace=trace_steps,
+        step_offset=step_offset,
+        point_offset=point_offset,
+        segment_offset=segment_offset,
+        checkpoints=checkpoints,
+        tangents=result_tangents if frames_requested else None,
+        normals=result_normals if frames_requested else None,
+        mesh=mesh,
+        clearance=clearance,
+        undecimated=undecimated
+    )
+
+DEFAULT_STREAM_CHUNK_ROWS = 256 # Số dòng YBC mỗi phần khi tính theo từng phần
+
+def iter_centerline_chunks(data_dict, rows_per_chunk=DEFAULT_STREAM_CHUNK_ROWS):
+    """
+    Tính đường tâm theo từng phần rows_per_chunk dòng YBC, mỗi phần tiếp tục từ trạng thái cuối của phần trước
+    (cùng cơ chế với ResumeState), nên bộ nhớ chỉ tỉ lệ với một phần thay vì toàn bộ chương trình.
+    Sinh ra các CenterlineResult với point_offset/segment_offset toàn cục; kết quả lỗi là phần cuối cùng.
+    Không hỗ trợ 'MeshProfile' và 'Clearance' (cần toàn bộ đường tâm).
+    """
+    if not isinstance(data_dict, dict) or not isinstance(data_dict.get('YBC'), list) or not data_dict['YBC']:
+        yield compute_centerline(data_dict) # Lỗi đầu vào hoặc YBC rỗng: một phần duy nhất như compute_centerline
+        return
+    bend_data = data_dict['YBC']
+    chunk_input = {key: value for key, value in data_dict.items() if key not in ('YBC', 'Checkpoints', 'ResumeState', 'MeshProfile', 'Clearance')}
+    resume_state = data_dict.get('ResumeState')
+    for chunk_start in range(0, len(bend_data), rows_per_chunk):
+        chunk_rows = bend_data[chunk_start:chunk_start + rows_per_chunk]
+        chunk_result = compute_centerline(dict(chunk_input, YBC=chunk_rows, Checkpoints=True, ResumeState=resume_state))
+        if chunk_result.error:
+            yield chunk_result
+            return
+        resume_state = chunk_result.resume_state(chunk_result.step_offset + len(chunk_rows))
+        chunk_result.checkpoints = None # Chỉ dùng để nối các phần
+        yield chunk_result
 
 # Bạn có thể thêm một khối if __name__ == "__main__": ở đây để test nhanh file này
 # ví dụ:
@@ -1,55 +1,120 @@
 # File: api/index.py
 
 # Đảm bảo các dòng import này không có khoảng trắng/tab ở đầu dòng
-from flask import Flask, request, jsonify
+# Khởi động nhanh (cold start trên Vercel): module này chỉ import Flask và các module nhẹ.
+# Engine YBC3D_web, định dạng nhị phân YBC3D_binary (cùng NumPy) được import ở lần đầu cần tính toán (load_engine),
+# nên các nhánh rẻ như lỗi kiểm tra dữ liệu, 304 theo ETag, /api/health không phải trả chi phí import NumPy.
+# Chế độ ngược YBC3D_inverse chỉ được import ở request /api/fit_ybc đầu tiên (load_inverse_engine).
+# Kiểm tra ngân sách thời gian import: python bench/check_import_time.py
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
+from types import SimpleNamespace
+import hmac
+import importlib
 import json
 import logging
 import os
+import time
 
-# Các dòng comment cũng không nên có thụt đầu dòng không cần thiết
-# Quan trọng: Khi triển khai lên Vercel, các file trong thư mục 'api'
-# có thể được coi là đang ở thư mục gốc của môi trường serverless.
-# Chúng ta cần đảm bảo YBC3D_web.py được import đúng cách.
-try: # Khối try bắt đầu ở đây, các dòng bên trong nó sẽ được thụt vào
-    # Thử import trực tiếp nếu Vercel đặt các file cùng cấp khi build
-    from YBC3D_web import calculate_centerline_from_data
-except ImportError:
-    # Nếu không được, thử import từ thư mục hiện tại (thường là 'api')
-    # Điều này có thể cần thiết tùy theo cách Vercel build
+_engine = None # Namespace các hàm của engine sau khi import; False nếu import lỗi (không thử lại mỗi request)
+_inverse_engine = None # Như _engine, cho chế độ ngược (YBC3D_inverse): chỉ /api/fit_ybc cần, import riêng
+
+
+def _import_api_module(module_name):
+    """ Module cùng thư mục api/, hoặc None nếu không import được (lỗi được ghi bằng logging.critical) """
+    # Quan trọng: Khi triển khai lên Vercel, các file trong thư mục 'api'
+    # có thể được coi là đang ở thư mục gốc của môi trường serverless.
+    # Chúng ta cần đảm bảo các module engine được import đúng cách.
     try:
-        from .YBC3D_web import calculate_centerline_from_data
-    except ImportError as e:
-        # Sử dụng logging của Python thay vì print trực tiếp trong môi trường serverless
-        # logging.critical sẽ được Vercel ghi lại
-        logging.critical(f"LỖI NGHIÊM TRỌNG: Không thể import 'calculate_centerline_from_data' từ YBC3D_web.py. Lỗi: {e}")
-        logging.critical("Đường dẫn sys.path hiện tại: %s", os.sys.path)
-        # Dòng này sẽ giúp bạn kiểm tra Vercel có "thấy" file YBC3D_web.py không
-        # Trong môi trường Vercel, thư mục làm việc thường là /var/task
-        current_dir_content = "Không thể liệt kê thư mục."
+        # Thử import trực tiếp nếu Vercel đặt các file cùng cấp khi build
+        return importlib.import_module(module_name)
+    except ImportError:
+        # Nếu không được, thử import từ thư mục hiện tại (thường là 'api')
+        # Điều này có thể cần thiết tùy theo cách Vercel build
         try:
-            current_dir_content = os.listdir('.' if os.path.exists('.') else '/var/task/api') # Thử /var/task/api nếu '.' không hoạt động
-            # Hoặc os.listdir(os.path.dirname(__file__)) # Lấy thư mục của file hiện tại
-        except Exception as list_dir_e:
-            current_dir_content = f"Lỗi khi liệt kê thư mục: {list_dir_e}"
+            return importlib.import_module('.' + module_name, __package__ or '')
+        except (ImportError, TypeError) as e:
+            # Sử dụng logging của Python thay vì print trực tiếp trong môi trường serverless
+            # logging.critical sẽ được Vercel ghi lại
+            logging.critical(f"LỖI NGHIÊM TRỌNG: Không thể import engine {module_name}.py. Lỗi: {e}")
+            logging.critical("Đường dẫn sys.path hiện tại: %s", os.sys.path)
+            # Dòng này sẽ giúp bạn kiểm tra Vercel có "thấy" file engine không
+            try:
+                current_dir_content = os.listdir(os.path.dirname(os.path.abspath(__file__)))
+            except Exception as list_dir_e:
+                current_dir_content = f"Lỗi khi liệt kê thư mục: {list_dir_e}"
+            logging.critical(f"Các file trong thư mục api/: {current_dir_content}")
+            return None
+
+
+def _import_engine():
+    """ Namespace các hàm của engine đường tâm, hoặc False nếu không import được """
+    web_module = _import_api_module('YBC3D_web')
+    binary_module = _import_api_module('YBC3D_binary') if web_module else None
+    if binary_module is None:
+        return False
+    return SimpleNamespace(
+        compute_centerline=web_module.compute_centerline,
+        merge_resumed_result=web_module.merge_resumed_result,
+        suffix_transform=web_module.suffix_transform,
+        splice_resumed_result=web_module.splice_resumed_result,
+        suffix_matrix=web_module.suffix_matrix,
+        iter_centerline_chunks=web_module.iter_centerline_chunks,
+        analyze_clearance=web_module.analyze_clearance,
+        round_points=web_module.round_points,
+        pack_centerline_binary=binary_module.pack_centerline_binary
+    )
+
+
+def load_engine():
+    """ Engine (import ở lần gọi đầu tiên), hoặc None nếu không import được: các handler trả về lỗi 500 """
+    global _engine
+    if _engine is None:
+        _engine = _import_engine()
+    return _engine or None
+
+
+def load_inverse_engine():
+    """ Như load_engine, cho fit_ybc_program: request tính đường tâm không phải trả chi phí import YBC3D_inverse """
+    global _inverse_engine
+    if _inverse_engine is None:
+        inverse_module = _import_api_module('YBC3D_inverse')
+        _inverse_engine = SimpleNamespace(fit_ybc_program=inverse_module.fit_ybc_program) if inverse_module else False
+    return _inverse_engine or None
+
 
-        logging.critical(f"Các file trong thư mục hiện tại (dự kiến là api/): {current_dir_content}")
+def engine_unavailable_response():
+    app.logger.error("Engine YBC3D_web không khả dụng (lỗi import, xem log khi khởi động).")
+    return jsonify({"error": "Lỗi server: Chức năng tính toán không khả dụng (lỗi import nội bộ)."}), 500
 
 
-        def calculate_centerline_from_data(data_dict): # Hàm giả
-            return json.dumps({
-                "error": "Lỗi cấu hình server: Chức năng tính toán không khả dụng do lỗi import module YBC3D_web.",
-                "centerline_points": [], "segment_info": [],
-                "final_point": [0,0,0], "final_direction": [1,0,0],
-                "final_up_vector": [0,0,1],
-                "diameter": data_dict.get("Diameter", 30.0),
-                "profile": data_dict.get("profile_in_request", {})
-            })
+# Hằng số của định dạng nhị phân, khai báo lại ở đây để không phải import YBC3D_binary (NumPy) khi khởi động;
+# phải khớp với BINARY_CONTENT_TYPE trong YBC3D_binary.py và POINT_PRECISIONS trong YBC3D_compact.py
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+POINT_PRECISIONS = ('float64', 'float32', 'int16')
+NDJSON_PRECISIONS = ('float64', 'float32') # int16 lượng tử hóa theo hộp bao của toàn bộ đường tâm: không có khi stream
+DEFAULT_BINARY_PRECISION = 'float32'
+DEFAULT_JSON_PRECISION = 'float64'
+
+try:
+    from YBC3D_cache import ResultCache, ProgramStore, canonical_request_key, normalize_ybc_rows, content_revision
+except ImportError:
+    from .YBC3D_cache import ResultCache, ProgramStore, canonical_request_key, normalize_ybc_rows, content_revision
+
+try:
+    from YBC3D_metrics import MetricsRegistry, RequestTimer, NULL_TIMER
+except ImportError:
+    from .YBC3D_metrics import MetricsRegistry, RequestTimer, NULL_TIMER
 
 # Khởi tạo ứng dụng Flask
 # Dòng này cũng không được thụt đầu dòng
 app = Flask(__name__)
-CORS(app) # Cho phép CORS cho tất cả các route
+# Cho phép CORS cho tất cả các route; các header kết quả cần được đọc từ JavaScript khác origin
+INCREMENTAL_RESPONSE_HEADERS = ['X-YBC-Revision', 'X-YBC-Step-Offset', 'X-YBC-Point-Offset', 'X-YBC-Segment-Offset',
+                                'X-YBC-Suffix-Point-Start', 'X-YBC-Suffix-Segment-Start', 'X-YBC-Suffix-Transform',
+                                'X-YBC-Suffix-Twist']
+CLEARANCE_RESPONSE_HEADERS = ['X-YBC-Min-Clearance', 'X-YBC-Interferences']
+CORS(app, expose_headers=['ETag', 'Server-Timing'] + INCREMENTAL_RESPONSE_HEADERS + CLEARANCE_RESPONSE_HEADERS)
 
 # Cấu hình logger của Flask
 if not app.debug:
@@ -57,19 +122,294 @@ if not app.debug:
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
 
+# Mức log có cấu trúc: YBC_LOG_LEVEL=DEBUG|INFO|WARNING|ERROR áp dụng cho cả Flask và engine YBC3D_web
+_log_level_name = os.environ.get('YBC_LOG_LEVEL', '').strip().upper()
+if isinstance(logging.getLevelName(_log_level_name), int):
+    app.logger.setLevel(_log_level_name)
+    logging.getLogger("YBC3D_web").setLevel(_log_level_name)
+
+
+# Cache kết quả: YBC_CACHE_MAX_BYTES giới hạn tầng bộ nhớ (0 = tắt cache),
+# YBC_CACHE_DIR bật tầng đĩa (ví dụ /tmp/ybc3d-cache trên serverless)
+CACHE_MAX_BYTES = int(os.environ.get('YBC_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+result_cache = ResultCache(CACHE_MAX_BYTES, os.environ.get('YBC_CACHE_DIR') or None) if CACHE_MAX_BYTES > 0 else None
+
+# Trạng thái các chương trình đang chỉnh sửa để chỉ tính lại phần đuôi:
+# YBC_PROGRAM_STORE_MAX_BYTES giới hạn tổng dung lượng (0 = tắt)
+PROGRAM_STORE_MAX_BYTES = int(os.environ.get('YBC_PROGRAM_STORE_MAX_BYTES', str(64 * 1024 * 1024)))
+program_store = ProgramStore(PROGRAM_STORE_MAX_BYTES) if PROGRAM_STORE_MAX_BYTES > 0 else None
+
+# Giới hạn cho endpoint batch, có thể cấu hình qua biến môi trường
+# Số luồng tối đa của batch. Vòng lặp theo dòng YBC giữ GIL nên các luồng không tính song song trên nhiều CPU:
+# chúng chỉ chồng lấp đọc/ghi cache trên đĩa và các đoạn NumPy nhả GIL. Không dùng process pool vì môi trường
+# serverless (Vercel/Lambda) không hỗ trợ multiprocessing đầy đủ; cần song song CPU thì chia batch qua nhiều request.
+BATCH_MAX_WORKERS = int(os.environ.get('YBC_BATCH_MAX_WORKERS', '4'))
+BATCH_MAX_JOBS = int(os.environ.get('YBC_BATCH_MAX_JOBS', '1000')) # Số job tối đa trong một request
+
+# Giới hạn số điểm đo của chế độ ngược (/api/fit_ybc), có thể cấu hình qua biến môi trường
+FIT_MAX_POINTS = int(os.environ.get('YBC_FIT_MAX_POINTS', '200000'))
+
+# Đo thời gian từng pha: header Server-Timing và histogram ở /api/metrics (YBC_METRICS=0 để tắt)
+METRICS_ENABLED = os.environ.get('YBC_METRICS', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+TIMED_ENDPOINTS = {'handle_calculate_tube': 'calculate_tube', 'handle_calculate_tube_batch': 'calculate_tube_batch',
+                   'handle_fit_ybc': 'fit_ybc'}
+metrics_registry = MetricsRegistry() if METRICS_ENABLED else None
+# /api/metrics đi qua rewrite công khai '/api/(.*)' của vercel.json: đặt YBC_METRICS_TOKEN để yêu cầu
+# 'Authorization: Bearer <token>'. Không đặt thì route công khai (chỉ gồm số liệu tổng hợp, không có dữ liệu request).
+METRICS_TOKEN = os.environ.get('YBC_METRICS_TOKEN', '')
+CACHE_COUNTER_KEYS = ('hits', 'disk_hits', 'misses', 'evictions') # Bộ đếm tích lũy của ResultCache.stats(); còn lại là gauge
+
+# Phản hồi NDJSON theo từng phần: số dòng YBC được tính cho mỗi phần gửi đi
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+STREAM_CHUNK_ROWS = max(1, int(os.environ.get('YBC_STREAM_CHUNK_ROWS', '256')))
+
+
+# Các tùy chọn của request (hoặc job batch) được chuyển thẳng cho engine: khóa request -> khóa data_dict
+REQUEST_OPTION_KEYS = {
+    'trace': 'Trace',
+    'frames': 'Frames',
+    'clearance': 'Clearance',
+    'NumArcPoints': 'NumArcPoints',
+    'ArcTolerance': 'ArcTolerance',
+    'MaxArcStepDeg': 'MaxArcStepDeg',
+    'MinArcPoints': 'MinArcPoints',
+    'MaxArcPoints': 'MaxArcPoints',
+    'MeshRadialSegments': 'MeshRadialSegments',
+    'DecimateTolerance': 'DecimateTolerance',
+}
+
+# Tùy chọn của /api/fit_ybc: khóa request -> tham số của fit_ybc_program (số dương)
+FIT_OPTION_KEYS = {
+    'Tolerance': 'tolerance',
+    'MaxResidual': 'max_residual',
+    'MinRadius': 'min_radius',
+}
+
+
+if METRICS_ENABLED:
+    # Chỉ đăng ký hook khi bật: khi tắt, handler chỉ tốn một lần g.get trả về NULL_TIMER
+    @app.before_request
+    def start_request_timer():
+        if request.endpoint in TIMED_ENDPOINTS:
+            g.request_timer = RequestTimer()
+
+    @app.after_request
+    def finish_request_timer(response):
+        timer = g.pop('request_timer', None)
+        if timer is not None:
+            # Với phản hồi streaming, 'total' là thời gian đến byte đầu tiên
+            total_ms = timer.total_ms()
+            timer.set_size('request_bytes', request.content_length)
+            if not response.is_streamed:
+                timer.set_size('response_bytes', response.content_length)
+            response.headers['Server-Timing'] = timer.server_timing_header(total_ms)
+            metrics_registry.observe_request(TIMED_ENDPOINTS[request.endpoint], response.status_code, timer, total_ms)
+        return response
+
+
+def request_timer():
+    """ RequestTimer của request hiện tại, hoặc NULL_TIMER khi tắt đo đạc """
+    return g.get('request_timer', NULL_TIMER)
+
+
+def build_centerline_input(profile_info, ybc_data, request_options=None):
+    """ Tạo dictionary đầu vào cho engine từ 'profile', 'YBC' và các tùy chọn của request """
+    data_for_centerline_calc = {'YBC': ybc_data}
+    if request_options:
+        for request_key, engine_key in REQUEST_OPTION_KEYS.items():
+            if request_options.get(request_key) is not None:
+                data_for_centerline_calc[engine_key] = request_options[request_key]
+    if profile_info.get('type') == 'round':
+        dimensions = profile_info.get('dimensions', {})
+        if 'diameter' in dimensions:
+            data_for_centerline_calc['Diameter'] = dimensions['diameter']
+    if request_options and request_options.get('mesh'):
+        # Lưới bề mặt được tạo ở server (và được cache cùng kết quả) thay vì dựng TubeGeometry ở trình duyệt
+        data_for_centerline_calc['MeshProfile'] = profile_info
+    return data_for_centerline_calc
+
+
+def wants_binary_response():
+    """ Client yêu cầu định dạng nhị phân qua '?format=binary' hoặc header 'Accept: application/octet-stream' """
+    if request.args.get('format') == 'binary':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', BINARY_CONTENT_TYPE]) == BINARY_CONTENT_TYPE
+
+
+def wants_ndjson_response():
+    """ Client yêu cầu phản hồi NDJSON theo từng phần qua '?stream=1' hoặc header 'Accept: application/x-ndjson' """
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_CONTENT_TYPE]) == NDJSON_CONTENT_TYPE
+
+
+def iter_ndjson_lines(first_chunk, remaining_chunks, round_points=None):
+    """
+    Các dòng NDJSON của phản hồi theo từng phần:
+      {"trace": [...]} trước các đoạn của mỗi phần khi yêu cầu 'trace' (các bước của phần đó, chỉ số toàn cục),
+      {"segment": {...}, "points": [[x, y, z], ...], "normals": [...], "binormals": [...]} cho mỗi đoạn
+        (điểm từ start_idx đến end_idx, kể cả hai đầu; normals/binormals chỉ có khi yêu cầu 'frames'),
+      {"done": true, "final_point", "final_direction", "final_up_vector", "diameter", "num_points", "num_segments"} ở cuối,
+      hoặc {"error": ...} nếu một phần sau bị lỗi (mã trạng thái 200 đã được gửi).
+    round_points: hàm làm tròn tọa độ khi yêu cầu precision 'float32' (YBC3D_compact.round_points).
+    """
+    chunk = first_chunk
+    num_segments = 0
+    chunk_iterator = iter(remaining_chunks)
+    while chunk is not None:
+        if chunk.error:
+            yield json.dumps({"error": chunk.error}, ensure_ascii=False) + '\n'
+            return
+        binormals = chunk.binormals()
+        points = round_points(chunk.points) if round_points is not None else chunk.points
+        lines = []
+        if chunk.trace is not None:
+            lines.append(json.dumps({"trace": chunk.trace}, separators=(',', ':')))
+        for segment in chunk.segment_info:
+            start = segment['start_idx'] - chunk.point_offset
+            end = segment['end_idx'] - chunk.point_offset + 1
+            line = {"segment": segment, "points": points[start:end].tolist()}
+            if binormals is not None:
+                line["normals"] = chunk.normals[start:end].tolist()
+                line["binormals"] = binormals[start:end].tolist()
+            lines.append(json.dumps(line, separators=(',', ':')))
+        num_segments += len(chunk.segment_info)
+        if lines:
+            yield '\n'.join(lines) + '\n' # Một lần ghi cho mỗi phần
+        last_chunk = chunk
+        chunk = next(chunk_iterator, None)
+    yield json.dumps({
+        "done": True,
+        "final_point": last_chunk.final_point.tolist(),
+        "final_direction": last_chunk.final_direction.tolist(),
+        "final_up_vector": last_chunk.final_up_vector.tolist(),
+        "diameter": last_chunk.diameter,
+        "num_points": last_chunk.point_offset + len(last_chunk.points),
+        "num_segments": num_segments
+    }, separators=(',', ':')) + '\n'
+
+
+def compute_centerline_cached(data_for_centerline_calc, cache_key):
+    """ compute_centerline qua cache kết quả; trả về (CenterlineResult, có_trúng_cache) """
+    if result_cache is not None:
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            return cached_result, True
+    result = load_engine().compute_centerline(data_for_centerline_calc)
+    if result_cache is not None:
+        result_cache.put(cache_key, result)
+    return result, False
+
+
+def compute_program_incremental(program_id, base_revision, data_for_centerline_calc, profile_info):
+    """
+    Tính chương trình đang được chỉnh sửa. Nếu server còn giữ đúng revision base_revision với cùng tùy chọn
+    và profile, chỉ tính lại từ dòng YBC đầu tiên thay đổi; ngược lại tính toàn bộ.
+    Các dòng cuối không đổi không được tính lại: phần đuôi khi đó chỉ gồm các dòng đã sửa, kèm 'suffix' (phép dời hình
+    cho các điểm và đoạn còn lại của kết quả trước, xem YBC3D_web.suffix_transform).
+    Trả về (kết quả phần đuôi, kết quả đầy đủ, revision mới). Khi tính toàn bộ, phần đuôi chính là kết quả đầy đủ.
+    Revision suy ra từ nội dung (content_revision), không phải bộ đếm của tiến trình: hai instance không thể cấp
+    cùng revision cho hai chương trình khác nhau.
+    """
+    options_key = canonical_request_key(
+        {key: value for key, value in data_for_centerline_calc.items() if key != 'YBC'}, profile_info)
+    rows = normalize_ybc_rows(data_for_centerline_calc['YBC'])
+    entry = program_store.get(program_id)
+    engine = load_engine()
+
+    if entry is not None and base_revision is not None and entry['revision'] == base_revision \
+            and entry['options_key'] == options_key:
+        first_changed_step = 0
+        for previous_row, row in zip(entry['rows'], rows):
+            if previous_row != row:
+                break
+            first_changed_step += 1
+        # Các dòng cuối không đổi (phần đuôi) chỉ cần dời hình theo trạng thái sau các dòng đã sửa, không tính lại
+        # (trừ khi có trace: các bước trong trace không được dời hình)
+        suffix_rows = 0
+        max_suffix_rows = min(len(entry['rows']), len(rows)) - first_changed_step
+        while suffix_rows < max_suffix_rows and entry['rows'][-1 - suffix_rows] == rows[-1 - suffix_rows]:
+            suffix_rows += 1
+        base_result = entry['result']
+        if base_result.trace is not None:
+            suffix_rows = 0
+        tail_result = engine.compute_centerline(dict(
+            data_for_centerline_calc, YBC=data_for_centerline_calc['YBC'][first_changed_step:len(rows) - suffix_rows],
+            Checkpoints=True, ResumeState=base_result.resume_state(first_changed_step)))
+        if tail_result.error:
+            full_result = tail_result
+        elif suffix_rows:
+            tail_result.suffix = engine.suffix_transform(base_result, tail_result, len(entry['rows']) - suffix_rows)
+            full_result = engine.splice_resumed_result(base_result, tail_result)
+            # Phần gửi đi chỉ gồm các dòng đã sửa, nhưng mang trạng thái cuối của cả chương trình
+            tail_result.final_point = full_result.final_point
+            tail_result.final_direction = full_result.final_direction
+            tail_result.final_up_vector = full_result.final_up_vector
+        else:
+            full_result = engine.merge_resumed_result(base_result, tail_result)
+        if data_for_centerline_calc.get('Clearance') and not tail_result.error:
+            # Khe hở phụ thuộc toàn bộ đường tâm: tính lại trên kết quả đã ghép (trước khi giản lược, như khi tính
+            # toàn bộ) và gửi kèm phần đuôi
+            clearance_input = full_result.undecimated or {"points": full_result.points, "segment_info": full_result.segment_info}
+            try:
+                full_result.clearance = tail_result.clearance = engine.analyze_clearance(
+                    clearance_input["points"], clearance_input["segment_info"], full_result.diameter)
+            except ValueError as e:
+                full_result.error = tail_result.error = f"Dữ liệu không hợp lệ: {e}"
+    else:
+        full_result = tail_result = engine.compute_centerline(dict(data_for_centerline_calc, Checkpoints=True))
+
+    revision = content_revision(rows, options_key)
+    if not full_result.error:
+        program_store.put(program_id, revision, options_key, rows, full_result)
+    return tail_result, full_result, revision
+
+
+def compute_batch_job(job):
+    """
+    Tính toán một job trong batch. Không ném ngoại lệ: mọi lỗi được trả về trong khóa 'error'
+    để một job hỏng không làm hỏng cả batch.
+    """
+    try:
+        if not isinstance(job, dict):
+            return {"error": "Job không hợp lệ (không phải object)."}
+        profile_info = job.get('profile')
+        ybc_data = job.get('YBC')
+        if not profile_info or not isinstance(profile_info, dict):
+            return {"error": "Thiếu hoặc sai định dạng 'profile'."}
+        if not ybc_data or not isinstance(ybc_data, list):
+            return {"error": "Thiếu hoặc sai định dạng 'YBC'."}
+        point_precision = job.get('precision', DEFAULT_JSON_PRECISION)
+        if point_precision not in POINT_PRECISIONS:
+            return {"error": f"'precision' không hợp lệ (chỉ hỗ trợ {', '.join(POINT_PRECISIONS)})."}
+
+        if load_engine() is None:
+            return {"error": "Lỗi server: Chức năng tính toán không khả dụng (lỗi import nội bộ)."}
+
+        data_for_centerline_calc = build_centerline_input(profile_info, ybc_data, job)
+        result, _ = compute_centerline_cached(data_for_centerline_calc, canonical_request_key(data_for_centerline_calc, profile_info))
+        if result.error:
+            return {"error": result.error}
+        result_data = result.to_dict(precision=point_precision)
+        result_data['profile'] = profile_info
+        return result_data
+    except Exception as e:
+        app.logger.error(f"Lỗi không xác định khi tính job batch: {e}", exc_info=True)
+        return {"error": "Lỗi server không mong muốn khi tính job."}
+
 
 @app.route('/api/calculate_tube', methods=['POST'])
 def handle_calculate_tube():
     # Các dòng bên trong hàm này sẽ được thụt vào một cấp
-    app.logger.info(f"Yêu cầu nhận được tại /api/calculate_tube với phương thức {request.method}")
+    request_started_at = time.perf_counter()
+    timer = request_timer()
     try:
         input_data = request.get_json()
+        timer.mark('parse')
         if not input_data:
             app.logger.warning("Dữ liệu đầu vào rỗng hoặc không phải JSON.")
             return jsonify({"error": "Dữ liệu đầu vào không hợp lệ."}), 400
         
-        app.logger.info(f"Dữ liệu đầu vào đã parse: {input_data}")
-
         profile_info_from_request = input_data.get('profile')
         ybc_data_from_request = input_data.get('YBC')
 
@@ -80,43 +420,134 @@ def handle_calculate_tube():
             app.logger.warning("Thiếu hoặc sai định dạng 'YBC' trong request.") # Thêm log
             return jsonify({"error": "Thiếu hoặc sai định dạng 'YBC'."}), 400
 
-        data_for_centerline_calc = {'YBC': ybc_data_from_request}
-        if profile_info_from_request.get('type') == 'round':
-            dimensions = profile_info_from_request.get('dimensions', {})
-            if 'diameter' in dimensions:
-                data_for_centerline_calc['Diameter'] = dimensions['diameter']
-        
-        # Kiểm tra hàm tính toán
-        # Đảm bảo calculate_centerline_from_data không phải là hàm giả do lỗi import
-        if not callable(calculate_centerline_from_data) or \
-          (hasattr(calculate_centerline_from_data, '__name__') and calculate_centerline_from_data.__name__ == '<lambda>' and "Lỗi cấu hình server" in calculate_centerline_from_data({}).get("error","")):
-            app.logger.error("Hàm 'calculate_centerline_from_data' không khả dụng (có thể do lỗi import YBC3D_web.py).")
-            # Cung cấp thêm thông tin debug về import
-            module_path_check = "Không xác định"
-            try:
-                # __file__ là đường dẫn đến file index.py hiện tại
-                # os.path.dirname(__file__) là thư mục chứa index.py (tức là 'api')
-                module_path_check = os.path.abspath(os.path.join(os.path.dirname(__file__), "YBC3D_web.py"))
-                app.logger.error(f"Kiểm tra sự tồn tại của YBC3D_web.py tại: {module_path_check} - Tồn tại: {os.path.exists(module_path_check)}")
-            except Exception as path_e:
-                 app.logger.error(f"Lỗi khi kiểm tra đường dẫn YBC3D_web.py: {path_e}")
-            
-            return jsonify({"error": "Lỗi server: Chức năng tính toán không khả dụng (lỗi import nội bộ)."}), 500
-
-
-        result_json_string = calculate_centerline_from_data(data_for_centerline_calc)
-        result_data_from_calc = json.loads(result_json_string)
-        
-        # Kiểm tra lỗi trả về từ hàm calculate_centerline_from_data
-        if "error" in result_data_from_calc and result_data_from_calc["error"]:
-             app.logger.warning(f"Lỗi từ hàm tính toán YBCR: {result_data_from_calc['error']}")
-             return jsonify(result_data_from_calc), 400 # Trả về lỗi do người dùng cung cấp dữ liệu sai
+        data_for_centerline_calc = build_centerline_input(profile_info_from_request, ybc_data_from_request, input_data)
+        timer.set_size('rows', len(ybc_data_from_request))
 
-        final_response_data = result_data_from_calc.copy()
-        final_response_data['profile'] = profile_info_from_request # Thêm thông tin biên dạng
+        binary_response = wants_binary_response()
+        # Độ chính xác của mảng điểm: '?precision=float64|float32|int16' (int16: lượng tử hóa theo hộp bao)
+        point_precision = request.args.get('precision', DEFAULT_BINARY_PRECISION if binary_response else DEFAULT_JSON_PRECISION)
+        if point_precision not in POINT_PRECISIONS:
+            return jsonify({"error": f"'precision' không hợp lệ (chỉ hỗ trợ {', '.join(POINT_PRECISIONS)})."}), 400
         
-        app.logger.info(f"Phản hồi cuối cùng: {final_response_data}")
-        return jsonify(final_response_data), 200
+        timer.mark('validate')
+
+        if wants_ndjson_response():
+            # Chương trình dài: tính và gửi từng phần, không giữ toàn bộ kết quả (không qua cache/ETag).
+            # Phần đầu được tính trước khi gửi để lỗi đầu vào vẫn trả về 400.
+            # Tùy chọn cần toàn bộ đường tâm không dùng được khi stream: trả 400 thay vì bỏ qua.
+            stream_precision = request.args.get('precision', DEFAULT_JSON_PRECISION)
+            if stream_precision not in NDJSON_PRECISIONS:
+                return jsonify({"error": f"'precision' {stream_precision} không hỗ trợ khi stream (chỉ {', '.join(NDJSON_PRECISIONS)})."}), 400
+            unsupported_options = [key for key in ('mesh', 'clearance') if input_data.get(key)]
+            if unsupported_options:
+                return jsonify({"error": f"Không hỗ trợ {', '.join(unsupported_options)} khi stream."}), 400
+            engine = load_engine()
+            if engine is None:
+                return engine_unavailable_response()
+            chunks = engine.iter_centerline_chunks(data_for_centerline_calc, STREAM_CHUNK_ROWS)
+            first_chunk = next(chunks)
+            timer.mark('compute')
+            if first_chunk.error:
+                app.logger.warning(f"Lỗi từ hàm tính toán YBCR: {first_chunk.error}")
+                return jsonify(first_chunk.to_dict()), 400
+            app.logger.info("calculate_tube: rows=%d format=ndjson chunk_rows=%d first_chunk_ms=%.1f",
+                            len(ybc_data_from_request), STREAM_CHUNK_ROWS, (time.perf_counter() - request_started_at) * 1000.0)
+            round_points = engine.round_points if stream_precision == 'float32' else None
+            return Response(iter_ndjson_lines(first_chunk, chunks, round_points), mimetype=NDJSON_CONTENT_TYPE)
+
+        # ETag theo nội dung request và định dạng phản hồi: client đã có kết quả thì không cần tải lại.
+        # Chương trình đang chỉnh sửa ('program_id') có ETag riêng theo loại phản hồi: chỉ phản hồi toàn bộ ('-full')
+        # được xác thực bằng If-None-Match; phần đuôi mang thêm revision gốc và không bao giờ được trả 304.
+        program_id = input_data.get('program_id')
+        incremental_request = program_id is not None and program_store is not None
+        cache_key = canonical_request_key(data_for_centerline_calc, profile_info_from_request)
+        content_etag = f"{cache_key[:40]}-{'bin' if binary_response else 'json'}-{point_precision}"
+        etag = f"{content_etag}-full" if incremental_request else content_etag
+        timer.mark('cache_key')
+        if request.if_none_match.contains(etag):
+            not_modified_response = Response(status=304)
+            not_modified_response.set_etag(etag)
+            not_modified_response.vary.add('Accept')
+            app.logger.info("calculate_tube: rows=%d not_modified total_ms=%.1f",
+                            len(ybc_data_from_request), (time.perf_counter() - request_started_at) * 1000.0)
+            return not_modified_response
+
+        # Engine trả về mảng NumPy; kết quả chỉ được serialize một lần ở đây
+        engine = load_engine()
+        if engine is None:
+            return engine_unavailable_response()
+        calc_started_at = time.perf_counter()
+        program_revision = None
+        if incremental_request:
+            # Chương trình đang chỉnh sửa: chỉ tính lại và gửi phần đuôi kể từ dòng đầu tiên thay đổi
+            result, full_result, program_revision = compute_program_incremental(
+                str(program_id), input_data.get('base_revision'), data_for_centerline_calc, profile_info_from_request)
+            if result is not full_result:
+                # Phần đuôi chỉ đúng khi ghép vào revision gốc (đã khớp với server nên là hash hex, an toàn trong ETag)
+                etag = f"{content_etag}-tail-{input_data.get('base_revision')}"
+            cache_hit = False
+        else:
+            result, cache_hit = compute_centerline_cached(data_for_centerline_calc, cache_key)
+        calc_ms = (time.perf_counter() - calc_started_at) * 1000.0
+        timer.mark('compute')
+        timer.set_size('points', len(result.points))
+
+        # Kiểm tra lỗi trả về từ hàm tính toán
+        if result.error:
+             app.logger.warning(f"Lỗi từ hàm tính toán YBCR: {result.error}")
+             return jsonify(result.to_dict()), 400 # Trả về lỗi do người dùng cung cấp dữ liệu sai
+
+        if binary_response:
+            # Định dạng nhị phân: header + mảng điểm (N, 3) + bản ghi đoạn, xem YBC3D_binary.py.
+            # Client đã có thông tin 'profile' nên không gửi lại.
+            response = Response(engine.pack_centerline_binary(
+                result.points, result.segment_info,
+                result.final_point, result.final_direction, result.final_up_vector, result.diameter,
+                precision=point_precision, mesh=result.mesh,
+                frames=(result.normals, result.binormals()) if result.normals is not None else None
+            ), mimetype=BINARY_CONTENT_TYPE)
+            if result.clearance is not None:
+                # Định dạng nhị phân không có phần khe hở: chỉ gửi tóm tắt qua header
+                min_clearance = result.clearance['min_clearance']
+                response.headers['X-YBC-Min-Clearance'] = 'none' if min_clearance is None else f"{min_clearance:.6g}"
+                response.headers['X-YBC-Interferences'] = str(result.clearance['num_pairs'])
+        else:
+            final_response_data = result.to_dict(precision=point_precision)
+            final_response_data.pop('checkpoints', None) # Checkpoints chỉ dùng ở server
+            final_response_data['profile'] = profile_info_from_request # Thêm thông tin biên dạng
+            if program_revision is not None:
+                final_response_data.update({
+                    "program_id": program_id, "revision": program_revision, "step_offset": result.step_offset,
+                    "point_offset": result.point_offset, "segment_offset": result.segment_offset
+                })
+            response = jsonify(final_response_data)
+        if program_revision is not None:
+            # Client ghép: điểm [0, point_offset) và đoạn [0, segment_offset) của kết quả trước + phần đuôi này
+            response.headers['X-YBC-Revision'] = str(program_revision)
+            response.headers['X-YBC-Step-Offset'] = str(result.step_offset)
+            response.headers['X-YBC-Point-Offset'] = str(result.point_offset)
+            response.headers['X-YBC-Segment-Offset'] = str(result.segment_offset)
+            if result.suffix is not None:
+                # Tiếp theo là điểm (suffix_point_start, ...] và đoạn [suffix_segment_start, ...) của kết quả trước,
+                # sau phép dời hình (ma trận 4x4 theo hàng) và góc xoắn của pháp tuyến quanh tiếp tuyến
+                response.headers['X-YBC-Suffix-Point-Start'] = str(result.suffix['point_start'])
+                response.headers['X-YBC-Suffix-Segment-Start'] = str(result.suffix['segment_start'])
+                response.headers['X-YBC-Suffix-Transform'] = ','.join(
+                    repr(value) for value in engine.suffix_matrix(result.suffix).ravel().tolist())
+                response.headers['X-YBC-Suffix-Twist'] = repr(float(result.suffix['twist']))
+        response.vary.add('Accept')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache' # Luôn xác thực lại bằng If-None-Match
+        timer.mark('serialize')
+
+        # Chỉ ghi kích thước và thời gian, không ghi nội dung request/response
+        app.logger.info(
+            "calculate_tube: rows=%d resume_step=%d request_bytes=%s points=%d response_bytes=%d format=%s cache=%s calc_ms=%.1f total_ms=%.1f",
+            len(ybc_data_from_request), result.step_offset, request.content_length,
+            len(result.points), response.content_length or 0,
+            'binary' if binary_response else 'json', 'hit' if cache_hit else 'miss',
+            calc_ms, (time.perf_counter() - request_started_at) * 1000.0)
+        return response, 200
 
     except json.JSONDecodeError as jde:
         app.logger.error(f"Lỗi parse JSON từ request: {jde}", exc_info=True)
@@ -125,4 +556,180 @@ def handle_calculate_tube():
         app.logger.error(f"Lỗi server không xác định trong handle_calculate_tube: {e}", exc_info=True)
         return jsonify({"error": "Lỗi server không mong muốn."}), 500
 
+
+@app.route('/api/calculate_tube_batch', methods=['POST'])
+def handle_calculate_tube_batch():
+    """
+    Tính nhiều chương trình ống trong một request.
+    Body: {"jobs": [{"id": ..., "profile": {...}, "YBC": [...]}, ...], "max_workers": (tùy chọn)}
+    'id' (tùy chọn) là chuỗi hoặc số nguyên, duy nhất và cùng kiểu trong một batch.
+    Trả về: {"results": {id: kết quả hoặc {"error": ...}}, "succeeded": n, "failed": m},
+    cùng "results_by_index": {chỉ số: ...} cho các job không có 'id'.
+    """
+    timer = request_timer()
+    try:
+        input_data = request.get_json(silent=True)
+        timer.mark('parse')
+        if not input_data or not isinstance(input_data, dict):
+            app.logger.warning("Dữ liệu batch rỗng hoặc không phải JSON object.")
+            return jsonify({"error": "Dữ liệu đầu vào không hợp lệ."}), 400
+
+        jobs = input_data.get('jobs')
+        if not jobs or not isinstance(jobs, list):
+            return jsonify({"error": "Thiếu hoặc sai định dạng 'jobs'."}), 400
+        if len(jobs) > BATCH_MAX_JOBS:
+            return jsonify({"error": f"Quá nhiều job trong một batch (tối đa {BATCH_MAX_JOBS})."}), 400
+
+        # Số luồng do client yêu cầu bị chặn bởi giới hạn của server (xem BATCH_MAX_WORKERS: luồng không tăng tốc phần tính toán)
+        max_workers = BATCH_MAX_WORKERS
+        requested_workers = input_data.get('max_workers')
+        if requested_workers is not None:
+            if not isinstance(requested_workers, int) or isinstance(requested_workers, bool) or requested_workers < 1:
+                return jsonify({"error": "'max_workers' phải là số nguyên dương."}), 400
+            max_workers = min(requested_workers, BATCH_MAX_WORKERS)
+
+        # Chỉ so sánh các id do client gửi, giữ nguyên kiểu: 1 và "1" cùng thành khóa "1" trong JSON nên không được trộn kiểu.
+        # Job thiếu id (hoặc không phải object) được báo theo chỉ số trong 'results_by_index', không chiếm khóa của 'results'.
+        explicit_ids = [job['id'] for job in jobs if isinstance(job, dict) and 'id' in job]
+        if any(isinstance(job_id, bool) or not isinstance(job_id, (str, int)) for job_id in explicit_ids):
+            return jsonify({"error": "Các 'id' trong 'jobs' phải là chuỗi hoặc số nguyên."}), 400
+        if len({type(job_id) for job_id in explicit_ids}) > 1:
+            return jsonify({"error": "Các 'id' trong 'jobs' phải cùng kiểu (chuỗi hoặc số nguyên)."}), 400
+        if len(set(explicit_ids)) != len(explicit_ids):
+            return jsonify({"error": "Các 'id' trong 'jobs' phải là duy nhất."}), 400
+
+        timer.mark('validate')
+        timer.set_size('jobs', len(jobs))
+
+        from concurrent.futures import ThreadPoolExecutor # Chỉ endpoint batch cần, import khi dùng
+        app.logger.info(f"Batch: {len(jobs)} job, {max_workers} luồng")
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            job_results = list(executor.map(compute_batch_job, jobs))
+        timer.mark('compute')
+
+        results, results_by_index = {}, {}
+        for index, (job, job_result) in enumerate(zip(jobs, job_results)):
+            if isinstance(job, dict) and 'id' in job:
+                results[str(job['id'])] = job_result
+            else:
+                results_by_index[str(index)] = job_result
+        failed = sum(1 for r in job_results if r.get("error"))
+        response_data = {"results": results, "succeeded": len(job_results) - failed, "failed": failed}
+        if results_by_index:
+            response_data["results_by_index"] = results_by_index
+        response = jsonify(response_data)
+        timer.mark('serialize')
+        return response, 200
+
+    except Exception as e:
+        app.logger.error(f"Lỗi server không xác định trong handle_calculate_tube_batch: {e}", exc_info=True)
+        return jsonify({"error": "Lỗi server không mong muốn."}), 500
+
+@app.route('/api/fit_ybc', methods=['POST'])
+def handle_fit_ybc():
+    """
+    Chế độ ngược: khớp chương trình YBC từ đường tâm đo được.
+    Body: {"points": [[x, y, z], ...], "Tolerance", "MaxResidual" (mm, tùy chọn; mặc định theo nhiễu ước lượng),
+           "MinRadius" (mm, tùy chọn: bán kính uốn nhỏ nhất có thể, ví dụ theo đường kính ống)}
+    Trả về: {"YBC": [...], "converged", "pose": {"origin", "rotation"}, "tolerance",
+             "residuals": {"max", "max_allowed", "rms", "end_point", "rows"}}
+    Khi sai số lớn nhất vượt MaxResidual hoặc bán kính khớp nhỏ hơn MinRadius (hay nửa khoảng cách lấy mẫu):
+    400 với "error", "converged": false và chương trình, sai số để chẩn đoán. Quá FIT_MAX_POINTS điểm: 400.
+    """
+    timer = request_timer()
+    try:
+        input_data = request.get_json(silent=True)
+        timer.mark('parse')
+        if not input_data or not isinstance(input_data, dict):
+            return jsonify({"error": "Dữ liệu đầu vào không hợp lệ."}), 400
+        points = input_data.get('points')
+        if not points or not isinstance(points, list):
+            return jsonify({"error": "Thiếu hoặc sai định dạng 'points'."}), 400
+        if len(points) > FIT_MAX_POINTS:
+            return jsonify({"error": f"Quá nhiều điểm trong 'points' (tối đa {FIT_MAX_POINTS})."}), 400
+        fit_options = {}
+        for request_key, argument_name in FIT_OPTION_KEYS.items():
+            value = input_data.get(request_key)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0:
+                return jsonify({"error": f"'{request_key}' phải là số dương."}), 400
+            fit_options[argument_name] = float(value)
+        timer.mark('validate')
+        timer.set_size('points', len(points))
+
+        inverse_engine = load_inverse_engine()
+        if inverse_engine is None:
+            return engine_unavailable_response()
+        fit_result = inverse_engine.fit_ybc_program(points, **fit_options)
+        timer.mark('compute')
+        if fit_result.error:
+            app.logger.warning(f"Lỗi khi khớp chương trình YBC: {fit_result.error}")
+            return jsonify(fit_result.to_dict()), 400
+        timer.set_size('rows', len(fit_result.ybc))
+        response = jsonify(fit_result.to_dict())
+        timer.mark('serialize')
+        return response, 200
+
+    except Exception as e:
+        app.logger.error(f"Lỗi server không xác định trong handle_fit_ybc: {e}", exc_info=True)
+        return jsonify({"error": "Lỗi server không mong muốn."}), 500
+
+def warm_up():
+    """
+    Import engine và chạy một phép tính nhỏ để lần gọi đầu tiên của người dùng không phải trả chi phí khởi động.
+    Trả về thời gian (ms) hoặc None nếu engine không khả dụng.
+    """
+    started_at = time.perf_counter()
+    engine = load_engine()
+    if engine is None:
+        return None
+    result = engine.compute_centerline({"YBC": [{"Y": 10.0, "B": 90.0, "C": 90.0, "Radius": 20.0}], "Frames": True})
+    engine.pack_centerline_binary(result.points, result.segment_info, result.final_point, result.final_direction,
+                                  result.final_up_vector, result.diameter)
+    return (time.perf_counter() - started_at) * 1000.0
+
+
+@app.route('/api/health', methods=['GET'])
+def handle_health():
+    """ Kiểm tra sống, không import engine """
+    return jsonify({"status": "ok", "engine_loaded": bool(_engine)}), 200
+
+
+@app.route('/api/warmup', methods=['GET', 'POST'])
+def handle_warmup():
+    """ Hook làm nóng cho instance được cấp sẵn (provisioned) hoặc cron ping sau khi triển khai """
+    warm_up_ms = warm_up()
+    if warm_up_ms is None:
+        return engine_unavailable_response()
+    return jsonify({"status": "ok", "warm_up_ms": round(warm_up_ms, 2)}), 200
+
+
+@app.route('/api/cache_stats', methods=['GET'])
+def handle_cache_stats():
+    """ Bộ đếm hit/miss và dung lượng của cache kết quả """
+    if result_cache is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(result_cache.stats(), enabled=True)), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def handle_metrics():
+    """ Histogram thời gian từng pha, kích thước request và bộ đếm cache theo định dạng Prometheus """
+    if metrics_registry is None:
+        return jsonify({"enabled": False}), 404
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        return jsonify({"error": "Cần header 'Authorization: Bearer <YBC_METRICS_TOKEN>'."}), 401
+    extra_gauges, extra_counters = {}, {}
+    if result_cache is not None:
+        for key, value in result_cache.stats().items():
+            if key in CACHE_COUNTER_KEYS:
+                extra_counters[f"ybc_cache_{key}_total"] = int(value)
+            else:
+                extra_gauges[f"ybc_cache_{key}"] = int(value)
+    return Response(metrics_registry.render_prometheus(extra_gauges, extra_counters), mimetype='text/plain; version=0.0.4')
+
+# Instance được cấp sẵn: YBC_WARMUP=1 làm nóng engine ngay khi module được nạp (đổi thời gian khởi động lấy request đầu nhanh)
+if os.environ.get('YBC_WARMUP', '').strip().lower() in ('1', 'true', 'yes', 'on'):
+    warm_up()
+
 # KHÔNG CẦN app.run() khi triển khai lên Vercel
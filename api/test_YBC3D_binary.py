@@ -0,0 +1,48 @@
+# Kiểm tra YBC3D_binary.py: đóng gói/giải mã với mọi độ chính xác và từ chối phiên bản/bố cục không hỗ trợ.
+#   python -m pytest api/test_YBC3D_binary.py
+
+import struct
+
+import numpy as np
+import pytest
+
+from YBC3D_binary import pack_centerline_binary, unpack_centerline_binary
+from YBC3D_web import compute_centerline
+
+PROGRAM = [{"Y": 100.0, "B": 90.0, "C": 30.0, "Radius": 50.0}, {"Y": 80.0, "B": 0.0, "C": 0.0, "Radius": 0.0}]
+
+
+def packed(precision):
+    result = compute_centerline({"YBC": PROGRAM})
+    return result, pack_centerline_binary(result.points, result.segment_info, result.final_point, result.final_direction,
+                                          result.final_up_vector, result.diameter, precision=precision)
+
+
+def with_header_byte(buffer, offset, fmt, value):
+    patched = bytearray(buffer)
+    struct.pack_into(fmt, patched, offset, value)
+    return bytes(patched)
+
+
+@pytest.mark.parametrize("precision, version", [("float64", 1), ("float32", 1), ("int16", 2)])
+def test_round_trip_and_version(precision, version):
+    result, buffer = packed(precision)
+    assert struct.unpack_from('<H', buffer, 4)[0] == version
+    unpacked = unpack_centerline_binary(buffer)
+    tolerance = np.abs(result.points).max() * (1e-12 if precision == 'float64' else 1e-4)
+    np.testing.assert_allclose(unpacked["centerline_points"], result.points, atol=tolerance)
+    assert [segment["end_idx"] for segment in unpacked["segment_info"]] == [segment["end_idx"] for segment in result.segment_info]
+
+
+def test_int16_layout_rejected_as_version_1():
+    # Phiên bản 1 không có khối lượng tử hóa: đọc điểm từ byte 96 sẽ sai
+    _, buffer = packed('int16')
+    with pytest.raises(ValueError):
+        unpack_centerline_binary(with_header_byte(buffer, 4, '<H', 1))
+
+
+@pytest.mark.parametrize("offset, fmt, value", [(4, '<H', 3), (6, '<B', 3), (6, '<B', 16)])
+def test_unknown_version_or_component_size_rejected(offset, fmt, value):
+    _, buffer = packed('float32')
+    with pytest.raises(ValueError):
+        unpack_centerline_binary(with_header_byte(buffer, offset, fmt, value))
@@ -0,0 +1,78 @@
+# Kiểm tra tầng đĩa của YBC3D_cache.py: kết quả đọc lại bằng kết quả đã ghi và file lạ (pickle) không được nạp;
+# LRU trong bộ nhớ và ProgramStore giới hạn theo số byte.
+#   python -m pytest api/test_YBC3D_cache.py
+
+import os
+import pickle
+
+import numpy as np
+
+import index
+from YBC3D_cache import estimate_result_bytes, ProgramStore, PROGRAM_ROW_BYTES, ResultCache
+from YBC3D_web import compute_centerline
+
+PROFILE = {"type": "round", "dimensions": {"diameter": 25.0}}
+PROGRAM = [{"Y": 100.0, "B": 90.0, "C": 30.0, "Radius": 50.0}, {"Y": 80.0, "B": 180.0, "C": 90.0, "Radius": 30.0},
+           {"Y": 60.0, "B": 0.0, "C": 0.0, "Radius": 0.0}]
+
+
+class WritesMarker:
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return (open, (self.path, 'w'))
+
+
+def test_disk_round_trip_with_all_options(tmp_path):
+    options = {"trace": True, "frames": True, "mesh": True, "clearance": True, "DecimateTolerance": 0.5}
+    result = compute_centerline(dict(index.build_centerline_input(PROFILE, PROGRAM, options), Checkpoints=True))
+    ResultCache(1 << 20, str(tmp_path)).put("k", result)
+
+    loaded = ResultCache(1 << 20, str(tmp_path)).get("k") # Cache mới: buộc đọc từ đĩa
+    np.testing.assert_array_equal(loaded.points, result.points)
+    np.testing.assert_array_equal(loaded.mesh.vertices, result.mesh.vertices)
+    np.testing.assert_array_equal(loaded.checkpoints["num_points"], result.checkpoints["num_points"])
+    np.testing.assert_array_equal(loaded.undecimated["points"], result.undecimated["points"])
+    assert loaded.mesh.ring_vertices == result.mesh.ring_vertices
+    assert loaded.segment_info == result.segment_info
+    assert loaded.trace == result.trace
+    assert loaded.clearance == result.clearance
+
+
+def test_planted_pickle_is_not_loaded(tmp_path):
+    marker = tmp_path / "marker"
+    cache = ResultCache(1 << 20, str(tmp_path))
+    with open(cache._disk_path("k"), 'wb') as planted:
+        pickle.dump(WritesMarker(str(marker)), planted)
+    np.savez(cache._disk_path("o"), meta=np.array([WritesMarker(str(marker))], dtype=object))
+
+    assert cache.get("k") is None and cache.get("o") is None
+    assert not marker.exists()
+    assert not os.path.exists(cache._disk_path("k")) # File hỏng bị xóa
+
+
+def test_result_cache_counts_evictions():
+    result = compute_centerline({"YBC": PROGRAM})
+    cache = ResultCache(2 * estimate_result_bytes(result))
+    for key in ("a", "b", "c", "d"):
+        cache.put(key, result)
+    stats = cache.stats()
+    assert stats["evictions"] == 2 and stats["entries"] == 2
+    assert cache.get("a") is None and cache.get("d") is not None
+
+
+def test_program_store_evicts_by_bytes():
+    result = compute_centerline({"YBC": PROGRAM, "Checkpoints": True})
+    entry_bytes = estimate_result_bytes(result) + PROGRAM_ROW_BYTES * len(PROGRAM)
+    store = ProgramStore(2 * entry_bytes)
+    for program_id in ("a", "b"):
+        store.put(program_id, "r", "o", PROGRAM, result)
+    store.get("a") # "a" mới dùng gần đây: "b" bị loại khi thêm "c"
+    store.put("c", "r", "o", PROGRAM, result)
+    assert store.get("a") and store.get("c") and store.get("b") is None
+
+    # Chương trình lớn hơn toàn bộ budget: không giữ, và trạng thái cũ của nó cũng bị bỏ
+    long_program = PROGRAM * 50
+    store.put("a", "r", "o", long_program, compute_centerline({"YBC": long_program, "Checkpoints": True}))
+    assert store.get("a") is None and store.get("c")
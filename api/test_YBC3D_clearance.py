@@ -0,0 +1,127 @@
+# Kiểm tra YBC3D_clearance.py: so sánh với quét vét cạn các cặp điểm lấy mẫu dày và giới hạn kích thước.
+#   python -m pytest api/test_YBC3D_clearance.py
+
+import random
+
+import numpy as np
+import pytest
+
+import YBC3D_clearance
+from YBC3D_clearance import analyze_clearance, EXCLUSION_SLOPE_TOLERANCE, NEIGHBOR_ARC_FACTOR, SEARCH_RADIUS_FACTOR
+from YBC3D_web import compute_centerline
+
+DIAMETER = 25.0
+BRUTE_FORCE_SPACING = 0.25 # Sai số khoảng cách của quét vét cạn <= bước lấy mẫu
+
+
+def random_program(seed, num_rows=15):
+    rng = random.Random(seed)
+    return [{"Y": rng.uniform(5.0, 80.0), "B": rng.choice([45.0, 90.0, 135.0]),
+             "C": rng.choice([0.0, 90.0, -90.0, 180.0]), "Radius": rng.choice([20.0, 30.0])} for _ in range(num_rows)]
+
+
+PROGRAMS = {
+    "coil": [{"Y": 10.0, "B": 90.0, "C": 4.0, "Radius": 30.0}] * 10, # Các vòng chồng lên nhau: nhiều va chạm
+    "hairpin": [{"Y": 100.0, "B": 180.0, "C": 0.0, "Radius": 12.5}, {"Y": 100.0, "B": 0.0, "C": 0.0, "Radius": 0.0}],
+    "random": random_program(5),
+}
+
+
+def brute_force_clearance(points, segment_info, diameter, spacing=BRUTE_FORCE_SPACING):
+    """
+    (min_distance, {cặp đoạn va chạm: khoảng cách nhỏ nhất}) bằng cách so sánh mọi cặp điểm lấy mẫu với bước spacing,
+    lấy cực tiểu theo từng cặp cạnh
+    """
+    edges = np.diff(points, axis=0)
+    edge_lengths = np.linalg.norm(edges, axis=1)
+    subdivisions = np.maximum(1, np.ceil(edge_lengths / spacing)).astype(int)
+    edge_of_sample = np.repeat(np.arange(len(edges)), subdivisions)
+    fractions = (np.arange(subdivisions.sum()) - np.repeat(np.cumsum(subdivisions) - subdivisions, subdivisions)) / subdivisions[edge_of_sample]
+    samples = points[edge_of_sample] + fractions[:, np.newaxis] * edges[edge_of_sample]
+    arc_length = np.concatenate(([0.0], np.cumsum(edge_lengths)))[edge_of_sample] + fractions * edge_lengths[edge_of_sample]
+    tangents = (edges / np.maximum(edge_lengths, 1e-300)[:, np.newaxis])[edge_of_sample]
+    segment_of_edge = YBC3D_clearance.segment_of_edges(segment_info, len(edges))
+
+    neighbor_arc = NEIGHBOR_ARC_FACTOR * diameter
+    search_radius = SEARCH_RADIUS_FACTOR * diameter
+    candidates = []
+    for block_start in range(0, len(samples), 2000):
+        block = np.arange(block_start, min(block_start + 2000, len(samples)))
+        distances = np.linalg.norm(samples[block, np.newaxis] - samples[np.newaxis], axis=2)
+        gaps = arc_length[np.newaxis] - arc_length[block, np.newaxis]
+        i, j = np.nonzero((gaps > neighbor_arc) & (distances < search_radius)) # i đứng trước j dọc ống
+        candidates.append((block[i], j, distances[i, j]))
+    first, second, distances = (np.concatenate(parts) for parts in zip(*candidates))
+
+    # Như analyze_clearance: cực tiểu của mỗi cặp cạnh nằm sát biên loại trừ lân cận mà khoảng cách còn giảm khi hai điểm
+    # tiến lại gần nhau dọc ống chỉ là phần kề nhau của ống
+    order = np.lexsort((distances, edge_of_sample[second], edge_of_sample[first]))
+    first, second, distances = first[order], second[order], distances[order]
+    edge_pairs = np.stack((edge_of_sample[first], edge_of_sample[second]), axis=1)
+    minimum_of_pair = np.ones(len(order), dtype=bool)
+    minimum_of_pair[1:] = np.any(edge_pairs[1:] != edge_pairs[:-1], axis=1)
+    first, second, distances = first[minimum_of_pair], second[minimum_of_pair], distances[minimum_of_pair]
+    differences = samples[first] - samples[second]
+    threshold = -EXCLUSION_SLOPE_TOLERANCE * distances
+    approaching = (np.einsum('ij,ij->i', differences, tangents[first]) < threshold) | \
+        (np.einsum('ij,ij->i', differences, tangents[second]) < threshold)
+    near_boundary = arc_length[second] - arc_length[first] <= neighbor_arc + 2.0 * spacing
+    genuine = ~(approaching & near_boundary)
+    first, second, distances = first[genuine], second[genuine], distances[genuine]
+
+    min_distance = distances.min() if len(distances) else np.inf
+    interfering = {}
+    for i, j, distance in zip(first, second, distances):
+        if distance < diameter:
+            key = tuple(sorted((int(segment_of_edge[edge_of_sample[i]]), int(segment_of_edge[edge_of_sample[j]]))))
+            interfering[key] = min(interfering.get(key, np.inf), distance)
+    return (min_distance if min_distance < SEARCH_RADIUS_FACTOR * diameter else None), interfering
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_matches_brute_force(name):
+    result = compute_centerline({"Diameter": DIAMETER, "YBC": PROGRAMS[name]})
+    report = analyze_clearance(result.points, result.segment_info, DIAMETER, max_reported_pairs=10000)
+    expected_min, expected_pairs = brute_force_clearance(result.points, result.segment_info, DIAMETER)
+
+    assert expected_min is not None and report["min_distance"] is not None
+    # Khoảng cách chính xác trên đường gấp khúc <= khoảng cách giữa các mẫu, và lệch không quá bước lấy mẫu
+    assert expected_min - BRUTE_FORCE_SPACING <= report["min_distance"] <= expected_min + 1e-9
+    reported = {(pair["segment_a"], pair["segment_b"]): pair["distance"] for pair in report["pairs"]}
+    assert report["num_pairs"] == len(reported)
+    # Cặp đoạn va chạm rõ ràng theo quét vét cạn phải được báo, và mọi cặp được báo đều gần như va chạm theo quét vét cạn
+    assert {key for key, distance in expected_pairs.items() if distance < DIAMETER - BRUTE_FORCE_SPACING} <= set(reported)
+    for key, distance in reported.items():
+        assert distance < DIAMETER
+        assert expected_pairs.get(key, np.inf) <= distance + BRUTE_FORCE_SPACING
+
+
+def test_interference_detected_in_coil():
+    result = compute_centerline({"Diameter": DIAMETER, "YBC": PROGRAMS["coil"]})
+    report = analyze_clearance(result.points, result.segment_info, DIAMETER)
+    assert report["interference"] and report["min_clearance"] < 0
+
+
+def test_long_straight_with_small_diameter_is_bounded():
+    # Trước đây mỗi cạnh được lấy mẫu với bước 0.25 * diameter: 4 triệu mẫu cho 1 km với D = 1.
+    # Ống thẳng không tự tiếp cận: không có cặp nào (kể cả ở khoảng cách loại trừ lân cận)
+    points = np.array([[0.0, 0.0, 0.0], [1.0e6, 0.0, 0.0]])
+    report = analyze_clearance(points, [{"type": "Y", "start_idx": 0, "end_idx": 1}], 1.0)
+    assert report["min_distance"] is None and report["min_clearance"] is None
+    assert not report["interference"]
+
+    straight = compute_centerline({"Diameter": DIAMETER, "Clearance": True,
+                                   "YBC": [{"Y": 30.0, "B": 0.0, "C": 0.0, "Radius": 0.0}] * 20})
+    assert straight.clearance["min_distance"] is None
+
+    result = compute_centerline({"Diameter": 0.01, "Clearance": True,
+                                 "YBC": [{"Y": 10000.0, "B": 90.0, "C": 90.0, "Radius": 50.0}] * 10})
+    assert not result.error
+    assert not result.clearance["interference"]
+
+
+def test_candidate_pair_guard_reports_error(monkeypatch):
+    monkeypatch.setattr(YBC3D_clearance, "MAX_CANDIDATE_PAIRS", 10)
+    result = compute_centerline({"Diameter": DIAMETER, "YBC": PROGRAMS["coil"], "Clearance": True})
+    assert result.error.startswith("Dữ liệu không hợp lệ")
+    assert len(result.points) == 0
@@ -0,0 +1,193 @@
+# Kiểm tra YBC3D_inverse.py: khớp lại chương trình từ đường tâm của engine, lấy mẫu lại đều và có nhiễu.
+#   python -m pytest api/test_YBC3D_inverse.py
+
+import random
+import time
+
+import numpy as np
+import pytest
+
+from YBC3D_inverse import (assign_pieces, chain_model, fit_ybc_program, initial_program, normal_equations,
+                           segment_primitives, POSE_PARAMETERS)
+from YBC3D_web import compute_centerline
+
+DENSE_ARC_POINTS = 720 # Đường tâm "thật" trước khi lấy mẫu lại
+MAX_FIT_SECONDS = 20.0 # Thời gian khớp tối đa với hơn 100 000 điểm (rộng cho máy CI chậm; thường vài giây)
+
+
+def random_program(seed, num_rows=12, tail=True):
+    rng = random.Random(seed)
+    rows = [{"Y": rng.uniform(10.0, 100.0), "B": rng.uniform(15.0, 150.0), "C": rng.uniform(-180.0, 180.0),
+             "Radius": rng.uniform(20.0, 80.0)} for _ in range(num_rows)]
+    tail_row = {"Y": rng.uniform(10.0, 100.0), "B": 0.0, "C": 0.0, "Radius": 0.0}
+    return rows + [tail_row] if tail else rows
+
+
+def resample(points, step):
+    """ Lấy mẫu lại đường gấp khúc với khoảng cách đều step theo độ dài cung: điểm đo không trùng điểm tiếp tuyến """
+    arc_length = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))))
+    samples = np.append(np.arange(0.0, arc_length[-1], step), arc_length[-1])
+    return np.column_stack([np.interp(samples, arc_length, points[:, axis]) for axis in range(3)])
+
+
+def measured(program, step, sigma, seed):
+    points = resample(compute_centerline({"YBC": program, "NumArcPoints": DENSE_ARC_POINTS}).points, step)
+    # Đặt vào một tư thế bất kỳ, như dữ liệu đo thật
+    rotation, _ = np.linalg.qr(np.random.default_rng(seed).normal(size=(3, 3)))
+    points = points @ rotation.T + np.array([120.0, -40.0, 300.0])
+    return points + np.random.default_rng(seed).normal(0.0, sigma, points.shape)
+
+
+def max_errors(program, fitted):
+    """ Sai lệch lớn nhất của Y, B, Radius và C (C của dòng uốn cuối không ảnh hưởng hình dạng) """
+    errors = {key: max(abs(row[key] - fit[key]) for row, fit in zip(program, fitted)) for key in ("Y", "B", "Radius")}
+    errors["C"] = max(abs((row["C"] - fit["C"] + 180.0) % 360.0 - 180.0) for row, fit in zip(program[:-2], fitted[:-2]))
+    return errors
+
+
+def test_round_trip_engine_points():
+    program = random_program(0)
+    result = fit_ybc_program(compute_centerline({"YBC": program}).points)
+    assert not result.error and result.converged
+    assert len(result.ybc) == len(program)
+    assert all(error < 1e-6 for error in max_errors(program, result.ybc).values())
+    assert result.point_residuals.max() < 1e-6
+
+
+@pytest.mark.parametrize("seed", [0, 1, 3])
+@pytest.mark.parametrize("step, sigma, limits", [
+    (2.0, 0.0, {"Y": 1e-2, "B": 1e-2, "Radius": 1e-2, "C": 1e-2}),
+    (5.0, 0.0, {"Y": 1e-2, "B": 1e-2, "Radius": 1e-2, "C": 1e-2}),
+    (1.0, 1e-4, {"Y": 1e-2, "B": 1e-2, "Radius": 5e-2, "C": 1e-2}),
+    (2.0, 0.01, {"Y": 0.5, "B": 0.2, "Radius": 1.5, "C": 0.2}),
+])
+def test_resampled_and_noisy(seed, step, sigma, limits):
+    program = random_program(seed)
+    result = fit_ybc_program(measured(program, step, sigma, seed))
+    assert not result.error and result.converged
+    assert len(result.ybc) == len(program)
+    errors = max_errors(program, result.ybc)
+    assert all(errors[key] < limits[key] for key in limits), errors
+    assert result.to_dict()["residuals"]["max"] <= result.max_residual
+
+
+@pytest.mark.parametrize("tail", [True, False])
+def test_long_program(tail):
+    # Hơn 2 * WINDOW_ROWS dòng uốn: khởi tạo theo cửa sổ rồi tinh chỉnh toàn cục
+    program = random_program(5, num_rows=120, tail=tail)
+    result = fit_ybc_program(measured(program, 2.0, 0.0, 5))
+    assert not result.error and result.converged
+    assert len(result.ybc) == len(program)
+    assert all(error < 1e-2 for error in max_errors(program, result.ybc).values())
+
+
+def test_short_arc_between_lines():
+    # Cung 9 mm lấy mẫu mỗi 2 mm: hai đầu cung nằm trong các đoạn thẳng kề, bán kính khớp từ góc giữa hai đường thẳng
+    program = [{"Y": 60.0, "B": 18.0, "C": 90.0, "Radius": 28.0}, {"Y": 50.0, "B": 90.0, "C": 0.0, "Radius": 40.0},
+               {"Y": 40.0, "B": 0.0, "C": 0.0, "Radius": 0.0}]
+    result = fit_ybc_program(measured(program, 2.0, 0.01, 7))
+    assert result.converged
+    assert len(result.ybc) == len(program)
+    assert max_errors(program, result.ybc)["Radius"] < 2.0
+
+
+def test_max_residual_exceeded_reports_not_converged():
+    points = measured(random_program(0), 2.0, 0.01, 0)
+    result = fit_ybc_program(points, max_residual=1e-4)
+    assert result.error and not result.converged
+    response = result.to_dict()
+    assert response["converged"] is False and response["YBC"]
+    assert response["residuals"]["max"] > response["residuals"]["max_allowed"] == 1e-4
+
+
+def test_sharp_corner_is_rejected():
+    # Góc vuông không có cung: không có điểm nào cách đỉnh góc nên không xác định được bán kính
+    along = np.arange(0.0, 100.0, 2.0)
+    points = np.vstack((np.column_stack((along, 0.0 * along, 0.0 * along)),
+                        np.column_stack((0.0 * along + 100.0, along, 0.0 * along))))
+    result = fit_ybc_program(points)
+    assert result.error and not result.ybc and not result.converged
+
+
+def arc_polyline(radius, sweep_deg, num_points):
+    angles = np.linspace(0.0, np.radians(sweep_deg), num_points)
+    return np.column_stack((radius * np.cos(angles), radius * np.sin(angles), 0.0 * angles))
+
+
+@pytest.mark.parametrize("points, expected", [
+    (compute_centerline({"YBC": [{"Y": 100.0, "B": 90.0, "C": 0.0, "Radius": 50.0}]}).points,
+     {"Y": 100.0, "B": 90.0, "Radius": 50.0}),
+    (arc_polyline(50.0, 90.0, 50), {"Y": 0.0, "B": 90.0, "Radius": 50.0}),
+    (arc_polyline(40.0, 180.0, 30), {"Y": 0.0, "B": 180.0, "Radius": 40.0}),
+])
+def test_program_ending_in_arc(points, expected):
+    # Không có đoạn thẳng cuối: cung cuối là một dòng, không vỡ thành nhiều dòng uốn bán kính ~0
+    result = fit_ybc_program(points)
+    assert not result.error and result.converged
+    assert len(result.ybc) == 1
+    assert all(abs(result.ybc[0][key] - value) < 1e-6 for key, value in expected.items()), result.ybc
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("step, sigma, limits", [
+    (None, 0.0, {"Y": 1e-6, "B": 1e-6, "Radius": 1e-6, "C": 1e-6}),
+    (2.0, 0.01, {"Y": 0.5, "B": 0.2, "Radius": 1.5, "C": 0.2}),
+])
+def test_random_program_without_trailing_straight(seed, step, sigma, limits):
+    program = random_program(seed, tail=False)
+    points = compute_centerline({"YBC": program}).points if step is None else measured(program, step, sigma, seed)
+    result = fit_ybc_program(points)
+    assert not result.error and result.converged
+    assert len(result.ybc) == len(program)
+    errors = max_errors(program, result.ybc)
+    assert all(errors[key] < limits[key] for key in limits), errors
+
+
+@pytest.mark.parametrize("radius", [0.2, 1.0])
+def test_radius_below_sample_spacing_is_not_converged(radius):
+    # Góc có bán kính nhỏ hơn nửa khoảng cách lấy mẫu 2 mm: dữ liệu không xác định được cung
+    program = [{"Y": 60.0, "B": 90.0, "C": 0.0, "Radius": radius}, {"Y": 60.0, "B": 0.0, "C": 0.0, "Radius": 0.0}]
+    result = fit_ybc_program(measured(program, 2.0, 0.0, 3))
+    assert result.error and not result.converged
+    assert result.to_dict()["converged"] is False and result.ybc
+
+
+def test_min_radius_rejects_tighter_bends():
+    points = measured(random_program(0), 2.0, 0.0, 0)
+    assert fit_ybc_program(points, min_radius=10.0).converged
+    result = fit_ybc_program(points, min_radius=40.0)
+    assert result.error and not result.converged
+
+
+@pytest.mark.parametrize("num_rows, num_arc_points", [(50, 2000), (3500, None)])
+def test_throughput_100k_points(num_rows, num_arc_points):
+    # Hơn 100 000 điểm: cung lấy mẫu rất dày, hoặc hàng nghìn dòng uốn
+    program = random_program(1, num_rows=num_rows)
+    points = compute_centerline({"YBC": program, "NumArcPoints": num_arc_points}).points
+    assert len(points) > 100000
+    started = time.perf_counter()
+    result = fit_ybc_program(points)
+    elapsed = time.perf_counter() - started
+    assert not result.error and result.converged
+    assert len(result.ybc) == len(program)
+    assert elapsed < MAX_FIT_SECONDS, elapsed
+
+
+@pytest.mark.parametrize("tail", [True, False])
+@pytest.mark.parametrize("fixed_pose", [False, True])
+def test_chain_solve_matches_dense_solve(tail, fixed_pose):
+    program = random_program(2, num_rows=6, tail=tail)
+    points = measured(program, 2.0, 0.01, 2)
+    fitted, pieces = initial_program(points, segment_primitives(points, 0.06))
+    model = chain_model(fitted)
+    pieces, _ = assign_pieces(points, pieces, model)
+    system, _ = normal_equations(points, pieces, fitted, model)
+    jtj, jtr = system.matrix()
+    damping = 1e-3
+    dense = jtj + damping * np.diag(system.diagonal)
+    expected = np.zeros(len(jtr))
+    free = slice(POSE_PARAMETERS if fixed_pose else 0, None)
+    expected[free] = np.linalg.solve(dense[free, free], -jtr[free])
+    np.testing.assert_allclose(system.gradient(), jtr, rtol=1e-9, atol=1e-9 * np.abs(jtr).max())
+    np.testing.assert_allclose(system.solve(damping, fixed_pose), expected, rtol=1e-7,
+                               atol=1e-9 * np.abs(expected).max())
@@ -0,0 +1,67 @@
+# Kiểm tra YBC3D_mesh.py: số tam giác, vòng đỉnh dùng chung ở điểm nối giữa các đoạn và pháp tuyến hướng ra ngoài.
+#   python -m pytest api/test_YBC3D_mesh.py
+
+import numpy as np
+import pytest
+
+from YBC3D_web import compute_centerline
+
+PROGRAM = [{"Y": 60.0, "B": 90.0, "C": 30.0, "Radius": 50.0}, {"Y": 40.0, "B": 120.0, "C": -90.0, "Radius": 60.0},
+           {"Y": 50.0, "B": 0.0, "C": 0.0, "Radius": 0.0}]
+PROFILES = [
+    ({"type": "round", "dimensions": {"diameter": 20.0}}, 16, 16),
+    ({"type": "square", "dimensions": {"side": 15.0}}, 8, 4),
+    ({"type": "rectangle", "dimensions": {"width": 20.0, "height": 10.0}}, 8, 4),
+]
+
+
+def mesh_result(profile, **options):
+    result = compute_centerline(dict(options, YBC=PROGRAM, MeshProfile=profile))
+    assert not result.error
+    return result
+
+
+@pytest.mark.parametrize("profile, ring_vertices, ring_edges", PROFILES)
+def test_triangle_and_vertex_counts(profile, ring_vertices, ring_edges):
+    result = mesh_result(profile)
+    mesh, num_points = result.mesh, len(result.points)
+    assert (mesh.ring_vertices, mesh.ring_edges) == (ring_vertices, ring_edges)
+    assert mesh.vertices.shape == mesh.normals.shape == (num_points * ring_vertices, 3)
+    # Mỗi dải giữa hai điểm liên tiếp có 2 tam giác cho mỗi cạnh của mặt cắt
+    assert mesh.indices.shape == ((num_points - 1) * ring_edges * 6,)
+    assert mesh.indices.max() == mesh.vertices.shape[0] - 1
+
+
+def test_radial_segments_option():
+    mesh = mesh_result(PROFILES[0][0], MeshRadialSegments=6).mesh
+    assert (mesh.ring_vertices, mesh.ring_edges) == (6, 6)
+
+
+@pytest.mark.parametrize("profile, ring_vertices, ring_edges", PROFILES)
+def test_segments_share_seam_vertices(profile, ring_vertices, ring_edges):
+    result = mesh_result(profile)
+    mesh = result.mesh
+    indices = mesh.indices.reshape(-1, 6 * ring_edges) # Một hàng cho mỗi dải giữa hai điểm liên tiếp
+    for segment, next_segment in zip(result.segment_info, result.segment_info[1:]):
+        seam = segment['end_idx']
+        assert next_segment['start_idx'] == seam
+        seam_ring = set(range(seam * ring_vertices, (seam + 1) * ring_vertices))
+        # Dải cuối của đoạn và dải đầu của đoạn sau cùng dùng vòng đỉnh ở điểm nối, không nhân bản đỉnh
+        assert set(indices[seam - 1]) & set(indices[seam]) == seam_ring
+        assert seam_ring <= set(indices[seam - 1]) and seam_ring <= set(indices[seam])
+
+
+@pytest.mark.parametrize("profile, ring_vertices, ring_edges", PROFILES)
+def test_normals_and_winding_point_outward(profile, ring_vertices, ring_edges):
+    result = mesh_result(profile)
+    mesh = result.mesh
+    vertices, normals = mesh.vertices.astype(float), mesh.normals.astype(float)
+    centers = np.repeat(result.points, ring_vertices, axis=0)
+    np.testing.assert_allclose(np.linalg.norm(normals, axis=1), 1.0, atol=1e-6)
+    assert np.all(np.einsum('ij,ij->i', normals, vertices - centers) > 0.0)
+
+    # Tam giác theo chiều ngược kim đồng hồ nhìn từ ngoài: pháp tuyến mặt hướng ra xa đường tâm
+    triangles = vertices[mesh.indices.reshape(-1, 3)]
+    face_normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    triangle_centers = centers[mesh.indices.reshape(-1, 3)].mean(axis=1)
+    assert np.all(np.einsum('ij,ij->i', face_normals, triangles.mean(axis=1) - triangle_centers) > 0.0)
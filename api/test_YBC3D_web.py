@@ -0,0 +1,185 @@
+# Kiểm tra YBC3D_web.py: đường tâm vector hóa bằng vòng lặp từng điểm với rotate_vector; khung tối thiểu xoay;
+# hàm JSON tương thích calculate_centerline_from_data;
+# số điểm của chia lưới thích ứng với bán kính rất lớn và dung sai rất nhỏ;
+# giới hạn cứng về số điểm mỗi cung và tổng số điểm đường tâm.
+#   python -m pytest api/test_YBC3D_web.py
+
+import json
+import math
+import random
+
+import numpy as np
+import pytest
+
+import YBC3D_web
+from YBC3D_web import (adaptive_arc_point_count, calculate_centerline_from_data, compute_centerline, rotate_vector,
+                       DEFAULT_MAX_ARC_POINTS)
+
+
+def reference_centerline(program, num_arc_points):
+    """ Đường tâm tính từng điểm một bằng rotate_vector, như vòng lặp trước khi vector hóa """
+    point, direction, up = np.zeros(3), np.array([1.0, 0.0, 0.0]), np.array([0.0, 0.0, 1.0])
+    points = [point]
+    for row in program:
+        if abs(row["Y"]) > 1e-9:
+            point = point + row["Y"] * direction
+            points.append(point)
+        if abs(row["B"]) > 1e-6 and row["Radius"] >= 1e-9:
+            b_rad = math.radians(row["B"])
+            perp = np.cross(up, direction)
+            center = point + row["Radius"] * perp / np.linalg.norm(perp)
+            for j in range(1, num_arc_points + 1):
+                points.append(center + rotate_vector(point - center, up, b_rad * (j / float(num_arc_points))))
+            point = points[-1]
+            direction = rotate_vector(direction, up, b_rad)
+            direction = direction / np.linalg.norm(direction)
+        if abs(row["C"]) > 1e-6:
+            rotated_up = rotate_vector(up, direction, math.radians(row["C"]))
+            rotated_up = rotated_up - np.dot(rotated_up, direction) * direction
+            up = rotated_up / np.linalg.norm(rotated_up)
+    return np.array(points)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("num_arc_points", [1, 7, 30])
+def test_vectorized_matches_per_point_reference(seed, num_arc_points):
+    rng = random.Random(seed)
+    # Có cả Y = 0, B = 0, C = 0 và Radius = 0 để đi qua mọi nhánh bỏ qua
+    program = [{"Y": rng.choice([0.0, rng.uniform(1.0, 100.0)]), "B": rng.choice([0.0, rng.uniform(-180.0, 180.0)]),
+                "C": rng.choice([0.0, rng.uniform(-180.0, 180.0)]), "Radius": rng.choice([0.0, rng.uniform(5.0, 80.0)])}
+               for _ in range(rng.randint(1, 25))]
+    result = compute_centerline({"YBC": program, "NumArcPoints": num_arc_points})
+    assert not result.error
+    expected = reference_centerline(program, num_arc_points)
+    assert result.points.shape == expected.shape
+    np.testing.assert_allclose(result.points, expected, rtol=0.0, atol=1e-9)
+
+
+FRAME_PROGRAM = [{"Y": 40.0, "B": 90.0, "C": 90.0, "Radius": 30.0}, {"Y": 25.0, "B": 60.0, "C": -135.0, "Radius": 50.0},
+                 {"Y": 0.0, "B": 45.0, "C": 180.0, "Radius": 40.0}, {"Y": 30.0, "B": 0.0, "C": 0.0, "Radius": 0.0}]
+
+
+def frames(**options):
+    result = compute_centerline(dict(options, YBC=FRAME_PROGRAM, Frames=True))
+    assert not result.error
+    return result
+
+
+def test_frames_are_orthonormal():
+    result = frames()
+    assert result.tangents.shape == result.normals.shape == result.points.shape
+    np.testing.assert_allclose(np.linalg.norm(result.tangents, axis=1), 1.0, atol=1e-12)
+    np.testing.assert_allclose(np.linalg.norm(result.normals, axis=1), 1.0, atol=1e-12)
+    np.testing.assert_allclose(np.einsum('ij,ij->i', result.tangents, result.normals), 0.0, atol=1e-12)
+
+
+@pytest.mark.parametrize("options", [{}, {"ArcTolerance": 0.01}])
+def test_consecutive_frames_have_minimal_twist(options):
+    # Khung sau bằng khung trước quay theo phép quay nhỏ nhất đưa tiếp tuyến trước về tiếp tuyến sau
+    result = frames(**options)
+    for i in range(len(result.points) - 1):
+        tangent, next_tangent = result.tangents[i], result.tangents[i + 1]
+        axis = np.cross(tangent, next_tangent)
+        angle = math.atan2(np.linalg.norm(axis), np.dot(tangent, next_tangent))
+        np.testing.assert_allclose(rotate_vector(result.normals[i], axis, angle), result.normals[i + 1], atol=1e-9)
+
+
+def test_frames_are_continuous_across_c_rotation():
+    # Xoay C chỉ đổi mặt phẳng uốn kế tiếp: pháp tuyến không nhảy ở điểm nối, chỉ quay từng bước nhỏ trên cung
+    result = frames()
+    step_angles = np.arccos(np.clip(np.einsum('ij,ij->i', result.normals[:-1], result.normals[1:]), -1.0, 1.0))
+    max_arc_step = max(math.radians(row["B"]) / 30.0 for row in FRAME_PROGRAM)
+    assert step_angles.max() <= max_arc_step + 1e-9
+    for segment in result.segment_info:
+        if segment['type'] == 'Y':
+            # Đoạn thẳng ngay sau xoay C: khung giữ nguyên
+            np.testing.assert_allclose(result.normals[segment['start_idx']], result.normals[segment['end_idx']], atol=1e-12)
+            np.testing.assert_allclose(result.tangents[segment['start_idx']], result.tangents[segment['end_idx']], atol=1e-12)
+
+
+@pytest.mark.parametrize("data", [
+    {"YBC": FRAME_PROGRAM, "Diameter": 25.4},
+    {"YBC": FRAME_PROGRAM, "NumArcPoints": 5, "Trace": True, "Checkpoints": True},
+    {"YBC": FRAME_PROGRAM, "ArcTolerance": 0.05, "Frames": True},
+    {"YBC": []},
+])
+def test_json_wrapper_matches_compute_centerline(data):
+    assert calculate_centerline_from_data(data) == json.dumps(compute_centerline(data).to_dict(), separators=(',', ':'))
+
+
+@pytest.mark.parametrize("data, diameter, message", [
+    ([{"Y": 1.0, "B": 0.0, "C": 0.0}], 30.0, "không phải dictionary"),
+    ({"Diameter": 22.0}, 22.0, "thiếu 'YBC'"),
+    ({"Diameter": 22.0, "YBC": [{"Y": 1.0, "B": 0.0}]}, 22.0, "Thiếu key 'C' (dòng 1)"),
+    ({"YBC": [{"Y": 1.0, "B": 0.0, "C": 0.0}, {"Y": "abc", "B": 0.0, "C": 0.0}]}, 30.0, "Giá trị không phải số (dòng 2)"),
+    ({"YBC": [{"Y": 1.0, "B": 90.0, "C": 0.0, "Radius": -5.0}]}, 30.0, "Radius không thể âm (dòng 1)"),
+])
+def test_json_wrapper_error_keeps_old_shape(data, diameter, message):
+    # Cùng cấu trúc với error_response_template của phiên bản trả về chuỗi JSON trực tiếp
+    response = json.loads(calculate_centerline_from_data(data))
+    assert message in response.pop("error")
+    assert response == {"centerline_points": [], "segment_info": [], "final_point": [0, 0, 0],
+                        "final_direction": [1, 0, 0], "diameter": diameter}
+
+
+@pytest.mark.parametrize("key", ["Trace", "Frames", "Checkpoints", "Clearance"])
+@pytest.mark.parametrize("value", ["false", "0", "", 2, [True]])
+def test_flag_option_rejects_non_boolean(key, value):
+    # Trước đây bool("false") bật tùy chọn
+    result = compute_centerline({"YBC": FRAME_PROGRAM, key: value})
+    assert result.error and f"'{key}'" in result.error
+
+
+@pytest.mark.parametrize("value, enabled", [(True, True), (1, True), (False, False), (0, False)])
+def test_flag_option_accepts_bool_and_zero_one(value, enabled):
+    result = compute_centerline({"YBC": FRAME_PROGRAM, "Trace": value})
+    assert not result.error and (result.trace is not None) == enabled
+
+
+def chord_deviation(radius, sweep_rad, num_points):
+    return radius * (1.0 - math.cos(sweep_rad / num_points / 2.0))
+
+
+@pytest.mark.parametrize("radius, tolerance", [(50.0, 0.1), (50.0, 1e-3), (1e6, 0.01), (20.0, 5.0)])
+def test_adaptive_count_meets_tolerance(radius, tolerance):
+    sweep_rad = math.radians(90.0)
+    count = adaptive_arc_point_count(sweep_rad, radius, tolerance, max_points=10000)
+    assert chord_deviation(radius, sweep_rad, count) <= tolerance * (1.0 + 1e-9)
+    assert count == 1 or chord_deviation(radius, sweep_rad, count - 1) > tolerance
+
+
+@pytest.mark.parametrize("radius, tolerance", [(1e17, 0.1), (1e300, 5e-324), (50.0, 1e-300)])
+def test_extreme_radius_or_tolerance_is_bounded(radius, tolerance):
+    # Trước đây 2 * acos(1 - tol / r) bị làm tròn về 0 và phép chia sau đó ném ZeroDivisionError
+    assert adaptive_arc_point_count(math.radians(30.0), radius, tolerance) == DEFAULT_MAX_ARC_POINTS
+
+
+def test_near_straight_arc_gets_one_segment():
+    assert adaptive_arc_point_count(1e-12, 50.0, 0.1, min_points=1) == 1
+    assert adaptive_arc_point_count(math.radians(30.0), 1e17, 1e18, min_points=1) == 1
+
+
+def test_huge_radius_request_computes():
+    result = compute_centerline({"YBC": [{"Y": 1.0, "B": 30.0, "C": 0.0, "Radius": 1e17}], "ArcTolerance": 0.1})
+    assert not result.error
+    assert len(result.points) == 2 + DEFAULT_MAX_ARC_POINTS
+    assert np.all(np.isfinite(result.points))
+
+
+@pytest.mark.parametrize("options", [{"NumArcPoints": 10001}, {"MaxArcPoints": 10001, "ArcTolerance": 0.1},
+                                     {"MinArcPoints": 10001, "MaxArcPoints": 20000, "ArcTolerance": 0.1}])
+def test_arc_points_over_limit_is_rejected(options):
+    result = compute_centerline(dict(options, YBC=[{"Y": 10.0, "B": 90.0, "C": 0.0, "Radius": 30.0}]))
+    assert result.error and "10000" in result.error
+    assert len(result.points) == 0
+
+
+def test_centerline_points_over_limit_is_rejected(monkeypatch):
+    monkeypatch.setattr(YBC3D_web, "CENTERLINE_POINTS_LIMIT", 100)
+    program = [{"Y": 10.0, "B": 90.0, "C": 0.0, "Radius": 30.0}] * 3
+    # Số điểm cố định: 1 + 3 * (1 + 32) = 100 điểm vẫn được tính, 34 điểm mỗi cung thì bị từ chối trước khi cấp phát
+    assert len(compute_centerline({"YBC": program, "NumArcPoints": 32}).points) == 100
+    assert "100" in compute_centerline({"YBC": program, "NumArcPoints": 34}).error
+    # Chia lưới thích ứng: mỗi cung cần 256 điểm, vượt giới hạn khi nới mảng ở cung đầu tiên
+    result = compute_centerline({"YBC": program, "ArcTolerance": 1e-4})
+    assert result.error and len(result.points) == 0
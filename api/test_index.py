@@ -0,0 +1,324 @@
+# Kiểm tra chỉnh sửa tăng dần trong index.py: kết quả ghép từ phần đuôi phải bằng kết quả tính toàn bộ;
+# và các route: batch, ETag/304, NDJSON, /api/metrics, giới hạn đầu vào.
+#   python -m pytest api/test_index.py
+
+import json
+import os
+import random
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import index
+from YBC3D_cache import ProgramStore, ResultCache
+from YBC3D_metrics import MetricsRegistry
+from YBC3D_web import compute_centerline
+
+PROFILE = {"type": "round", "dimensions": {"diameter": 25.0}}
+
+
+def random_program(seed, num_rows=40):
+    rng = random.Random(seed)
+    return [{"Y": rng.uniform(5.0, 80.0), "B": rng.choice([0.0, 45.0, 90.0, 135.0]),
+             "C": rng.choice([0.0, 90.0, -90.0, 180.0]), "Radius": rng.choice([20.0, 30.0])} for _ in range(num_rows)]
+
+
+def compute_edit(program_id, program, edited, options, profile=PROFILE):
+    """ (phần gửi đi, kết quả ghép) khi sửa program thành edited, và kết quả tính toàn bộ edited """
+    _, _, revision = index.compute_program_incremental(
+        program_id, None, index.build_centerline_input(profile, program, options), profile)
+    tail, merged, _ = index.compute_program_incremental(
+        program_id, revision, index.build_centerline_input(profile, edited, options), profile)
+    return tail, merged, compute_centerline(dict(index.build_centerline_input(profile, edited, options), Checkpoints=True))
+
+
+def edit_row(program, step, seed):
+    rng = random.Random(seed)
+    edited = [dict(row) for row in program]
+    edited[step] = dict(edited[step], Y=rng.uniform(5.0, 80.0), B=rng.choice([45.0, 90.0]), C=rng.choice([90.0, -90.0]))
+    return edited
+
+
+@pytest.mark.parametrize("step", [0, 17, 39])
+def test_incremental_clearance_matches_full_with_decimation(step):
+    options = {"clearance": True, "DecimateTolerance": 3.0}
+    program = random_program(1)
+    program_id = f"clearance-{step}"
+    _, _, revision = index.compute_program_incremental(
+        program_id, None, index.build_centerline_input(PROFILE, program, options), PROFILE)
+    edited = edit_row(program, step, step)
+    _, merged, _ = index.compute_program_incremental(
+        program_id, revision, index.build_centerline_input(PROFILE, edited, options), PROFILE)
+    full = compute_centerline(index.build_centerline_input(PROFILE, edited, options))
+
+    assert not merged.error and not full.error
+    assert merged.clearance["min_distance"] == pytest.approx(full.clearance["min_distance"], abs=1e-9)
+    assert merged.clearance["num_pairs"] == full.clearance["num_pairs"]
+    np.testing.assert_allclose(merged.points, full.points, atol=1e-9)
+
+
+EDITS = {
+    "Y": lambda program: [dict(row, Y=row["Y"] + 7.5) if k == 20 else row for k, row in enumerate(program)],
+    "C": lambda program: [dict(row, C=row["C"] + 33.0) if k == 20 else row for k, row in enumerate(program)],
+    "B_and_radius": lambda program: [dict(row, B=70.0, Radius=45.0) if k == 20 else row for k, row in enumerate(program)],
+    "insert": lambda program: program[:20] + [{"Y": 12.0, "B": 30.0, "C": 45.0, "Radius": 25.0}] + program[20:],
+    "delete": lambda program: program[:20] + program[22:],
+}
+
+
+@pytest.mark.parametrize("edit", sorted(EDITS))
+@pytest.mark.parametrize("options, profile", [
+    ({"frames": True, "mesh": True}, PROFILE),
+    ({"mesh": True, "clearance": True, "DecimateTolerance": 0.5}, PROFILE),
+    ({"mesh": True}, {"type": "rectangle", "dimensions": {"width": 30.0, "height": 15.0}}),
+])
+def test_spliced_suffix_matches_full_recompute(edit, options, profile):
+    program = random_program(2)
+    edited = EDITS[edit](program)
+    tail, merged, full = compute_edit(f"splice-{edit}-{sorted(options)}-{profile['type']}", program, edited, options, profile)
+
+    assert not merged.error and not full.error
+    # Chỉ các dòng đã sửa được tính và gửi đi
+    assert tail.suffix is not None and len(tail.points) < len(full.points) // 2
+    np.testing.assert_allclose(merged.points, full.points, atol=1e-9)
+    assert [(segment["type"], segment["start_idx"], segment["end_idx"]) for segment in merged.segment_info] == \
+        [(segment["type"], segment["start_idx"], segment["end_idx"]) for segment in full.segment_info]
+    for attribute in ("final_point", "final_direction", "final_up_vector"):
+        np.testing.assert_allclose(getattr(merged, attribute), getattr(full, attribute), atol=1e-9)
+        np.testing.assert_allclose(getattr(tail, attribute), getattr(full, attribute), atol=1e-9)
+    for key in full.checkpoints:
+        np.testing.assert_allclose(merged.checkpoints[key], full.checkpoints[key], atol=1e-9)
+    if full.normals is not None:
+        np.testing.assert_allclose(merged.tangents, full.tangents, atol=1e-9)
+        np.testing.assert_allclose(merged.normals, full.normals, atol=1e-9)
+    np.testing.assert_array_equal(merged.mesh.indices, full.mesh.indices)
+    np.testing.assert_allclose(merged.mesh.vertices, full.mesh.vertices, atol=1e-3)
+    np.testing.assert_allclose(merged.mesh.normals, full.mesh.normals, atol=1e-5)
+    if full.clearance is not None:
+        assert merged.clearance["min_distance"] == pytest.approx(full.clearance["min_distance"], abs=1e-9)
+
+
+def test_trace_falls_back_to_full_tail():
+    program = random_program(3)
+    tail, merged, full = compute_edit("splice-trace", program, EDITS["Y"](program), {"trace": True})
+    assert tail.suffix is None and tail.step_offset == 20
+    assert len(tail.trace) == len(program) - 20
+    np.testing.assert_allclose(merged.points, full.points, atol=1e-9)
+
+
+def test_revision_from_another_instance_forces_full_compute(monkeypatch):
+    # Hai instance cùng program_id nhưng khác dòng YBC: revision khác nhau nên không ghép nhầm phần đầu
+    program = random_program(4)
+    other = edit_row(program, 5, 1)
+    store_a, store_b = ProgramStore(1 << 24), ProgramStore(1 << 24)
+    monkeypatch.setattr(index, "program_store", store_a)
+    _, _, revision_a = index.compute_program_incremental("shared", None, index.build_centerline_input(PROFILE, program), PROFILE)
+    monkeypatch.setattr(index, "program_store", store_b)
+    _, _, revision_b = index.compute_program_incremental("shared", None, index.build_centerline_input(PROFILE, other), PROFILE)
+    _, _, revision_same = index.compute_program_incremental("copy", None, index.build_centerline_input(PROFILE, program), PROFILE)
+    assert revision_a != revision_b and revision_a == revision_same
+
+    monkeypatch.setattr(index, "program_store", store_a)
+    edited = edit_row(other, 30, 2)
+    tail, merged, _ = index.compute_program_incremental(
+        "shared", revision_b, index.build_centerline_input(PROFILE, edited), PROFILE)
+    assert tail is merged and tail.step_offset == 0
+    np.testing.assert_allclose(merged.points, compute_centerline(index.build_centerline_input(PROFILE, edited)).points)
+
+
+def post_program(client, program, program_id, base_revision=None, etag=None):
+    headers = {"Accept": "application/octet-stream"}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    return client.post("/api/calculate_tube", headers=headers, json={
+        "profile": PROFILE, "YBC": program, "program_id": program_id, "base_revision": base_revision})
+
+
+def test_incremental_tail_has_own_etag_and_is_never_not_modified():
+    client = index.app.test_client()
+    program = random_program(5)
+    edited = EDITS["Y"](program)
+    first = post_program(client, program, "etag-kind")
+    tail = post_program(client, edited, "etag-kind", first.headers["X-YBC-Revision"])
+    full = post_program(client, edited, "etag-other")
+    assert int(tail.headers["X-YBC-Step-Offset"]) == 20 and int(full.headers["X-YBC-Step-Offset"]) == 0
+    assert tail.headers["ETag"] != full.headers["ETag"]
+    assert first.headers["X-YBC-Revision"] in tail.headers["ETag"]
+
+    # Gửi lại cùng nội dung với ETag của phần đuôi: phải nhận phản hồi đầy đủ, không phải 304
+    replay = post_program(client, edited, "etag-kind", tail.headers["X-YBC-Revision"], tail.headers["ETag"])
+    assert replay.status_code == 200
+    assert post_program(client, edited, "etag-other", etag=full.headers["ETag"]).status_code == 304
+
+
+SHORT_PROGRAM = [{"Y": 50.0, "B": 90.0, "C": 0.0, "Radius": 20.0}, {"Y": 30.0, "B": 45.0, "C": 90.0, "Radius": 20.0},
+                 {"Y": 40.0, "B": 0.0, "C": 0.0, "Radius": 0.0}]
+
+
+def test_fit_ybc_rejects_too_many_points(monkeypatch):
+    monkeypatch.setattr(index, "FIT_MAX_POINTS", 10)
+    client = index.app.test_client()
+    points = compute_centerline({"YBC": SHORT_PROGRAM}).points.tolist()
+    response = client.post("/api/fit_ybc", json={"points": points[:11]})
+    assert response.status_code == 400 and "tối đa 10" in response.get_json()["error"]
+    # Đúng giới hạn: được khớp (kết quả có "converged" dù khớp được hay không)
+    assert "converged" in client.post("/api/fit_ybc", json={"points": points[:10]}).get_json()
+
+
+@pytest.mark.parametrize("options", [{"NumArcPoints": 10 ** 9}, {"MaxArcPoints": 10 ** 9, "ArcTolerance": 1e-9}])
+def test_calculate_tube_rejects_arc_points_over_limit(options):
+    response = index.app.test_client().post("/api/calculate_tube", json=dict(options, profile=PROFILE, YBC=SHORT_PROGRAM))
+    assert response.status_code == 400 and "giới hạn" in response.get_json()["error"]
+
+
+def test_batch_isolates_failing_jobs(monkeypatch):
+    compute_cached = index.compute_centerline_cached
+
+    def crash_on_two_rows(data_for_centerline_calc, cache_key):
+        if len(data_for_centerline_calc['YBC']) == 2:
+            raise RuntimeError("boom")
+        return compute_cached(data_for_centerline_calc, cache_key)
+
+    monkeypatch.setattr(index, "compute_centerline_cached", crash_on_two_rows)
+    response = index.app.test_client().post("/api/calculate_tube_batch", json={"jobs": [
+        {"id": "ok", "profile": PROFILE, "YBC": SHORT_PROGRAM},
+        {"id": "no-profile", "YBC": SHORT_PROGRAM},
+        {"id": "bad-row", "profile": PROFILE, "YBC": [{"Y": "abc", "B": 0, "C": 0}]},
+        {"id": "crash", "profile": PROFILE, "YBC": SHORT_PROGRAM[:2]},
+        "not-a-job",
+    ]})
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert (body["succeeded"], body["failed"]) == (1, 4)
+    assert "error" not in body["results"]["ok"] and len(body["results"]["ok"]["centerline_points"]) > 0
+    for job_id in ("no-profile", "bad-row", "crash"):
+        assert body["results"][job_id]["error"]
+    assert body["results_by_index"]["4"]["error"]
+    assert "boom" not in body["results"]["crash"]["error"] # Chi tiết ngoại lệ không lộ ra client
+
+
+def test_batch_ids_do_not_collide_with_missing_ids():
+    client = index.app.test_client()
+    job = {"profile": PROFILE, "YBC": SHORT_PROGRAM}
+    # Job thứ hai (chỉ số 1) không có id: không trùng với id "1" của job đầu
+    response = client.post("/api/calculate_tube_batch", json={"jobs": [dict(job, id="1"), job]})
+    body = response.get_json()
+    assert response.status_code == 200 and body["succeeded"] == 2
+    assert set(body["results"]) == {"1"} and set(body["results_by_index"]) == {"1"}
+
+    mixed = client.post("/api/calculate_tube_batch", json={"jobs": [dict(job, id=1), dict(job, id="1")]})
+    assert mixed.status_code == 400 and "cùng kiểu" in mixed.get_json()["error"]
+    duplicate = client.post("/api/calculate_tube_batch", json={"jobs": [dict(job, id=7), job, dict(job, id=7)]})
+    assert duplicate.status_code == 400 and "duy nhất" in duplicate.get_json()["error"]
+
+
+def test_etag_not_modified_and_per_format():
+    client = index.app.test_client()
+    body = {"profile": PROFILE, "YBC": SHORT_PROGRAM}
+    as_json = client.post("/api/calculate_tube", json=body)
+    as_binary = client.post("/api/calculate_tube", json=body, headers={"Accept": "application/octet-stream"})
+    assert as_json.status_code == as_binary.status_code == 200
+    assert as_json.headers["ETag"] != as_binary.headers["ETag"]
+
+    not_modified = client.post("/api/calculate_tube", json=body, headers={"If-None-Match": as_json.headers["ETag"]})
+    assert not_modified.status_code == 304 and not_modified.get_data() == b""
+    assert not_modified.headers["ETag"] == as_json.headers["ETag"]
+    # ETag của định dạng nhị phân không xác thực được phản hồi JSON
+    assert client.post("/api/calculate_tube", json=body,
+                       headers={"If-None-Match": as_binary.headers["ETag"]}).status_code == 200
+    edited = client.post("/api/calculate_tube", json=dict(body, YBC=SHORT_PROGRAM[:2]),
+                         headers={"If-None-Match": as_json.headers["ETag"]})
+    assert edited.status_code == 200
+
+
+def test_ndjson_late_error_is_final_line(monkeypatch):
+    monkeypatch.setattr(index, "STREAM_CHUNK_ROWS", 2)
+    program = SHORT_PROGRAM * 2 + [{"Y": "abc", "B": 0.0, "C": 0.0}]
+    response = index.app.test_client().post("/api/calculate_tube?stream=1", json={"profile": PROFILE, "YBC": program})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    # Phần đầu hợp lệ đã được gửi với mã 200; lỗi ở phần sau là dòng cuối, không có dòng 'done'
+    assert response.status_code == 200
+    assert "segment" in lines[0]
+    assert set(lines[-1]) == {"error"} and "dòng 7" in lines[-1]["error"]
+    assert not any(line.get("done") for line in lines)
+
+    early = index.app.test_client().post("/api/calculate_tube?stream=1",
+                                         json={"profile": PROFILE, "YBC": [{"Y": "abc", "B": 0.0, "C": 0.0}]})
+    assert early.status_code == 400
+
+
+def test_metrics_output(monkeypatch):
+    monkeypatch.setattr(index, "metrics_registry", MetricsRegistry())
+    monkeypatch.setattr(index, "result_cache", ResultCache(1 << 20))
+    client = index.app.test_client()
+    body = {"profile": PROFILE, "YBC": SHORT_PROGRAM}
+    client.post("/api/calculate_tube", json=body)
+    client.post("/api/calculate_tube", json=body)
+    client.post("/api/calculate_tube", json={"profile": PROFILE})
+
+    response = client.get("/api/metrics")
+    text = response.get_data(as_text=True)
+    assert response.status_code == 200 and response.mimetype == "text/plain"
+    assert 'ybc_requests_total{route="calculate_tube",status="200"} 2' in text
+    assert 'ybc_requests_total{route="calculate_tube",status="400"} 1' in text
+    assert 'ybc_request_phase_seconds_count{route="calculate_tube",phase="compute"} 2' in text
+    assert 'ybc_request_size_sum{route="calculate_tube",kind="rows"} 6.0' in text
+    assert "ybc_cache_hits_total 1" in text and "ybc_cache_misses_total 1" in text
+    assert "# TYPE ybc_cache_evictions_total counter" in text and "# TYPE ybc_cache_bytes gauge" in text
+
+    monkeypatch.setattr(index, "METRICS_TOKEN", "secret")
+    assert client.get("/api/metrics").status_code == 401
+    assert client.get("/api/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/api/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
+
+    monkeypatch.setattr(index, "metrics_registry", None)
+    assert client.get("/api/metrics").status_code == 404
+
+
+def test_calculate_tube_does_not_import_inverse_engine():
+    # Tiến trình mới: request tính đường tâm đầu tiên không nạp YBC3D_inverse, request /api/fit_ybc thì có
+    script = """
+import sys, index
+client = index.app.test_client()
+client.post("/api/calculate_tube", json={"profile": %r, "YBC": %r})
+print("YBC3D_inverse" in sys.modules)
+client.post("/api/fit_ybc", json={"points": [[0, 0, 0], [1, 0, 0]]})
+print("YBC3D_inverse" in sys.modules)
+""" % (PROFILE, SHORT_PROGRAM)
+    completed = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(index.__file__)),
+                               capture_output=True, text=True, check=True)
+    assert completed.stdout.split() == ["False", "True"]
+
+
+def test_calculate_tube_rejects_string_trace_flag():
+    response = index.app.test_client().post("/api/calculate_tube", json={"profile": PROFILE, "YBC": SHORT_PROGRAM, "trace": "false"})
+    assert response.status_code == 400 and "'Trace'" in response.get_json()["error"]
+
+
+def test_ndjson_honors_precision_and_trace(monkeypatch):
+    monkeypatch.setattr(index, "STREAM_CHUNK_ROWS", 2)
+    client = index.app.test_client()
+    body = {"profile": PROFILE, "YBC": SHORT_PROGRAM}
+
+    def stream(query, **options):
+        response = client.post(f"/api/calculate_tube?stream=1{query}", json=dict(body, **options))
+        return response, [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    _, full = stream("")
+    _, rounded = stream("&precision=float32")
+    full_points = np.concatenate([line["points"] for line in full if "points" in line])
+    rounded_points = np.concatenate([line["points"] for line in rounded if "points" in line])
+    assert not np.array_equal(full_points, rounded_points)
+    np.testing.assert_allclose(rounded_points, full_points, rtol=1e-6, atol=1e-5)
+
+    _, traced = stream("", trace=True)
+    steps = [step["step"] for line in traced if "trace" in line for step in line["trace"]]
+    assert steps == [1, 2, 3] and "trace" not in full[0]
+
+    for query, options in (("&precision=int16", {}), ("", {"mesh": True}), ("", {"clearance": True})):
+        response, _ = stream(query, **options)
+        assert response.status_code == 400
@@ -0,0 +1,279 @@
+# File: bench/bench_centerline.py
+#
+# Benchmark và kiểm tra hồi quy hiệu năng cho engine đường tâm (YBC3D_web.py) và route /api/calculate_tube.
+#
+#   python bench/bench_centerline.py --output base.json                   # Ghi kết quả
+#   python bench/bench_centerline.py --compare base.json                  # So sánh, chỉ báo cáo (luôn exit 0)
+#   python bench/bench_centerline.py --compare base.json --strict         # Exit 1 nếu có hồi quy
+#
+# Kết quả phụ thuộc máy chạy và tải của máy tại thời điểm đo. bench/baseline.json chỉ là số liệu tham khảo của một máy
+# (meta ghi máy và commit), không dùng làm ngưỡng đạt/trượt. Muốn dùng --strict làm cổng kiểm tra: đo A/B trên cùng máy,
+# trong cùng một job — checkout commit gốc rồi chạy --output base.json, checkout commit mới rồi chạy --compare base.json --strict.
+# Mỗi lần chạy đo --rounds vòng xen kẽ qua mọi case; thời gian của case là trung vị của trung vị từng vòng, và độ lệch
+# giữa các vòng (spread) nới ngưỡng so sánh của case đó. Các case ngắn hơn MIN_COMPARE_MS chỉ được báo cáo.
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+sys.path.insert(0, API_DIR)
+
+# Tắt cache kết quả và trạng thái chương trình để đo đúng chi phí tính toán của route
+os.environ['YBC_CACHE_MAX_BYTES'] = '0'
+os.environ['YBC_PROGRAM_STORE_MAX_BYTES'] = '0'
+os.environ.setdefault('YBC_LOG_LEVEL', 'ERROR')
+
+import numpy as np
+from YBC3D_web import calculate_centerline_from_data, compute_centerline
+
+DEFAULT_SIZES = (1, 10, 100, 1000, 5000)
+DEFAULT_SEED = 20240501
+DEFAULT_THRESHOLD = 0.25 # Throughput giảm quá 25% so với baseline thì coi là hồi quy (đủ rộng cho nhiễu của máy dùng chung)
+MIN_MEASURE_SECONDS = 0.5 # Lặp lại mỗi case đến khi tổng thời gian đo đạt ngưỡng này
+MIN_COMPARE_MS = 10.0 # Case có trung vị dưới ngưỡng này quá nhiễu để so sánh, chỉ được báo cáo
+DEFAULT_ROUNDS = 3 # Số vòng đo xen kẽ: tải của máy thay đổi theo phút, một vòng liên tục không thấy được độ lệch đó
+
+# Góc uốn, bán kính khuôn và góc xoay thường gặp trên máy uốn ống
+COMMON_BEND_ANGLES = (15.0, 30.0, 45.0, 60.0, 90.0, 90.0, 90.0, 120.0, 135.0)
+COMMON_RADII = (20.0, 25.0, 32.0, 40.0, 50.0, 63.0, 80.0, 100.0)
+COMMON_ROTATIONS = (0.0, 0.0, 90.0, -90.0, 180.0)
+
+
+def generate_program(num_rows, seed=DEFAULT_SEED):
+    """ Chương trình YBC ngẫu nhiên (có seed) gồm num_rows dòng: đoạn thẳng, uốn và xoay với giá trị thực tế """
+    rng = random.Random(f"{seed}-{num_rows}")
+    rows = []
+    for _ in range(num_rows):
+        feed = 0.0 if rng.random() < 0.1 else round(rng.uniform(5.0, 300.0), 1)
+        if rng.random() < 0.15: # Dòng chỉ đẩy ống, không uốn
+            bend_angle, radius = 0.0, 0.0
+        else:
+            bend_angle = rng.choice(COMMON_BEND_ANGLES) if rng.random() < 0.8 else round(rng.uniform(1.0, 170.0), 1)
+            radius = rng.choice(COMMON_RADII)
+        rotation = rng.choice(COMMON_ROTATIONS) if rng.random() < 0.7 else round(rng.uniform(-180.0, 180.0), 1)
+        rows.append({"Y": feed, "B": bend_angle, "C": rotation, "Radius": radius})
+    return rows
+
+
+def measure(function, min_seconds=MIN_MEASURE_SECONDS, min_repeats=3):
+    """ Gọi function nhiều lần, trả về (danh sách thời gian từng lần, kết quả lần cuối) """
+    timings = []
+    result = None
+    gc.collect()
+    while len(timings) < min_repeats or sum(timings) < min_seconds:
+        started_at = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started_at)
+    return timings, result
+
+
+def peak_memory(function):
+    """ Bộ nhớ cấp phát đỉnh (byte, theo tracemalloc) của một lần gọi function """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summarize(rows, num_points, round_timings, response_bytes, peak_bytes):
+    """ Gộp thời gian các vòng đo của một case: trung vị của trung vị từng vòng, spread = (lớn nhất - nhỏ nhất) / trung vị """
+    round_medians = [statistics.median(timings) for timings in round_timings]
+    median_seconds = statistics.median(round_medians)
+    best_seconds = min(min(timings) for timings in round_timings) # Chỉ để báo cáo; so sánh dùng trung vị
+    return {
+        "rows": rows,
+        "points": num_points,
+        "repeats": sum(len(timings) for timings in round_timings),
+        "rounds": len(round_timings),
+        "spread": round((max(round_medians) - min(round_medians)) / median_seconds, 4) if median_seconds > 0 else 0.0,
+        "median_ms": round(median_seconds * 1000.0, 4),
+        "min_ms": round(best_seconds * 1000.0, 4),
+        "points_per_sec": round(num_points / best_seconds, 1) if best_seconds > 0 else None,
+        "median_points_per_sec": round(num_points / median_seconds, 1) if median_seconds > 0 else None,
+        "response_bytes": response_bytes,
+        "peak_bytes": peak_bytes,
+    }
+
+
+def bench_engine(rows):
+    """
+    calculate_centerline_from_data từ đầu đến cuối (tính toán + serialize JSON).
+    Trả về (hàm đo một vòng -> (thời gian, số byte phản hồi), hàm gọi một lần để đo bộ nhớ).
+    """
+    data = {"Diameter": 25.0, "YBC": rows}
+
+    def measure_round():
+        timings, result_json = measure(lambda: calculate_centerline_from_data(data))
+        return timings, len(result_json.encode('utf-8'))
+
+    return measure_round, lambda: calculate_centerline_from_data(data)
+
+
+def bench_http(client, rows, binary):
+    """ POST /api/calculate_tube qua test client của Flask, định dạng JSON hoặc nhị phân; trả về như bench_engine """
+    body = {"profile": {"type": "round", "dimensions": {"diameter": 25.0}}, "YBC": rows}
+    headers = {'Accept': 'application/octet-stream'} if binary else {}
+
+    def post():
+        response = client.post('/api/calculate_tube', json=body, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/calculate_tube trả về {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return response
+
+    def measure_round():
+        timings, response = measure(post)
+        return timings, len(response.get_data())
+
+    return measure_round, post
+
+
+def source_revision():
+    """ (commit HEAD, api/ có thay đổi chưa commit hay không), hoặc (None, None) khi không chạy trong git checkout """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=API_DIR, capture_output=True, text=True, check=True)
+        status = subprocess.run(['git', 'status', '--porcelain', '--', '.'], cwd=API_DIR, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.stdout.strip(), bool(status.stdout.strip())
+
+
+def run_benchmarks(sizes, seed, include_http=True, rounds=DEFAULT_ROUNDS):
+    cases = {}
+    client = None
+    if include_http:
+        from index import app
+        client = app.test_client()
+    for num_rows in sizes:
+        rows = generate_program(num_rows, seed)
+        num_points = len(compute_centerline({"Diameter": 25.0, "YBC": rows}).points)
+        cases[f"engine/{num_rows}"] = (rows, num_points, bench_engine(rows))
+        if client is not None:
+            cases[f"http_json/{num_rows}"] = (rows, num_points, bench_http(client, rows, binary=False))
+            cases[f"http_binary/{num_rows}"] = (rows, num_points, bench_http(client, rows, binary=True))
+
+    # Các vòng xen kẽ qua mọi case: thay đổi tải của máy trong lúc chạy ảnh hưởng đều các case và hiện ra ở spread
+    round_timings = {case: [] for case in cases}
+    response_bytes = {}
+    for _ in range(max(1, rounds)):
+        for case, (_, _, (measure_round, _)) in cases.items():
+            timings, response_bytes[case] = measure_round()
+            round_timings[case].append(timings)
+    results = {
+        case: summarize(len(rows), num_points, round_timings[case], response_bytes[case], peak_memory(call_once))
+        for case, (rows, num_points, (_, call_once)) in cases.items()
+    }
+    commit, api_dirty = source_revision()
+    return {
+        "meta": {
+            "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "seed": seed,
+            "commit": commit,
+            "api_dirty": api_dirty, # True: mã trong api/ khác commit trên
+        },
+        "results": results,
+    }
+
+
+def is_comparable(baseline_case, current_case, min_compare_ms=MIN_COMPARE_MS):
+    """ Case đủ dài (cả baseline và hiện tại) để throughput theo trung vị ổn định giữa các lần chạy """
+    return (bool(current_case) and bool(baseline_case.get("median_points_per_sec")) and bool(current_case.get("median_points_per_sec"))
+            and min(baseline_case["median_ms"], current_case["median_ms"]) >= min_compare_ms)
+
+
+def case_threshold(baseline_case, current_case, threshold):
+    """ Ngưỡng của một case: không nhỏ hơn độ lệch giữa các vòng đo đã thấy ở cả hai lần chạy """
+    return max(threshold, baseline_case.get("spread", 0.0) + current_case.get("spread", 0.0))
+
+
+def compare_results(baseline, current, threshold, min_compare_ms=MIN_COMPARE_MS):
+    """ Danh sách (case, baseline, hiện tại, tỉ lệ, ngưỡng) có throughput trung vị giảm quá ngưỡng của case """
+    regressions = []
+    for case, baseline_case in baseline.get("results", {}).items():
+        current_case = current["results"].get(case)
+        if not is_comparable(baseline_case, current_case, min_compare_ms):
+            continue
+        ratio = current_case["median_points_per_sec"] / baseline_case["median_points_per_sec"]
+        allowed_drop = case_threshold(baseline_case, current_case, threshold)
+        if ratio < 1.0 - allowed_drop:
+            regressions.append((case, baseline_case["median_points_per_sec"], current_case["median_points_per_sec"],
+                                ratio, allowed_drop))
+    return regressions
+
+
+def print_report(report, baseline=None, min_compare_ms=MIN_COMPARE_MS):
+    print(f"{'case':<20} {'rows':>6} {'points':>8} {'median ms':>10} {'spread':>7} {'best pts/s':>12} {'bytes':>10} "
+          f"{'peak KiB':>9} {'vs base':>8}")
+    for case, values in report["results"].items():
+        relative = ""
+        if baseline and case in baseline.get("results", {}):
+            if is_comparable(baseline["results"][case], values, min_compare_ms):
+                relative = f"{values['median_points_per_sec'] / baseline['results'][case]['median_points_per_sec']:.2f}x"
+            else:
+                relative = "-" # Quá ngắn để so sánh
+        print(f"{case:<20} {values['rows']:>6} {values['points']:>8} {values['median_ms']:>10.3f} {values['spread']:>7.0%} "
+              f"{values['points_per_sec']:>12.0f} {values['response_bytes']:>10} {values['peak_bytes'] / 1024:>9.0f} {relative:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark engine đường tâm YBC và route /api/calculate_tube")
+    parser.add_argument('--sizes', type=lambda text: [int(value) for value in text.split(',')], default=list(DEFAULT_SIZES),
+                        help="Số dòng YBC của các chương trình, phân tách bằng dấu phẩy (mặc định: 1,10,100,1000,5000)")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--no-http', action='store_true', help="Chỉ đo engine, bỏ qua route Flask")
+    parser.add_argument('--output', help="Ghi kết quả ra file JSON (ví dụ bench/baseline.json)")
+    parser.add_argument('--compare', help="File baseline JSON để so sánh")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Tỉ lệ giảm throughput tối đa cho phép khi so sánh (mặc định 0.25)")
+    parser.add_argument('--min-compare-ms', type=float, default=MIN_COMPARE_MS,
+                        help="Chỉ so sánh các case có thời gian trung vị từ giá trị này trở lên (mặc định 10 ms)")
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS,
+                        help="Số vòng đo xen kẽ qua mọi case (mặc định 3)")
+    parser.add_argument('--strict', action='store_true',
+                        help="Exit 1 khi có hồi quy; chỉ dùng với baseline đo trên cùng máy trong cùng job (đo A/B)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    report = run_benchmarks(args.sizes, args.seed, include_http=not args.no_http, rounds=args.rounds)
+    print_report(report, baseline, args.min_compare_ms)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+            output_file.write('\n')
+        print(f"Đã ghi kết quả vào {args.output}")
+
+    if baseline is not None:
+        regressions = compare_results(baseline, report, args.threshold, args.min_compare_ms)
+        if regressions:
+            print(f"\nHỒI QUY hiệu năng (giảm quá ngưỡng của case, tối thiểu {args.threshold:.0%}):")
+            for case, baseline_rate, current_rate, ratio, allowed_drop in regressions:
+                print(f"  {case}: {baseline_rate:.0f} -> {current_rate:.0f} points/s ({ratio:.2f}x, ngưỡng {allowed_drop:.0%})")
+            if not args.strict:
+                print("Chỉ mang tính tham khảo (không có --strict): exit 0.")
+            return 1 if args.strict else 0
+        print(f"\nKhông có hồi quy so với {args.compare} (ngưỡng tối thiểu {args.threshold:.0%}, các case từ {args.min_compare_ms:g} ms).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# File: bench/check_import_time.py
+#
+# Kiểm tra ngân sách thời gian import của handler serverless (api/index.py) bằng 'python -X importtime':
+#   python bench/check_import_time.py                  # exit 1 nếu vượt ngân sách hoặc NumPy bị import khi khởi động
+#   python bench/check_import_time.py --budget-ms 250 --runs 7
+#
+# Ngân sách đo thời gian import tích lũy (gồm cả Flask) của module 'index', lấy trung vị của nhiều lần chạy
+# trong tiến trình mới. Con số phụ thuộc máy: chỉnh --budget-ms theo runner dùng để kiểm tra.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+
+DEFAULT_BUDGET_MS = 300.0
+DEFAULT_RUNS = 5
+# Các module nặng không được import khi nạp handler (chỉ import ở request đầu tiên cần tính toán)
+DEFERRED_MODULES = ('numpy', 'YBC3D_web', 'YBC3D_binary', 'YBC3D_mesh', 'YBC3D_clearance', 'YBC3D_inverse',
+                    'YBC3D_compact', 'concurrent.futures')
+
+
+def measure_import(module_name='index'):
+    """ Một lần import trong tiến trình mới: (thời gian tích lũy ms, {module: thời gian tích lũy ms}) """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        cwd=API_DIR, capture_output=True, text=True, check=True,
+        env=dict(os.environ, YBC_WARMUP='0')
+    )
+    cumulative_ms = {}
+    for line in completed.stderr.splitlines():
+        # Định dạng: 'import time: self [us] | cumulative | imported package'
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|', 1).split('|')]
+        cumulative_ms[name] = int(cumulative_us) / 1000.0
+    return cumulative_ms[module_name], cumulative_ms
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ngân sách thời gian import của api/index.py")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    args = parser.parse_args(argv)
+
+    totals = []
+    modules = {}
+    for _ in range(max(1, args.runs)):
+        total_ms, modules = measure_import()
+        totals.append(total_ms)
+    median_ms = statistics.median(totals)
+
+    print(f"import index: trung vị {median_ms:.1f} ms ({', '.join(f'{t:.1f}' for t in totals)}), ngân sách {args.budget_ms:.1f} ms")
+    print("Các module tốn nhiều nhất (tích lũy, lần chạy cuối):")
+    top_level = sorted(((ms, name) for name, ms in modules.items() if name != 'index'), reverse=True)[:8]
+    for ms, name in top_level:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failed = False
+    eagerly_imported = [name for name in DEFERRED_MODULES if name in modules]
+    if eagerly_imported:
+        print(f"LỖI: các module sau bị import khi nạp handler: {', '.join(eagerly_imported)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"LỖI: vượt ngân sách import ({median_ms:.1f} ms > {args.budget_ms:.1f} ms)")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,18 @@
 // Biến toàn cục cho Three.js
 let scene, camera, renderer, controls;
 let tubeGroup; // Một nhóm để chứa tất cả các đoạn ống, dễ dàng xóa và thêm lại
+let lastTubeResult = null; // Kết quả gần nhất { requestBody, etag, revision, decoded } để gửi If-None-Match và tính tăng dần
+// Mã chương trình đang chỉnh sửa: server chỉ tính lại và gửi phần đuôi kể từ dòng YBC đầu tiên thay đổi
+const programId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : String(Date.now()) + String(Math.random()).slice(2);
 
 // Màu sắc cho các đoạn ống
 const STRAIGHT_SEGMENT_COLOR = 0x007bff; // Màu xanh dương cho đoạn thẳng (Y)
 const BENT_SEGMENT_COLOR = 0xff4500;    // Màu cam đỏ cho đoạn cong (B)
 const DEFAULT_TUBE_COLOR = 0xcccccc;   // Màu xám nếu không xác định được loại
+const STREAM_ROW_THRESHOLD = 2000; // Từ số dòng YBC này, nhận kết quả theo từng phần (NDJSON) và vẽ dần
+// Từ số dòng YBC này, server giản lược điểm trên cung (độ lệch dây cung tối đa, mm) và gửi điểm dạng int16 lượng tử hóa
+const LARGE_PROGRAM_ROW_THRESHOLD = 500;
+const LARGE_PROGRAM_DECIMATE_TOLERANCE = 0.05;
 
 // Khởi tạo môi trường 3D (Tương tự như trước)
 function init3DViewer() {
@@ -113,17 +120,514 @@ function deleteSelectedRows() {
 }
 
 
-// Hàm vẽ biên dạng (thay thế hàm drawTube cũ)
-function drawProfileGeometry(centerlinePoints, segmentInfo, profileData) {
-    // Xóa các đối tượng cũ trong group
+// Định dạng nhị phân của /api/calculate_tube (magic 'YBC3', xem api/YBC3D_binary.py)
+const BINARY_HEADER_BYTES = 96;
+const BINARY_VERSION = 2; // Phiên bản mới nhất được hỗ trợ; phiên bản 2 thêm điểm int16 kèm khối lượng tử hóa
+const BINARY_MIN_VERSION_BY_COMPONENT_BYTES = { 8: 1, 4: 1, 2: 2 };
+const BINARY_QUANTIZATION_BYTES = 48; // origin, scale (6 x float64) trước mảng điểm int16
+const BINARY_SEGMENT_RECORD_BYTES = 32;
+const BINARY_FLAG_MESH = 0x01; // Có phần lưới bề mặt sau các đoạn
+const BINARY_FLAG_FRAMES = 0x02; // Có normal/binormal tại từng điểm sau các đoạn
+
+// Giải mã phản hồi nhị phân: mảng điểm được wrap trực tiếp trên buffer (không sao chép)
+function decodeBinaryCenterline(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+    if (magic !== 'YBC3') {
+        throw new Error("Phản hồi nhị phân không đúng định dạng.");
+    }
+    const version = view.getUint16(4, true);
+    const bytesPerComponent = view.getUint8(6);
+    const flags = view.getUint8(7);
+    const minVersion = BINARY_MIN_VERSION_BY_COMPONENT_BYTES[bytesPerComponent];
+    if (minVersion === undefined || version < minVersion || version > BINARY_VERSION) {
+        throw new Error(`Phiên bản định dạng nhị phân không được hỗ trợ (${version}, ${bytesPerComponent} byte mỗi thành phần).`);
+    }
+    const numPoints = view.getUint32(8, true);
+    const numSegments = view.getUint32(12, true);
+    const diameter = view.getFloat64(16, true);
+
+    let centerlinePoints;
+    let offset;
+    if (bytesPerComponent === 2) {
+        // Điểm lượng tử hóa theo hộp bao: điểm = origin + giá trị * scale, giải lượng tử một lần sang Float32Array
+        const origin = [0, 1, 2].map(axis => view.getFloat64(BINARY_HEADER_BYTES + axis * 8, true));
+        const scale = [0, 1, 2].map(axis => view.getFloat64(BINARY_HEADER_BYTES + 24 + axis * 8, true));
+        const quantized = new Int16Array(buffer, BINARY_HEADER_BYTES + BINARY_QUANTIZATION_BYTES, numPoints * 3);
+        centerlinePoints = new Float32Array(numPoints * 3);
+        for (let i = 0; i < quantized.length; i++) {
+            centerlinePoints[i] = origin[i % 3] + quantized[i] * scale[i % 3];
+        }
+        offset = BINARY_HEADER_BYTES + BINARY_QUANTIZATION_BYTES + quantized.byteLength;
+    } else {
+        const PointArrayType = bytesPerComponent === 4 ? Float32Array : Float64Array;
+        centerlinePoints = new PointArrayType(buffer, BINARY_HEADER_BYTES, numPoints * 3);
+        offset = BINARY_HEADER_BYTES + centerlinePoints.byteLength;
+    }
+    offset += (8 - offset % 8) % 8; // Mảng điểm được đệm đến bội số của 8 byte
+    const segmentInfo = [];
+    for (let k = 0; k < numSegments; k++, offset += BINARY_SEGMENT_RECORD_BYTES) {
+        const typeCode = view.getUint8(offset);
+        const segment = {
+            start_idx: view.getUint32(offset + 4, true),
+            end_idx: view.getUint32(offset + 8, true)
+        };
+        const value = view.getFloat64(offset + 16, true);
+        if (typeCode === 0) {
+            segment.type = 'Y';
+            segment.value = value;
+        } else {
+            segment.type = typeCode === 1 ? 'B' : '?';
+            segment.angle = value;
+            segment.radius = view.getFloat64(offset + 24, true);
+        }
+        segmentInfo.push(segment);
+    }
+    let pointNormals = null;
+    let pointBinormals = null;
+    if (flags & BINARY_FLAG_FRAMES) {
+        pointNormals = new Float32Array(buffer, offset, numPoints * 3);
+        offset += pointNormals.byteLength;
+        pointBinormals = new Float32Array(buffer, offset, numPoints * 3);
+        offset += pointBinormals.byteLength;
+    }
+    let mesh = null;
+    if (flags & BINARY_FLAG_MESH) {
+        const numVertices = view.getUint32(offset, true);
+        const numIndices = view.getUint32(offset + 4, true);
+        const ringVertices = view.getUint32(offset + 8, true);
+        const ringEdges = view.getUint32(offset + 12, true);
+        offset += 16;
+        const vertices = new Float32Array(buffer, offset, numVertices * 3);
+        offset += vertices.byteLength;
+        const normals = new Float32Array(buffer, offset, numVertices * 3);
+        offset += normals.byteLength;
+        const indices = new Uint32Array(buffer, offset, numIndices);
+        mesh = { vertices, normals, indices, ringVertices, ringEdges };
+    }
+    return { centerlinePoints, segmentInfo, diameter, mesh, pointNormals, pointBinormals };
+}
+
+// Lưới bề mặt trong kết quả JSON (khóa 'mesh') được chuyển sang cùng dạng mảng phẳng như định dạng nhị phân
+function meshFromJson(meshData) {
+    if (!meshData) return null;
+    return {
+        vertices: new Float32Array(meshData.vertices),
+        normals: new Float32Array(meshData.normals),
+        indices: new Uint32Array(meshData.indices),
+        ringVertices: meshData.ring_vertices,
+        ringEdges: meshData.ring_edges
+    };
+}
+
+// Ghép lưới phần đuôi: giữ các vòng đỉnh của điểm [0, pointOffset) và các dải tam giác trước điểm pointOffset
+function mergeIncrementalMesh(previous, tail, pointOffset) {
+    if (!previous || !tail) return tail;
+    const keptVertexValues = pointOffset * previous.ringVertices * 3;
+    const keptIndices = pointOffset * 6 * previous.ringEdges;
+    const vertices = new Float32Array(keptVertexValues + tail.vertices.length);
+    vertices.set(previous.vertices.subarray(0, keptVertexValues));
+    vertices.set(tail.vertices, keptVertexValues);
+    const normals = new Float32Array(keptVertexValues + tail.normals.length);
+    normals.set(previous.normals.subarray(0, keptVertexValues));
+    normals.set(tail.normals, keptVertexValues);
+    const indices = new Uint32Array(keptIndices + tail.indices.length);
+    indices.set(previous.indices.subarray(0, keptIndices));
+    indices.set(tail.indices, keptIndices);
+    return { vertices, normals, indices, ringVertices: tail.ringVertices, ringEdges: tail.ringEdges };
+}
+
+// Ghép mảng phẳng theo điểm (3 giá trị mỗi điểm): giữ điểm [0, pointOffset) của mảng trước + phần đuôi
+function mergePointArrays(previous, tail, pointOffset) {
+    if (!previous || !tail) return tail;
+    const merged = new tail.constructor(pointOffset * 3 + tail.length);
+    merged.set(previous.subarray(0, pointOffset * 3));
+    merged.set(tail, pointOffset * 3);
+    return merged;
+}
+
+// Phép dời hình của phần đuôi không đổi trong header X-YBC-Suffix-* (null nếu server tính lại toàn bộ phần đuôi)
+function suffixFromHeaders(headers) {
+    const pointStart = headers.get('X-YBC-Suffix-Point-Start');
+    if (pointStart === null) return null;
+    return {
+        pointStart: parseInt(pointStart, 10),
+        segmentStart: parseInt(headers.get('X-YBC-Suffix-Segment-Start'), 10),
+        transform: headers.get('X-YBC-Suffix-Transform').split(',').map(Number), // Ma trận 4x4 theo hàng
+        twist: parseFloat(headers.get('X-YBC-Suffix-Twist'))
+    };
+}
+
+// Ma trận 4x4 theo hàng m áp dụng cho mảng phẳng các vector 3 chiều; translate = false với vector hướng
+function transformVectors(values, m, translate) {
+    const result = new values.constructor(values.length);
+    for (let i = 0; i < values.length; i += 3) {
+        const x = values[i], y = values[i + 1], z = values[i + 2];
+        result[i] = m[0] * x + m[1] * y + m[2] * z + (translate ? m[3] : 0);
+        result[i + 1] = m[4] * x + m[5] * y + m[6] * z + (translate ? m[7] : 0);
+        result[i + 2] = m[8] * x + m[9] * y + m[10] * z + (translate ? m[11] : 0);
+    }
+    return result;
+}
+
+// Quay mảng phẳng các vector quanh trục đơn vị axis (x, y, z) góc có cos/sin cho trước (Rodrigues), ghi đè tại chỗ
+function rotateVectorsInPlace(values, start, end, axis, cosAngle, sinAngle, center) {
+    const [ax, ay, az] = axis;
+    for (let i = start; i < end; i += 3) {
+        const x = values[i] - (center ? center[0] : 0), y = values[i + 1] - (center ? center[1] : 0), z = values[i + 2] - (center ? center[2] : 0);
+        const along = (ax * x + ay * y + az * z) * (1 - cosAngle);
+        values[i] = x * cosAngle + (ay * z - az * y) * sinAngle + ax * along + (center ? center[0] : 0);
+        values[i + 1] = y * cosAngle + (az * x - ax * z) * sinAngle + ay * along + (center ? center[1] : 0);
+        values[i + 2] = z * cosAngle + (ax * y - ay * x) * sinAngle + az * along + (center ? center[2] : 0);
+    }
+}
+
+// Ghép các mảng phẳng cùng kiểu với mảng đầu tiên
+function concatArrays(parts) {
+    const merged = new parts[0].constructor(parts.reduce((total, part) => total + part.length, 0));
+    let offset = 0;
+    for (const part of parts) {
+        merged.set(part, offset);
+        offset += part.length;
+    }
+    return merged;
+}
+
+// Phần đuôi không đổi của kết quả trước (điểm sau suffix.pointStart, đoạn từ suffix.segmentStart) sau phép dời hình
+// và góc xoắn của pháp tuyến quanh tiếp tuyến, chỉ số điểm dời pointShift; giống splice_resumed_result trong api/YBC3D_web.py
+function transformedSuffix(previous, suffix, pointShift) {
+    const m = suffix.transform;
+    const cosTwist = Math.cos(suffix.twist), sinTwist = Math.sin(suffix.twist);
+    const twisted = Math.abs(suffix.twist) > 1e-12;
+    const firstValue = (suffix.pointStart + 1) * 3;
+    const centerlinePoints = transformVectors(previous.centerlinePoints.subarray(firstValue), m, true);
+    let pointNormals = null;
+    let pointBinormals = null;
+    if (previous.pointNormals && previous.pointBinormals) {
+        const normals = transformVectors(previous.pointNormals.subarray(firstValue), m, false);
+        const binormals = transformVectors(previous.pointBinormals.subarray(firstValue), m, false);
+        pointNormals = normals.map((value, i) => cosTwist * value + sinTwist * binormals[i]);
+        pointBinormals = binormals.map((value, i) => cosTwist * value - sinTwist * normals[i]);
+    }
+    let mesh = null;
+    if (previous.mesh) {
+        const { ringVertices, ringEdges } = previous.mesh;
+        const vertices = transformVectors(previous.mesh.vertices.subarray((suffix.pointStart + 1) * ringVertices * 3), m, true);
+        const normals = transformVectors(previous.mesh.normals.subarray((suffix.pointStart + 1) * ringVertices * 3), m, false);
+        const previousIndices = previous.mesh.indices.subarray(suffix.pointStart * 6 * ringEdges);
+        if (twisted && previousIndices.length > 0) {
+            // Tiếp tuyến của vòng: tích có hướng pháp tuyến đỉnh đầu của hai cạnh đầu tiên của mặt cắt (xem transform_tube_mesh)
+            const first = 3 * (previousIndices[0] % ringVertices), second = 3 * (previousIndices[6] % ringVertices);
+            for (let ring = 0; ring * ringVertices * 3 < vertices.length; ring++) {
+                const base = ring * ringVertices * 3;
+                const n1 = normals.subarray(base + first, base + first + 3), n2 = normals.subarray(base + second, base + second + 3);
+                const axis = [n1[1] * n2[2] - n1[2] * n2[1], n1[2] * n2[0] - n1[0] * n2[2], n1[0] * n2[1] - n1[1] * n2[0]];
+                const length = Math.hypot(axis[0], axis[1], axis[2]);
+                const unitAxis = axis.map(value => value / length);
+                const center = centerlinePoints.subarray(ring * 3, ring * 3 + 3);
+                rotateVectorsInPlace(vertices, base, base + ringVertices * 3, unitAxis, cosTwist, sinTwist, center);
+                rotateVectorsInPlace(normals, base, base + ringVertices * 3, unitAxis, cosTwist, sinTwist, null);
+            }
+        }
+        const indices = previousIndices.map(index => index + pointShift * ringVertices);
+        mesh = { vertices, normals, indices, ringVertices, ringEdges };
+    }
+    const segmentInfo = previous.segmentInfo.slice(suffix.segmentStart).map(segment => ({
+        ...segment, start_idx: segment.start_idx + pointShift, end_idx: segment.end_idx + pointShift
+    }));
+    return { centerlinePoints, pointNormals, pointBinormals, segmentInfo, mesh };
+}
+
+// Ghép phần đuôi do server gửi (chế độ tăng dần) vào kết quả trước: giữ điểm [0, pointOffset) và đoạn [0, segmentOffset).
+// suffix (tùy chọn, suffixFromHeaders): các điểm/đoạn còn lại của kết quả trước được nối sau phần đuôi sau phép dời hình
+function mergeIncrementalCenterline(previous, tail, pointOffset, segmentOffset, suffix = null) {
+    if (!previous || (pointOffset === 0 && segmentOffset === 0 && !suffix)) {
+        return tail;
+    }
+    const merged = {
+        centerlinePoints: mergePointArrays(previous.centerlinePoints, tail.centerlinePoints, pointOffset),
+        pointNormals: mergePointArrays(previous.pointNormals, tail.pointNormals, pointOffset),
+        pointBinormals: mergePointArrays(previous.pointBinormals, tail.pointBinormals, pointOffset),
+        segmentInfo: previous.segmentInfo.slice(0, segmentOffset).concat(tail.segmentInfo),
+        diameter: tail.diameter,
+        mesh: mergeIncrementalMesh(previous.mesh, tail.mesh, pointOffset)
+    };
+    if (!suffix) {
+        return merged;
+    }
+    const pointShift = centerlinePointCount(merged.centerlinePoints) - 1 - suffix.pointStart;
+    const moved = transformedSuffix(previous, suffix, pointShift);
+    return {
+        centerlinePoints: concatArrays([merged.centerlinePoints, moved.centerlinePoints]),
+        pointNormals: merged.pointNormals && moved.pointNormals ? concatArrays([merged.pointNormals, moved.pointNormals]) : merged.pointNormals,
+        pointBinormals: merged.pointBinormals && moved.pointBinormals ? concatArrays([merged.pointBinormals, moved.pointBinormals]) : merged.pointBinormals,
+        segmentInfo: merged.segmentInfo.concat(moved.segmentInfo),
+        diameter: merged.diameter,
+        mesh: merged.mesh && moved.mesh ? {
+            ...merged.mesh,
+            vertices: concatArrays([merged.mesh.vertices, moved.mesh.vertices]),
+            normals: concatArrays([merged.mesh.normals, moved.mesh.normals]),
+            indices: concatArrays([merged.mesh.indices, moved.mesh.indices])
+        } : merged.mesh
+    };
+}
+
+// Số điểm và điểm thứ i của đường tâm; hỗ trợ cả mảng lồng [[x,y,z],...] (JSON) và mảng phẳng Float32Array (nhị phân)
+function centerlinePointCount(points) {
+    return ArrayBuffer.isView(points) ? points.length / 3 : points.length;
+}
+
+function centerlinePointAt(points, i) {
+    if (ArrayBuffer.isView(points)) {
+        return new THREE.Vector3(points[3 * i], points[3 * i + 1], points[3 * i + 2]);
+    }
+    return new THREE.Vector3(points[i][0], points[i][1], points[i][2]);
+}
+
+// Xóa các đối tượng cũ trong group
+function clearTubeGroup() {
     while (tubeGroup.children.length > 0) {
         const oldSegment = tubeGroup.children[0];
         tubeGroup.remove(oldSegment);
         if (oldSegment.geometry) oldSegment.geometry.dispose();
-        if (oldSegment.material) oldSegment.material.dispose();
+        if (Array.isArray(oldSegment.material)) oldSegment.material.forEach(material => material.dispose());
+        else if (oldSegment.material) oldSegment.material.dispose();
     }
+}
 
-    if (!centerlinePoints || centerlinePoints.length < 2 || !profileData) {
+// Tự động điều chỉnh camera theo các đối tượng trong tubeGroup
+function fitCameraToTube() {
+    if (tubeGroup.children.length > 0) {
+        const boundingBox = new THREE.Box3().setFromObject(tubeGroup);
+        const center = new THREE.Vector3();
+        const size = new THREE.Vector3();
+        boundingBox.getCenter(center);
+        boundingBox.getSize(size);
+
+        const maxDim = Math.max(size.x, size.y, size.z);
+        const fov = camera.fov * (Math.PI / 180);
+        let cameraDistance = Math.abs(maxDim / 2 / Math.tan(fov / 2));
+        cameraDistance *= 1.8; 
+
+        const direction = new THREE.Vector3();
+        camera.getWorldDirection(direction);
+        camera.position.copy(center).addScaledVector(direction.multiplyScalar(-1), cameraDistance);
+        if (camera.position.y < size.y * 0.2 + center.y) {
+            camera.position.y = size.y * 0.2 + center.y + 20;
+        }
+        controls.target.copy(center);
+        controls.update();
+        showMessage("Tạo biên dạng 3D thành công!", "success");
+    } else {
+        showMessage("Không có gì để vẽ hoặc dữ liệu không hợp lệ.", "error");
+    }
+}
+
+// Vẽ lưới bề mặt do server tạo: một BufferGeometry duy nhất, mỗi đoạn là một group chọn vật liệu theo loại đoạn.
+// Chỉ số của dải giữa điểm i và i + 1 nằm ở [6 * ringEdges * i, 6 * ringEdges * (i + 1)), xem api/YBC3D_mesh.py
+function drawTubeMesh(mesh, segmentInfo) {
+    clearTubeGroup();
+    if (!mesh || mesh.indices.length === 0) {
+        showMessage("Dữ liệu không đủ hoặc không hợp lệ để vẽ biên dạng.");
+        return;
+    }
+
+    const indicesPerBand = 6 * mesh.ringEdges;
+    const groups = [];
+    if (segmentInfo && segmentInfo.length > 0) {
+        segmentInfo.forEach(segment => {
+            groups.push({
+                start: segment.start_idx * indicesPerBand,
+                count: (segment.end_idx - segment.start_idx) * indicesPerBand,
+                materialIndex: segmentMaterialIndex(segment)
+            });
+        });
+    } else {
+        groups.push({ start: 0, count: mesh.indices.length, materialIndex: 2 });
+    }
+
+    tubeGroup.add(createTubeMeshObject(mesh, groups));
+    fitCameraToTube();
+}
+
+// Chỉ số vật liệu trong createTubeMeshObject theo loại đoạn
+function segmentMaterialIndex(segment) {
+    return segment.type === 'Y' ? 0 : (segment.type === 'B' ? 1 : 2);
+}
+
+// Một THREE.Mesh từ lưới có chỉ số; groups là các khoảng chỉ số { start, count, materialIndex }
+function createTubeMeshObject(mesh, groups) {
+    const geometry = new THREE.BufferGeometry();
+    geometry.setAttribute('position', new THREE.BufferAttribute(mesh.vertices, 3));
+    geometry.setAttribute('normal', new THREE.BufferAttribute(mesh.normals, 3));
+    geometry.setIndex(new THREE.BufferAttribute(mesh.indices, 1));
+    groups.forEach(group => geometry.addGroup(group.start, group.count, group.materialIndex));
+
+    const materials = [
+        new THREE.MeshPhongMaterial({ color: STRAIGHT_SEGMENT_COLOR, side: THREE.DoubleSide }),
+        new THREE.MeshPhongMaterial({ color: BENT_SEGMENT_COLOR, side: THREE.DoubleSide }),
+        new THREE.MeshPhongMaterial({ color: DEFAULT_TUBE_COLOR, side: THREE.DoubleSide })
+    ];
+    return new THREE.Mesh(geometry, materials);
+}
+
+// Một THREE.Mesh cho các dòng NDJSON { segment, points, normals, binormals } nhận được trong một lần đọc
+function createStreamedSegmentsObject(segmentLines, profileData) {
+    const segmentMeshes = segmentLines.map(line => sweepProfileAlongFrames(
+        line.points, flattenPointVectors(line.normals), flattenPointVectors(line.binormals), profileData));
+    const numVertexValues = segmentMeshes.reduce((total, mesh) => total + mesh.vertices.length, 0);
+    const numIndices = segmentMeshes.reduce((total, mesh) => total + mesh.indices.length, 0);
+    const vertices = new Float32Array(numVertexValues);
+    const normals = new Float32Array(numVertexValues);
+    const indices = new Uint32Array(numIndices);
+    const groups = [];
+    let vertexValueOffset = 0;
+    let indexOffset = 0;
+    segmentMeshes.forEach((mesh, k) => {
+        vertices.set(mesh.vertices, vertexValueOffset);
+        normals.set(mesh.normals, vertexValueOffset);
+        const firstVertex = vertexValueOffset / 3;
+        for (let i = 0; i < mesh.indices.length; i++) {
+            indices[indexOffset + i] = mesh.indices[i] + firstVertex;
+        }
+        groups.push({ start: indexOffset, count: mesh.indices.length, materialIndex: segmentMaterialIndex(segmentLines[k].segment) });
+        vertexValueOffset += mesh.vertices.length;
+        indexOffset += mesh.indices.length;
+    });
+    return createTubeMeshObject({ vertices, normals, indices }, groups);
+}
+
+// Chương trình dài: nhận phản hồi NDJSON (xem iter_ndjson_lines trong api/index.py) và vẽ dần từng phần khi dữ liệu đến
+async function streamTubeGeometry(requestBody, profileData) {
+    const response = await fetch('/api/calculate_tube', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Accept': 'application/x-ndjson' },
+        body: requestBody,
+    });
+    if (!response.ok) {
+        const result = await response.json();
+        throw new Error(result.error || `Lỗi HTTP: ${response.status} ${response.statusText}`);
+    }
+    clearTubeGroup();
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let pending = '';
+    let numSegments = 0;
+    while (true) {
+        const { done, value } = await reader.read();
+        if (value) pending += decoder.decode(value, { stream: true });
+        const lines = pending.split('\n');
+        pending = done ? '' : lines.pop(); // Dòng cuối có thể chưa nhận đủ
+        const segmentLines = [];
+        for (const line of lines) {
+            if (!line) continue;
+            const message = JSON.parse(line);
+            if (message.error) throw new Error(message.error);
+            if (message.segment) segmentLines.push(message);
+        }
+        if (segmentLines.length > 0) {
+            tubeGroup.add(createStreamedSegmentsObject(segmentLines, profileData));
+            if (numSegments === 0) fitCameraToTube(); // Hiển thị phần đầu ngay khi nhận được
+            numSegments += segmentLines.length;
+            showMessage(`Đang nhận dữ liệu: ${numSegments} đoạn...`, "success");
+        }
+        if (done) break;
+    }
+    fitCameraToTube();
+}
+
+// Mặt cắt biên dạng trong hệ (normal, binormal) của điểm, giống profile_cross_section trong api/YBC3D_mesh.py:
+// offsets/normals là các cặp [u, v], edges là các cặp chỉ số đỉnh (ngược chiều kim đồng hồ)
+function profileCrossSection(profileData, radialSegments = 16) {
+    const { type, dimensions } = profileData;
+    if (type === 'round') {
+        const radius = dimensions.diameter / 2;
+        const offsets = [], normals = [], edges = [];
+        for (let k = 0; k < radialSegments; k++) {
+            const angle = 2 * Math.PI * k / radialSegments;
+            normals.push([Math.cos(angle), Math.sin(angle)]);
+            offsets.push([radius * Math.cos(angle), radius * Math.sin(angle)]);
+            edges.push([k, (k + 1) % radialSegments]);
+        }
+        return { offsets, normals, edges };
+    }
+    const halfWidth = (type === 'square' ? dimensions.side : dimensions.width) / 2; // Dọc theo binormal
+    const halfHeight = (type === 'square' ? dimensions.side : dimensions.height) / 2; // Dọc theo normal
+    const corners = [[halfHeight, -halfWidth], [halfHeight, halfWidth], [-halfHeight, halfWidth], [-halfHeight, -halfWidth]];
+    const faceNormals = [[1, 0], [0, 1], [-1, 0], [0, -1]];
+    const offsets = [], normals = [], edges = [];
+    for (let f = 0; f < 4; f++) { // Mỗi mặt có 2 đỉnh riêng để pháp tuyến phẳng
+        offsets.push(corners[f], corners[(f + 1) % 4]);
+        normals.push(faceNormals[f], faceNormals[f]);
+        edges.push([2 * f, 2 * f + 1]);
+    }
+    return { offsets, normals, edges };
+}
+
+// Đặt mặt cắt tại từng điểm theo khung do server trả về (không cần spline hay Frenet frames),
+// tạo lưới cùng bố cục với lưới của server để vẽ bằng drawTubeMesh
+function sweepProfileAlongFrames(centerlinePoints, pointNormals, pointBinormals, profileData) {
+    const section = profileCrossSection(profileData);
+    const numPoints = centerlinePointCount(centerlinePoints);
+    const ringVertices = section.offsets.length;
+    const ringEdges = section.edges.length;
+    const vertices = new Float32Array(numPoints * ringVertices * 3);
+    const normals = new Float32Array(numPoints * ringVertices * 3);
+    for (let i = 0; i < numPoints; i++) {
+        const p = centerlinePointAt(centerlinePoints, i);
+        for (let k = 0; k < ringVertices; k++) {
+            const [u, v] = section.offsets[k];
+            const [nu, nv] = section.normals[k];
+            const base = (i * ringVertices + k) * 3;
+            for (let axis = 0; axis < 3; axis++) {
+                const n = pointNormals[3 * i + axis];
+                const b = pointBinormals[3 * i + axis];
+                vertices[base + axis] = p.getComponent(axis) + u * n + v * b;
+                normals[base + axis] = nu * n + nv * b;
+            }
+        }
+    }
+    const indices = new Uint32Array(Math.max(numPoints - 1, 0) * ringEdges * 6);
+    let cursor = 0;
+    for (let i = 0; i + 1 < numPoints; i++) {
+        const ringStart = i * ringVertices;
+        section.edges.forEach(([edgeA, edgeB]) => {
+            const a = ringStart + edgeA, b = ringStart + edgeB;
+            indices.set([a, b, b + ringVertices, a, b + ringVertices, a + ringVertices], cursor);
+            cursor += 6;
+        });
+    }
+    return { vertices, normals, indices, ringVertices, ringEdges };
+}
+
+// Khung trong kết quả JSON (mảng lồng) được chuyển sang mảng phẳng như định dạng nhị phân
+function flattenPointVectors(vectors) {
+    if (!vectors || ArrayBuffer.isView(vectors)) return vectors || null;
+    const flat = new Float32Array(vectors.length * 3);
+    vectors.forEach((vector, i) => flat.set(vector, 3 * i));
+    return flat;
+}
+
+// Vẽ kết quả đã giải mã: dùng lưới của server nếu có, ngược lại dựng hình học từ đường tâm (và khung nếu có)
+function drawTubeResult(decoded, profileData) {
+    if (decoded.mesh) {
+        drawTubeMesh(decoded.mesh, decoded.segmentInfo);
+    } else {
+        drawProfileGeometry(decoded.centerlinePoints, decoded.segmentInfo, profileData, decoded.pointNormals, decoded.pointBinormals);
+    }
+}
+
+// Hàm vẽ biên dạng (thay thế hàm drawTube cũ)
+// pointNormals/pointBinormals (tùy chọn): khung tại từng điểm do server trả về ('frames': true)
+function drawProfileGeometry(centerlinePoints, segmentInfo, profileData, pointNormals = null, pointBinormals = null) {
+    if (pointNormals && pointBinormals && profileData && centerlinePoints && centerlinePointCount(centerlinePoints) >= 2) {
+        // Có khung: đặt mặt cắt trực tiếp tại từng điểm, không dựng CatmullRomCurve3/ExtrudeGeometry
+        drawTubeMesh(sweepProfileAlongFrames(centerlinePoints, pointNormals, pointBinormals, profileData), segmentInfo);
+        return;
+    }
+    clearTubeGroup();
+
+    if (!centerlinePoints || centerlinePointCount(centerlinePoints) < 2 || !profileData) {
         showMessage("Dữ liệu không đủ hoặc không hợp lệ để vẽ biên dạng.");
         console.error("Dữ liệu không đủ:", { centerlinePoints, profileData });
         return;
@@ -147,7 +651,10 @@ function drawProfileGeometry(centerlinePoints, segmentInfo, profileData) {
         // Trường hợp không có segmentInfo (ít khi xảy ra nếu backend hoạt động đúng)
         // Vẽ toàn bộ đường tâm bằng một hình học duy nhất
         console.warn("Không có thông tin segmentInfo, vẽ toàn bộ đường bằng một hình học.");
-        const pointsVec3 = centerlinePoints.map(p => new THREE.Vector3(p[0], p[1], p[2]));
+        const pointsVec3 = [];
+        for (let i = 0; i < centerlinePointCount(centerlinePoints); i++) {
+            pointsVec3.push(centerlinePointAt(centerlinePoints, i));
+        }
         if (pointsVec3.length < 2) {
              showMessage("Cần ít nhất 2 điểm để vẽ đường."); return;
         }
@@ -190,9 +697,10 @@ function drawProfileGeometry(centerlinePoints, segmentInfo, profileData) {
         // Vẽ từng đoạn ống với màu và hình dạng tương ứng
         segmentInfo.forEach(segment => {
             const segmentPoints = [];
+            const numCenterlinePoints = centerlinePointCount(centerlinePoints);
             for (let i = segment.start_idx; i <= segment.end_idx; i++) {
-                if (centerlinePoints[i]) {
-                    segmentPoints.push(new THREE.Vector3(centerlinePoints[i][0], centerlinePoints[i][1], centerlinePoints[i][2]));
+                if (i < numCenterlinePoints) {
+                    segmentPoints.push(centerlinePointAt(centerlinePoints, i));
                 }
             }
 
@@ -237,11 +745,8 @@ function drawProfileGeometry(centerlinePoints, segmentInfo, profileData) {
                     
                     // QUAN TRỌNG: Định hướng của ExtrudeGeometry
                     // Three.js sẽ cố gắng tính toán Frenet frames.
-                    // Để có định hướng chính xác hơn, đặc biệt sau các phép xoay C,
-                    // backend lý tưởng nên cung cấp vector "up" (hoặc pháp tuyến của mặt phẳng uốn)
-                    // cho mỗi điểm trên đường tâm. Sau đó, có thể dùng THREE.Path.getSpacedPoints()
-                    // cùng với các vector up đó để tạo custom frames cho extrudeSettings.frames.
-                    // Hiện tại, chúng ta dựa vào tính toán mặc định của Three.js.
+                    // Để có định hướng chính xác, đặc biệt sau các phép xoay C, yêu cầu 'frames' từ backend:
+                    // khi có khung tại từng điểm, hàm này dùng sweepProfileAlongFrames thay cho nhánh này.
                     geometry = new THREE.ExtrudeGeometry(shape, currentExtrudeSettings);
                 }
             }
@@ -254,30 +759,7 @@ function drawProfileGeometry(centerlinePoints, segmentInfo, profileData) {
     }
     
     // Tự động điều chỉnh camera (giữ nguyên logic)
-    if (tubeGroup.children.length > 0) {
-        const boundingBox = new THREE.Box3().setFromObject(tubeGroup);
-        const center = new THREE.Vector3();
-        const size = new THREE.Vector3();
-        boundingBox.getCenter(center);
-        boundingBox.getSize(size);
-
-        const maxDim = Math.max(size.x, size.y, size.z);
-        const fov = camera.fov * (Math.PI / 180);
-        let cameraDistance = Math.abs(maxDim / 2 / Math.tan(fov / 2));
-        cameraDistance *= 1.8; 
-
-        const direction = new THREE.Vector3();
-        camera.getWorldDirection(direction);
-        camera.position.copy(center).addScaledVector(direction.multiplyScalar(-1), cameraDistance);
-        if (camera.position.y < size.y * 0.2 + center.y) {
-            camera.position.y = size.y * 0.2 + center.y + 20;
-        }
-        controls.target.copy(center);
-        controls.update();
-        showMessage("Tạo biên dạng 3D thành công!", "success");
-    } else {
-        showMessage("Không có gì để vẽ hoặc dữ liệu không hợp lệ.", "error");
-    }
+    fitCameraToTube();
 }
 
 
@@ -361,18 +843,66 @@ async function handleGenerateTube() {
             type: profileType,
             dimensions: profileDimensions
         },
-        YBC: ybcrData
+        YBC: ybcrData,
+        mesh: true // Lưới bề mặt được tạo (và cache) ở server, client chỉ tải lên một BufferGeometry
+        // frames: true // Hoặc chỉ nhận khung tại từng điểm và đặt mặt cắt ở client (thay cho mesh)
         // NumArcPoints: 30 // Có thể thêm nếu muốn tùy chỉnh
+        // ArcTolerance: 0.1 // Hoặc chia lưới thích ứng: độ lệch dây cung tối đa (mm) thay cho số điểm cố định
     };
+    const largeProgram = ybcrData.length >= LARGE_PROGRAM_ROW_THRESHOLD;
+    if (largeProgram) {
+        payload.DecimateTolerance = LARGE_PROGRAM_DECIMATE_TOLERANCE; // Bỏ các điểm cung gần dây cung, giảm bộ nhớ trình duyệt
+    }
 
     showMessage("Đang gửi dữ liệu đến server...", "success");
 
     try {
-        const response = await fetch('/api/calculate_tube', {
+        if (ybcrData.length >= STREAM_ROW_THRESHOLD) {
+            // Chương trình rất dài: server gửi từng đoạn kèm khung, client đặt mặt cắt và vẽ ngay khi nhận
+            lastTubeResult = null;
+            await streamTubeGeometry(JSON.stringify({
+                profile: payload.profile, YBC: ybcrData, frames: true, DecimateTolerance: payload.DecimateTolerance
+            }), payload.profile);
+            return;
+        }
+        // Yêu cầu định dạng nhị phân; lỗi vẫn được trả về dưới dạng JSON
+        const requestBody = JSON.stringify(payload);
+        const headers = { 'Content-Type': 'application/json', 'Accept': 'application/octet-stream' };
+        const cachedResult = lastTubeResult && lastTubeResult.requestBody === requestBody ? lastTubeResult : null;
+        if (cachedResult && cachedResult.etag) {
+            headers['If-None-Match'] = cachedResult.etag; // Server trả 304 nếu kết quả không đổi
+        }
+        const previousResult = lastTubeResult;
+        const response = await fetch(largeProgram ? '/api/calculate_tube?precision=int16' : '/api/calculate_tube', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload),
+            headers: headers,
+            body: JSON.stringify({
+                ...payload,
+                program_id: programId,
+                base_revision: previousResult ? previousResult.revision : null
+            }),
         });
+        if (response.status === 304 && cachedResult) {
+            drawTubeResult(cachedResult.decoded, payload.profile);
+            return;
+        }
+        const contentType = response.headers.get('Content-Type') || '';
+        if (response.ok && contentType.startsWith('application/octet-stream')) {
+            const tail = decodeBinaryCenterline(await response.arrayBuffer());
+            const revisionHeader = response.headers.get('X-YBC-Revision');
+            const pointOffset = parseInt(response.headers.get('X-YBC-Point-Offset') || '0', 10);
+            const segmentOffset = parseInt(response.headers.get('X-YBC-Segment-Offset') || '0', 10);
+            const decoded = mergeIncrementalCenterline(previousResult && previousResult.decoded, tail, pointOffset, segmentOffset,
+                                                       suffixFromHeaders(response.headers));
+            lastTubeResult = {
+                requestBody,
+                etag: response.headers.get('ETag'),
+                revision: revisionHeader, // Hash nội dung do server cấp, gửi lại nguyên dạng
+                decoded
+            };
+            drawTubeResult(decoded, payload.profile);
+            return;
+        }
         const result = await response.json();
 
         if (!response.ok) {
@@ -385,7 +915,10 @@ async function handleGenerateTube() {
 
         // Backend nên trả về cả centerline_points, segment_info, và profile (để xác nhận)
         if (result.centerline_points && result.segment_info && result.profile) {
-            drawProfileGeometry(result.centerline_points, result.segment_info, result.profile);
+            drawTubeResult({
+                centerlinePoints: result.centerline_points, segmentInfo: result.segment_info, mesh: meshFromJson(result.mesh),
+                pointNormals: flattenPointVectors(result.point_normals), pointBinormals: flattenPointVectors(result.point_binormals)
+            }, result.profile);
         } else {
             console.error("Kết quả từ server không hợp lệ:", result);
             showMessage("Kết quả từ server không chứa đủ thông tin (centerline_points, segment_info, profile).");
@@ -394,12 +927,7 @@ async function handleGenerateTube() {
     } catch (error) {
         console.error('Lỗi khi gửi yêu cầu hoặc xử lý kết quả:', error);
         showMessage('Không thể tạo biên dạng: ' + error.message, 'error');
-        while (tubeGroup.children.length > 0) { // Xóa hình cũ nếu lỗi
-            const oldSegment = tubeGroup.children[0];
-            tubeGroup.remove(oldSegment);
-            if (oldSegment.geometry) oldSegment.geometry.dispose();
-            if (oldSegment.material) oldSegment.material.dispose();
-        }
+        clearTubeGroup(); // Xóa hình cũ nếu lỗi
     }
 }
 